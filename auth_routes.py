@@ -1,23 +1,29 @@
-from fastapi import APIRouter,status,Depends
+from fastapi import APIRouter,status,Depends,Query
 from fastapi.exceptions import HTTPException
-from database import Session,engine
-from schemas import SignUpModel,LoginModel
+from database import get_db,pool_stats
+from schemas import SignUpModel,LoginModel,UserResponseModel,TokenPairModel,AccessTokenModel
 from models import User
+from sqlalchemy import select,or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.exceptions import HTTPException
 from fastapi_jwt_auth import AuthJWT
-from werkzeug.security import generate_password_hash , check_password_hash
-from fastapi.encoders import jsonable_encoder
+from passwords import hash_password,verify_password,HashingPoolBusy
+import cache
+from cache import user_cache
+from crud import get_cached_user,username_available
+from fastapi.responses import ORJSONResponse
+from query_budget import query_budget
 
 
 auth_router=APIRouter(
     prefix='/auth',
-    tags=['auth']
+    tags=['auth'],
+    default_response_class=ORJSONResponse
 
 )
 
 
-session=Session(bind=engine)
-
 @auth_router.get('/')
 async def hello(Authorize:AuthJWT=Depends()):
 
@@ -37,9 +43,11 @@ async def hello(Authorize:AuthJWT=Depends()):
 
 
 @auth_router.post('/signup',
-    status_code=status.HTTP_201_CREATED
+    status_code=status.HTTP_201_CREATED,
+    responses={status.HTTP_201_CREATED:{"model":UserResponseModel}}
 )
-async def signup(user:SignUpModel):
+@query_budget(2)
+async def signup(user:SignUpModel,session:AsyncSession=Depends(get_db)):
     """
         ## Create a user
         This requires the following
@@ -55,40 +63,82 @@ async def signup(user:SignUpModel):
     """
 
 
-    db_email=session.query(User).filter(User.email==user.email).first()
-
-    if db_email is not None:
-        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User with the email already exists"
-        )
-
-    db_username=session.query(User).filter(User.username==user.username).first()
+    #hash before touching the database, so no connection waits on it
+    try:
+        password=await hash_password(user.password)
 
-    if db_username is not None:
-        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User with the username already exists"
+    except HashingPoolBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, try again later",
+            headers={"Retry-After":"1"}
         )
 
     new_user=User(
         username=user.username,
         email=user.email,
-        password=generate_password_hash(user.password),
+        password=password,
         is_active=user.is_active,
         is_admin=user.is_admin
     )
 
     session.add(new_user)
 
-    session.commit()
+    #the unique constraints on email and username reject duplicates, even concurrent ones
+    try:
+        await session.commit()
+
+    except IntegrityError:
+        await session.rollback()
+
+        #the committed users tell which of the two was taken, not the driver's message
+        taken=(await session.execute(
+            select(User.username,User.email).where(or_(User.username==user.username,User.email==user.email))
+        )).all()
+
+        if any(email==user.email for _,email in taken):
+            detail="User with the email already exists"
+        elif any(username==user.username for username,_ in taken):
+            detail="User with the username already exists"
+        else:
+            detail="Invalid user"
+
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail=detail)
+
+    cache.username_filter.add(new_user.username)
+    user_cache.invalidate(new_user.username)
+
+    response={
+        "id":new_user.id,
+        "username":new_user.username,
+        "email":new_user.email,
+        "is_admin":new_user.is_admin,
+        "is_active":new_user.is_active
+    }
 
-    return new_user
+    return ORJSONResponse(response,status_code=status.HTTP_201_CREATED)
+
+
+
+@auth_router.get('/available')
+@query_budget(2)
+async def check_username(username:str=Query(...,min_length=1,max_length=25),session:AsyncSession=Depends(get_db)):
+    """
+        ## Check if a username is free
+        This answers from an in-memory Bloom filter of the taken usernames and only
+        queries the database when the filter reports a possible match. The filter
+        catches up with users signed up on other processes every USERNAME_FILTER_SYNC
+        seconds; signup still enforces uniqueness, so the answer is advisory.
+    """
+
+    return {"username":username,"available":await username_available(session,username)}
 
 
 
 #login route
 
-@auth_router.post('/login',status_code=200)
-async def login(user:LoginModel,Authorize:AuthJWT=Depends()):
+@auth_router.post('/login',status_code=200,response_model=TokenPairModel)
+@query_budget(1)
+async def login(user:LoginModel,Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
     """     
         ## Login a user
         This requires
@@ -98,9 +148,20 @@ async def login(user:LoginModel,Authorize:AuthJWT=Depends()):
             ```
         and returns a token pair `access` and `refresh`
     """
-    db_user=session.query(User).filter(User.username==user.username).first()
+    db_user=await session.scalar(select(User).where(User.username==user.username))
 
-    if db_user and check_password_hash(db_user.password, user.password):
+    await session.close()
+
+    try:
+        valid=db_user is not None and await verify_password(db_user.password, user.password)
+
+    except HashingPoolBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, try again later",
+            headers={"Retry-After":"1"}
+        )
+
+    if valid:
         access_token=Authorize.create_access_token(subject=db_user.username)
         refresh_token=Authorize.create_refresh_token(subject=db_user.username)
 
@@ -109,7 +170,7 @@ async def login(user:LoginModel,Authorize:AuthJWT=Depends()):
             "refresh":refresh_token
         }
 
-        return jsonable_encoder(response)
+        return ORJSONResponse(response)
 
     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
         detail="Invalid Username Or Password"
@@ -119,7 +180,7 @@ async def login(user:LoginModel,Authorize:AuthJWT=Depends()):
 
 #refreshing tokens
 
-@auth_router.get('/refresh')
+@auth_router.get('/refresh',response_model=AccessTokenModel)
 async def refresh_token(Authorize:AuthJWT=Depends()):
     """
     ## Create a fresh token
@@ -140,5 +201,57 @@ async def refresh_token(Authorize:AuthJWT=Depends()):
     
     access_token=Authorize.create_access_token(subject=current_user)
 
-    return jsonable_encoder({"access":access_token})
+    return ORJSONResponse({"access":access_token})
+
+
+
+@auth_router.get('/cache/stats')
+async def user_cache_stats(Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
+    """
+        ## User cache statistics
+        This returns the size and hit/miss counters of the authenticated-user cache
+        and the state of the username filter. It can be accessed by admins only
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None or not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="You are not an admin"
+        )
+
+    return {**user_cache.stats(),"username_filter":cache.username_filter.stats()}
+
+
+@auth_router.get('/db/stats')
+async def database_pool_stats(Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
+    """
+        ## Database pool statistics
+        This returns the usage of the write pool and of the read-only analytics pool.
+        It can be accessed by admins only
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None or not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="You are not an admin"
+        )
 
+    return pool_stats()
@@ -0,0 +1,248 @@
+"""
+    API load benchmark
+
+    Seeds a throwaway SQLite database with users and exercises, then drives every
+    main endpoint through the in-process client, one scenario after the other, at
+    a fixed concurrency. Prints throughput and latency percentiles per scenario as
+    JSON, so runs can be compared across commits. Needs no network.
+
+        python -m benchmarks.api_load --requests 500 --concurrency 20
+        python -m benchmarks.api_load --scenarios login,create,mine --output run.json
+
+    Logins and signups hash passwords at PASSWORD_HASH_ITERATIONS, lower it to
+    focus on the rest of the stack.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime,timedelta
+from sqlalchemy.ext.asyncio import AsyncSession
+from benchmarks.common import setup_database,client,percentiles
+from benchmarks.index_layout import make_rows
+from crud import insert_exercises
+from leaderboard import leaderboard
+from series_cache import series_cache
+from models import Exercise
+
+
+EXERCISE_NAMES=[code for code,_ in Exercise.EXERCISES_TYPES]
+INTENSITY_LEVELS=[code for code,_ in Exercise.INTENSITY_LEVELS]
+
+
+def exercise_payload(rng):
+    return {
+        "date":(datetime.now()-timedelta(minutes=rng.randrange(60*24*60))).isoformat(timespec="seconds"),
+        "exercise_name":rng.choice(EXERCISE_NAMES),
+        "sets":rng.randint(1,6),
+        "repetitions":rng.randint(5,20),
+        "weight_lifted":round(rng.uniform(0,120),1),
+        "distance_covered":round(rng.uniform(0,10),2),
+        "calories_burned":round(rng.uniform(10,600),1),
+        "intensity_level":rng.choice(INTENSITY_LEVELS),
+    }
+
+
+class Context:
+    """
+        Seeded users and their tokens, shared by the scenarios
+    """
+
+    def __init__(self,rng,users,exercises,batch_size):
+        self.rng=rng
+        self.users=users
+        self.exercises=exercises
+        self.batch_size=batch_size
+        self.tokens={}
+        self.signups=0
+
+    def user(self):
+        return self.rng.randint(1,self.users)
+
+    def headers(self,user_id=None):
+        return {"Authorization":f"Bearer {self.tokens[user_id or self.user()]['access']}"}
+
+
+def signup(c,ctx):
+    ctx.signups+=1
+    username=f"new{ctx.signups}"
+
+    return c.post('/auth/signup',json={"username":username,"email":f"{username}@bench.local","password":"password"})
+
+
+def login(c,ctx):
+    return c.post('/auth/login',json={"username":f"user{ctx.user()}","password":"password"})
+
+
+def refresh(c,ctx):
+    return c.get('/auth/refresh',headers={"Authorization":f"Bearer {ctx.tokens[ctx.user()]['refresh']}"})
+
+
+def create(c,ctx):
+    return c.post('/exercises/exercise',headers=ctx.headers(),json=exercise_payload(ctx.rng))
+
+
+def batch(c,ctx):
+    return c.post('/exercises/batch',headers=ctx.headers(),json=[exercise_payload(ctx.rng) for _ in range(ctx.batch_size)])
+
+
+def update(c,ctx):
+    return c.put(f'/exercises/exercise/update/{ctx.rng.randint(1,ctx.exercises)}/',headers=ctx.headers(),json={
+        "date":datetime.now().isoformat(timespec="seconds"),
+        "exercise_name":ctx.rng.choice(EXERCISE_NAMES),
+        "sets":ctx.rng.randint(1,6)
+    })
+
+
+def read(path,**params):
+    def request(c,ctx):
+        return c.get(path,headers=ctx.headers(),params=params)
+
+    return request
+
+
+SCENARIOS={
+    "signup":signup,
+    "login":login,
+    "refresh":refresh,
+    "create":create,
+    "batch":batch,
+    "update":update,
+    "mine":read('/exercises/mine'),
+    "summary":read('/exercises/summary',period="month"),
+    "daily":read('/exercises/daily'),
+    "records":read('/exercises/records'),
+    "trends":read('/exercises/trends'),
+    "leaderboard":read('/exercises/leaderboard'),
+    "export":read('/exercises/export',format="ndjson"),
+}
+
+
+async def seed(engine,c,ctx,seed_value):
+    #one at a time, so user{n} gets id n
+    for user_id in range(1,ctx.users+1):
+        username=f"user{user_id}"
+        await c.post('/auth/signup',json={"username":username,"email":f"{username}@bench.local","password":"password"})
+        response=await c.post('/auth/login',json={"username":username,"password":"password"})
+        ctx.tokens[user_id]=response.json()
+
+    async with AsyncSession(engine) as session:
+        await insert_exercises(session,make_rows(ctx.exercises,ctx.users,seed_value))
+        await session.commit()
+
+    await leaderboard.rebuild()
+
+
+async def run_scenario(c,ctx,scenario,requests,concurrency):
+    semaphore=asyncio.Semaphore(concurrency)
+    latencies=[]
+    statuses={}
+
+    async def one():
+        async with semaphore:
+            start=time.perf_counter()
+            response=await scenario(c,ctx)
+            latencies.append(time.perf_counter()-start)
+            statuses[response.status_code]=statuses.get(response.status_code,0)+1
+
+    started=time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed=time.perf_counter()-started
+
+    return {
+        "requests":requests,
+        "errors":sum(count for status,count in statuses.items() if status>=400),
+        "statuses":statuses,
+        "elapsed_s":round(elapsed,3),
+        "throughput_rps":round(requests/elapsed,2),
+        "latency":percentiles(latencies),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git","rev-parse","--short","HEAD"],capture_output=True,text=True,check=True).stdout.strip()
+
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+
+async def run(scenarios,requests,concurrency,users,exercises,batch_size,seed_value):
+    engine,path=await setup_database()
+    series_root=tempfile.mkdtemp(prefix="bench-series-")
+    series_cache.root=series_root
+
+    try:
+        async with client() as c:
+            ctx=Context(random.Random(seed_value),users,exercises,batch_size)
+
+            started=time.perf_counter()
+            await seed(engine,c,ctx,seed_value)
+            seeded=time.perf_counter()-started
+
+            results={}
+
+            for name in scenarios:
+                results[name]=await run_scenario(c,ctx,SCENARIOS[name],requests,concurrency)
+
+        return {
+            "meta":{
+                "commit":git_commit(),
+                "python":sys.version.split()[0],
+                "platform":platform.platform(),
+                "timestamp":datetime.now().isoformat(timespec="seconds"),
+                "requests":requests,
+                "concurrency":concurrency,
+                "users":users,
+                "exercises":exercises,
+                "batch_size":batch_size,
+                "seed":seed_value,
+                "password_hash_iterations":int(os.getenv("PASSWORD_HASH_ITERATIONS","600000")),
+                "seed_s":round(seeded,3),
+            },
+            "scenarios":results,
+        }
+
+    finally:
+        await engine.dispose()
+        os.remove(path)
+        shutil.rmtree(series_root,ignore_errors=True)
+
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios",default=",".join(SCENARIOS),help="comma separated, in the order they run")
+    parser.add_argument("--requests",type=int,default=200,help="requests per scenario")
+    parser.add_argument("--concurrency",type=int,default=20)
+    parser.add_argument("--users",type=int,default=50)
+    parser.add_argument("--exercises",type=int,default=50000,help="exercises seeded across the users")
+    parser.add_argument("--batch-size",type=int,default=100)
+    parser.add_argument("--seed",type=int,default=42)
+    parser.add_argument("--output",default=None,help="also write the JSON report to this file")
+    args=parser.parse_args()
+
+    scenarios=[name for name in args.scenarios.split(",") if name]
+    unknown=[name for name in scenarios if name not in SCENARIOS]
+
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    report=asyncio.run(run(scenarios,args.requests,args.concurrency,args.users,args.exercises,args.batch_size,args.seed))
+    text=json.dumps(report,indent=2)
+
+    if args.output:
+        with open(args.output,"w") as output:
+            output.write(text+"\n")
+
+    print(text)
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+    Auth overhead benchmark
+
+    Measures what a protected request pays for its token, with the stock AuthJWT
+    and with CachedAuthJWT: first the bare verification done by a handler
+    (jwt_required + get_jwt_subject), then whole requests to `/exercises/`.
+
+        python -m benchmarks.auth_overhead --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import timeit
+from fastapi_jwt_auth import AuthJWT
+from starlette.requests import Request
+from jwt_cache import CachedAuthJWT,claims_cache
+from main import app
+from benchmarks.common import setup_database,client,signup_and_login,percentiles
+
+
+def verification_cost(auth_class,token,repeat):
+    scope={"type":"http","headers":[(b"authorization",f"Bearer {token}".encode())]}
+
+    def handler_checks():
+        Authorize=auth_class(req=Request(scope))
+        Authorize.jwt_required()
+        Authorize.get_jwt_subject()
+
+    handler_checks()
+
+    return min(timeit.repeat(handler_checks,number=100,repeat=repeat))/100
+
+
+async def request_latency(c,headers,requests):
+    latencies=[]
+
+    for _ in range(requests):
+        started=time.perf_counter()
+        await c.get('/exercises/',headers=headers)
+        latencies.append(time.perf_counter()-started)
+
+    return percentiles(latencies)
+
+
+async def run(requests):
+    engine,path=await setup_database()
+
+    try:
+        async with client() as c:
+            headers=await signup_and_login(c,"auth")
+            token=headers["Authorization"].split()[1]
+
+            report={
+                "verification_us":{
+                    "AuthJWT":round(verification_cost(AuthJWT,token,20)*1e6,2),
+                    "CachedAuthJWT":round(verification_cost(CachedAuthJWT,token,20)*1e6,2)
+                }
+            }
+
+            app.dependency_overrides[AuthJWT]=AuthJWT
+            stock=await request_latency(c,headers,requests)
+
+            app.dependency_overrides[AuthJWT]=CachedAuthJWT
+            claims_cache.clear()
+            cached=await request_latency(c,headers,requests)
+
+            report["request_latency"]={"AuthJWT":stock,"CachedAuthJWT":cached}
+            report["claims_cache"]=claims_cache.stats()
+
+        return report
+
+    finally:
+        await engine.dispose()
+        os.remove(path)
+
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests",type=int,default=2000)
+    args=parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args.requests)),indent=2))
+
+
+if __name__=="__main__":
+    main()
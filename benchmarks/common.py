@@ -0,0 +1,107 @@
+"""
+    Helpers shared by the benchmarks. Each run gets a throwaway SQLite database
+    that is wired into `main.app`, and requests go through an in-process ASGI client
+"""
+import os
+import tempfile
+import httpx
+from sqlalchemy.ext.asyncio import create_async_engine,AsyncSession
+from sqlalchemy.orm import sessionmaker
+from database import Base,get_db,get_read_db,configure_sqlite,read_only_url,SQLITE_READ_PRAGMAS
+from main import app
+from ingest import ingestor
+from csv_import import importer
+from leaderboard import leaderboard
+from partitions import exercise_partitions
+from query_budget import watch_engine,QUERY_BUDGET_MODE
+
+
+async def setup_database(path=None,partitioned=False):
+    """
+        Creates the tables in a fresh database file and points `get_db`,
+        `get_read_db` and the background writers and readers at it.
+        With `partitioned` both engines read through the partition router.
+    """
+    if path is None:
+        fd,path=tempfile.mkstemp(suffix=".db",prefix="bench-")
+        os.close(fd)
+
+    engine=configure_sqlite(create_async_engine(f"sqlite+aiosqlite:///{path}",connect_args={"check_same_thread": False}))
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    read_engine=configure_sqlite(
+        create_async_engine(read_only_url(f"sqlite:///{path}"),connect_args={"check_same_thread": False}),
+        SQLITE_READ_PRAGMAS
+    )
+
+    if QUERY_BUDGET_MODE!="off":
+        watch_engine(engine)
+        watch_engine(read_engine)
+
+    if partitioned:
+        exercise_partitions.install(engine)
+        exercise_partitions.install(read_engine)
+
+    factory=sessionmaker(bind=engine,class_=AsyncSession,expire_on_commit=False)
+    read_factory=sessionmaker(bind=read_engine,class_=AsyncSession,expire_on_commit=False)
+
+    async def override_get_db():
+        async with factory() as session:
+            yield session
+
+    async def override_get_read_db():
+        async with read_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_db]=override_get_db
+    app.dependency_overrides[get_read_db]=override_get_read_db
+    ingestor.session_factory=factory
+    importer.session_factory=factory
+    leaderboard.session_factory=factory
+
+    return engine,path
+
+
+def client():
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app),base_url="http://bench")
+
+
+async def signup_and_login(client,username,password="password"):
+    """
+        Creates a user and returns the auth header for it
+    """
+    await client.post('/auth/signup',json={
+        "username":username,
+        "email":f"{username}@bench.local",
+        "password":password,
+        "is_admin":False,
+        "is_active":True
+    })
+
+    response=await client.post('/auth/login',json={"username":username,"password":password})
+
+    return {"Authorization":f"Bearer {response.json()['access']}"}
+
+
+def percentiles(samples):
+    """
+        Summarises latencies given in seconds as milliseconds
+    """
+    ordered=sorted(samples)
+
+    if not ordered:
+        return {}
+
+    def pick(q):
+        return round(ordered[min(len(ordered)-1,int(q*len(ordered)))]*1000,3)
+
+    return {
+        "count":len(ordered),
+        "mean_ms":round(sum(ordered)/len(ordered)*1000,3),
+        "p50_ms":pick(0.50),
+        "p95_ms":pick(0.95),
+        "p99_ms":pick(0.99),
+        "max_ms":round(ordered[-1]*1000,3)
+    }
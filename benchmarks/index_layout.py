@@ -0,0 +1,131 @@
+"""
+    Exercise index layout benchmark
+
+    Loads the same synthetic exercises into two throwaway databases, one with the
+    old single-column indexes and one with the layout declared in models.py, and
+    compares insert throughput and "this user, this date range" query latency.
+
+        python -m benchmarks.index_layout --rows 200000 --users 200
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime,timedelta
+from sqlalchemy import create_engine,insert,select,func
+from database import Base
+from models import Exercise
+from benchmarks.common import percentiles
+
+
+#the indexes models.Exercise declared before the rework
+LEGACY_INDEXES=("id","date","weight_lifted","distance_covered","calories_burned","intensity_level")
+
+BATCH=1000
+
+
+def make_rows(count,users,seed):
+    rng=random.Random(seed)
+    start=datetime(2022,1,1)
+    names=[code for code,_ in Exercise.EXERCISES_TYPES]
+    levels=[code for code,_ in Exercise.INTENSITY_LEVELS]
+
+    return [
+        {
+            "date":start+timedelta(minutes=rng.randrange(3*365*24*60)),
+            "exercise_name":rng.choice(names),
+            "sets":rng.randint(1,6),
+            "repetitions":rng.randint(5,20),
+            "weight_lifted":round(rng.uniform(0,120),1),
+            "distance_covered":round(rng.uniform(0,10),2),
+            "calories_burned":round(rng.uniform(10,600),1),
+            "intensity_level":rng.choice(levels),
+            "user_id":rng.randint(1,users)
+        }
+        for _ in range(count)
+    ]
+
+
+def run_layout(layout,rows,users,queries,seed):
+    fd,path=tempfile.mkstemp(suffix=".db",prefix=f"bench-{layout}-")
+    os.close(fd)
+    engine=create_engine(f"sqlite:///{path}")
+
+    try:
+        Base.metadata.create_all(engine,tables=[Exercise.__table__])
+
+        if layout=="legacy":
+            with engine.begin() as connection:
+                connection.exec_driver_sql("DROP INDEX ix_exercises_user_date_id")
+                for column in LEGACY_INDEXES:
+                    connection.exec_driver_sql(f"CREATE INDEX ix_exercises_{column} ON exercises ({column})")
+
+        started=time.perf_counter()
+
+        for start in range(0,len(rows),BATCH):
+            with engine.begin() as connection:
+                connection.execute(insert(Exercise),rows[start:start+BATCH])
+
+        insert_elapsed=time.perf_counter()-started
+
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ANALYZE")
+
+        rng=random.Random(seed+1)
+        latencies=[]
+
+        with engine.connect() as connection:
+            for _ in range(queries):
+                user_id=rng.randint(1,users)
+                since=datetime(2022,1,1)+timedelta(days=rng.randrange(3*365-30))
+                query=select(Exercise.date,Exercise.calories_burned).where(
+                    Exercise.user_id==user_id,
+                    Exercise.date>=since,
+                    Exercise.date<since+timedelta(days=30)
+                ).order_by(Exercise.date)
+
+                started=time.perf_counter()
+                connection.execute(query).all()
+                latencies.append(time.perf_counter()-started)
+
+            plan=connection.exec_driver_sql(
+                "EXPLAIN QUERY PLAN SELECT date,calories_burned FROM exercises "
+                "WHERE user_id=? AND date>=? AND date<? ORDER BY date",
+                (1,"2023-01-01","2023-02-01")
+            ).all()
+
+        return {
+            "inserts_per_s":round(len(rows)/insert_elapsed),
+            "insert_elapsed_s":round(insert_elapsed,3),
+            "range_query_latency":percentiles(latencies),
+            "range_query_plan":[row[-1] for row in plan],
+            "db_size_bytes":os.path.getsize(path)
+        }
+
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows",type=int,default=200000)
+    parser.add_argument("--users",type=int,default=200)
+    parser.add_argument("--queries",type=int,default=500)
+    parser.add_argument("--seed",type=int,default=7)
+    args=parser.parse_args()
+
+    rows=make_rows(args.rows,args.users,args.seed)
+
+    report={"rows":args.rows,"users":args.users}
+
+    for layout in ("legacy","current"):
+        report[layout]=run_layout(layout,rows,args.users,args.queries,args.seed)
+
+    print(json.dumps(report,indent=2))
+
+
+if __name__=="__main__":
+    main()
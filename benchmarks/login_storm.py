@@ -0,0 +1,85 @@
+"""
+    Login storm benchmark
+
+    Fires many concurrent logins at `/auth/login` while a probe keeps calling an
+    unrelated endpoint, then reports login throughput and the probe latency.
+
+        python -m benchmarks.login_storm --logins 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from benchmarks.common import setup_database,client,signup_and_login,percentiles
+
+
+async def run(logins,concurrency):
+    engine,path=await setup_database()
+
+    try:
+        async with client() as c:
+            headers=await signup_and_login(c,"storm")
+
+            stop=asyncio.Event()
+            probe_latencies=[]
+            login_latencies=[]
+            statuses={}
+
+            async def probe():
+                while not stop.is_set():
+                    start=time.perf_counter()
+                    await c.get('/exercises/',headers=headers)
+                    probe_latencies.append(time.perf_counter()-start)
+                    await asyncio.sleep(0.005)
+
+            semaphore=asyncio.Semaphore(concurrency)
+
+            async def login():
+                async with semaphore:
+                    start=time.perf_counter()
+                    response=await c.post('/auth/login',json={"username":"storm","password":"password"})
+                    login_latencies.append(time.perf_counter()-start)
+                    statuses[response.status_code]=statuses.get(response.status_code,0)+1
+
+            probe_task=asyncio.create_task(probe())
+
+            #baseline latency of the probe before the storm
+            await asyncio.sleep(0.5)
+            baseline=list(probe_latencies)
+            probe_latencies.clear()
+
+            started=time.perf_counter()
+            await asyncio.gather(*(login() for _ in range(logins)))
+            elapsed=time.perf_counter()-started
+
+            stop.set()
+            await probe_task
+
+        return {
+            "logins":logins,
+            "concurrency":concurrency,
+            "elapsed_s":round(elapsed,3),
+            "logins_per_s":round(logins/elapsed,2),
+            "login_statuses":statuses,
+            "login_latency":percentiles(login_latencies),
+            "probe_latency_idle":percentiles(baseline),
+            "probe_latency_during_storm":percentiles(probe_latencies)
+        }
+
+    finally:
+        await engine.dispose()
+        os.remove(path)
+
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins",type=int,default=200)
+    parser.add_argument("--concurrency",type=int,default=50)
+    args=parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args.logins,args.concurrency)),indent=2))
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+    Response serialization micro-benchmark
+
+    Compares the old path (jsonable_encoder on live ORM rows, then JSONResponse)
+    with the new one (plain dicts rendered by ORJSONResponse) for a single
+    exercise and for a 1,000-row list.
+
+        python -m benchmarks.serialization --repeat 200
+"""
+import argparse
+import json
+import timeit
+from sqlalchemy import create_engine,insert,select
+from sqlalchemy.orm import Session
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse,ORJSONResponse
+from database import Base
+from models import Exercise
+from crud import exercise_dict
+from benchmarks.index_layout import make_rows
+
+
+def old_path(exercises):
+    return JSONResponse(jsonable_encoder(exercises)).body
+
+
+def new_path(exercises):
+    if isinstance(exercises,list):
+        return ORJSONResponse([exercise_dict(exercise) for exercise in exercises]).body
+
+    return ORJSONResponse(exercise_dict(exercises)).body
+
+
+def measure(fn,value,repeat):
+    return min(timeit.repeat(lambda:fn(value),number=1,repeat=repeat))
+
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat",type=int,default=200)
+    args=parser.parse_args()
+
+    engine=create_engine("sqlite://")
+    Base.metadata.create_all(engine,tables=[Exercise.__table__])
+
+    with engine.begin() as connection:
+        connection.execute(insert(Exercise),make_rows(1000,10,3))
+
+    report={}
+
+    with Session(engine) as session:
+        exercises=session.execute(select(Exercise).order_by(Exercise.id)).scalars().all()
+
+        for name,value in (("single_row",exercises[0]),("list_1000_rows",exercises)):
+            old=measure(old_path,value,args.repeat)
+            new=measure(new_path,value,args.repeat)
+
+            report[name]={
+                "jsonable_encoder_us":round(old*1e6,1),
+                "orjson_us":round(new*1e6,1),
+                "speedup":round(old/new,1)
+            }
+
+    print(json.dumps(report,indent=2))
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+    SQLite tuning benchmark
+
+    Runs writers (one exercise insert and commit each) and readers (a 30-day range
+    query each) side by side for a fixed time, once with SQLite's defaults and once
+    with the pragmas from database.SQLITE_PRAGMAS, and reports throughput and latency.
+
+        python -m benchmarks.sqlite_tuning --writers 4 --readers 8 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime,timedelta
+from sqlalchemy import insert,select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from database import Base,SQLITE_PRAGMAS,configure_sqlite
+from models import Exercise
+from benchmarks.index_layout import make_rows
+from benchmarks.common import percentiles
+
+
+USERS=100
+
+
+async def run_profile(name,pragmas,writers,readers,seconds,seed_rows):
+    fd,path=tempfile.mkstemp(suffix=".db",prefix=f"bench-{name}-")
+    os.close(fd)
+
+    engine=create_async_engine(f"sqlite+aiosqlite:///{path}",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=writers+readers,
+        connect_args={"check_same_thread": False}
+    )
+    configure_sqlite(engine,pragmas)
+
+    try:
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all,tables=[Exercise.__table__])
+            await connection.execute(insert(Exercise),make_rows(seed_rows,USERS,1))
+
+        write_latencies=[]
+        read_latencies=[]
+        errors={"write":0,"read":0}
+        deadline=time.perf_counter()+seconds
+
+        async def writer(number):
+            rows=make_rows(10000,USERS,100+number)
+            index=0
+
+            while time.perf_counter()<deadline:
+                started=time.perf_counter()
+
+                try:
+                    async with engine.begin() as connection:
+                        await connection.execute(insert(Exercise),[rows[index%len(rows)]])
+                    write_latencies.append(time.perf_counter()-started)
+
+                except OperationalError:
+                    errors["write"]+=1
+
+                index+=1
+
+        async def reader(number):
+            rng=random.Random(number)
+
+            while time.perf_counter()<deadline:
+                since=datetime(2022,1,1)+timedelta(days=rng.randrange(3*365-30))
+                query=select(Exercise.date,Exercise.calories_burned).where(
+                    Exercise.user_id==rng.randint(1,USERS),
+                    Exercise.date>=since,
+                    Exercise.date<since+timedelta(days=30)
+                )
+                started=time.perf_counter()
+
+                try:
+                    async with engine.connect() as connection:
+                        (await connection.execute(query)).all()
+                    read_latencies.append(time.perf_counter()-started)
+
+                except OperationalError:
+                    errors["read"]+=1
+
+        await asyncio.gather(
+            *(writer(number) for number in range(writers)),
+            *(reader(number) for number in range(readers))
+        )
+
+        return {
+            "pragmas":pragmas,
+            "writes_per_s":round(len(write_latencies)/seconds,1),
+            "reads_per_s":round(len(read_latencies)/seconds,1),
+            "errors":errors,
+            "write_latency":percentiles(write_latencies),
+            "read_latency":percentiles(read_latencies)
+        }
+
+    finally:
+        await engine.dispose()
+        for suffix in ("","-wal","-shm","-journal"):
+            if os.path.exists(path+suffix):
+                os.remove(path+suffix)
+
+
+async def run(writers,readers,seconds,seed_rows):
+    report={"writers":writers,"readers":readers,"seconds":seconds,"seed_rows":seed_rows}
+    report["defaults"]=await run_profile("defaults",{},writers,readers,seconds,seed_rows)
+    report["tuned"]=await run_profile("tuned",SQLITE_PRAGMAS,writers,readers,seconds,seed_rows)
+
+    return report
+
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers",type=int,default=4)
+    parser.add_argument("--readers",type=int,default=8)
+    parser.add_argument("--seconds",type=float,default=10)
+    parser.add_argument("--seed-rows",type=int,default=50000)
+    args=parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args.writers,args.readers,args.seconds,args.seed_rows)),indent=2))
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,183 @@
+import hashlib
+import math
+import os
+import time
+from collections import OrderedDict,namedtuple
+
+
+USER_CACHE_SIZE=int(os.getenv("USER_CACHE_SIZE","10000"))
+USER_CACHE_TTL=float(os.getenv("USER_CACHE_TTL","60"))
+
+USERNAME_FILTER_CAPACITY=int(os.getenv("USERNAME_FILTER_CAPACITY","1000000"))
+USERNAME_FILTER_ERROR_RATE=float(os.getenv("USERNAME_FILTER_ERROR_RATE","0.01"))
+
+#seconds between catch-ups of the username filter with users signed up on other processes
+USERNAME_FILTER_SYNC=float(os.getenv("USERNAME_FILTER_SYNC","1"))
+
+
+class TTLCache:
+    """
+        Bounded LRU cache whose entries also expire after `ttl` seconds.
+        It keeps hit and miss counters so its effect can be measured.
+    """
+
+    def __init__(self,maxsize,ttl):
+        self.maxsize=maxsize
+        self.ttl=ttl
+        self.hits=0
+        self.misses=0
+        self._entries=OrderedDict()
+
+    def get(self,key):
+        entry=self._entries.get(key)
+
+        if entry is None or entry[1]<time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses+=1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits+=1
+
+        return entry[0]
+
+    def set(self,key,value,ttl=None):
+        ttl=self.ttl if ttl is None else min(ttl,self.ttl)
+
+        self._entries[key]=(value,time.monotonic()+ttl)
+        self._entries.move_to_end(key)
+
+        while len(self._entries)>self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self,key):
+        self._entries.pop(key,None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups=self.hits+self.misses
+
+        return {
+            "size":len(self._entries),
+            "maxsize":self.maxsize,
+            "ttl":self.ttl,
+            "hits":self.hits,
+            "misses":self.misses,
+            "hit_ratio":round(self.hits/lookups,4) if lookups else 0.0
+        }
+
+
+class BytesLRUCache:
+    """
+        LRU cache of byte strings bounded by their total size rather than their count
+    """
+
+    def __init__(self,maxbytes):
+        self.maxbytes=maxbytes
+        self.currbytes=0
+        self.hits=0
+        self.misses=0
+        self._entries=OrderedDict()
+
+    def get(self,key):
+        value=self._entries.get(key)
+
+        if value is None:
+            self.misses+=1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits+=1
+
+        return value
+
+    def set(self,key,value):
+        if len(value)>self.maxbytes:
+            return
+
+        previous=self._entries.pop(key,None)
+
+        if previous is not None:
+            self.currbytes-=len(previous)
+
+        self._entries[key]=value
+        self.currbytes+=len(value)
+
+        while self.currbytes>self.maxbytes:
+            _,evicted=self._entries.popitem(last=False)
+            self.currbytes-=len(evicted)
+
+    def clear(self):
+        self._entries.clear()
+        self.currbytes=0
+
+    def stats(self):
+        lookups=self.hits+self.misses
+
+        return {
+            "entries":len(self._entries),
+            "bytes":self.currbytes,
+            "maxbytes":self.maxbytes,
+            "hits":self.hits,
+            "misses":self.misses,
+            "hit_ratio":round(self.hits/lookups,4) if lookups else 0.0
+        }
+
+
+class BloomFilter:
+    """
+        Set membership in a fixed bit array. `in` never misses an added key and
+        wrongly matches an absent one with about `error_rate` probability, as long
+        as no more than `capacity` keys are added.
+    """
+
+    def __init__(self,capacity,error_rate):
+        self.capacity=capacity
+        self.error_rate=error_rate
+        self.size=max(8,int(-capacity*math.log(error_rate)/math.log(2)**2))
+        self.hashes=max(1,round(self.size/capacity*math.log(2)))
+        self.count=0
+        self.warm=False
+        #the username filter's last loaded user id, and when it last caught up
+        self.last_id=0
+        self.synced_at=0.0
+        self._bits=bytearray((self.size+7)//8)
+
+    def _positions(self,key):
+        #double hashing, two 64-bit halves of one digest give every position
+        digest=hashlib.blake2b(key.encode(),digest_size=16).digest()
+        first=int.from_bytes(digest[:8],"little")
+        second=int.from_bytes(digest[8:],"little")|1
+
+        return ((first+i*second)%self.size for i in range(self.hashes))
+
+    def add(self,key):
+        for position in self._positions(key):
+            self._bits[position>>3]|=1<<(position&7)
+
+        self.count+=1
+
+    def __contains__(self,key):
+        return all(self._bits[position>>3]&(1<<(position&7)) for position in self._positions(key))
+
+    def stats(self):
+        return {
+            "capacity":self.capacity,
+            "error_rate":self.error_rate,
+            "bits":self.size,
+            "hashes":self.hashes,
+            "count":self.count,
+            "warm":self.warm,
+        }
+
+
+#what the handlers need to know about the caller
+CachedUser=namedtuple("CachedUser",["id","username","is_admin","is_active"])
+
+user_cache=TTLCache(USER_CACHE_SIZE,USER_CACHE_TTL)
+
+#every username taken, so most availability checks skip the database
+username_filter=BloomFilter(USERNAME_FILTER_CAPACITY,USERNAME_FILTER_ERROR_RATE)
@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+from cache import BytesLRUCache
+
+
+CHART_WORKERS=int(os.getenv("CHART_WORKERS","2"))
+CHART_CACHE_BYTES=int(os.getenv("CHART_CACHE_BYTES",str(32*1024*1024)))
+
+CHART_METRICS=("exercises","sets","repetitions","calories_burned","distance_covered","weight_lifted")
+
+MEDIA_TYPES={
+    "png":"image/png",
+    "svg":"image/svg+xml",
+}
+
+chart_cache=BytesLRUCache(CHART_CACHE_BYTES)
+
+_executor=None
+
+#renders in progress, so identical requests wait for one render instead of starting their own
+_pending={}
+
+
+def render_chart(days,values,metric,fmt):
+    """
+        Draws a daily series (ISO dates and their values) with the object-oriented Agg API and returns the image bytes.
+        It touches no pyplot global state, so it is safe to run in parallel.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure=Figure(figsize=(8,4),dpi=100)
+    FigureCanvasAgg(figure)
+
+    axes=figure.add_subplot()
+    axes.plot([date.fromisoformat(day) for day in days],values,marker="o",linewidth=1.5,markersize=3)
+    axes.set_title(f"{metric.replace('_',' ').capitalize()} per day")
+    axes.set_ylabel(metric.replace("_"," "))
+    axes.grid(True,alpha=0.3)
+    figure.autofmt_xdate()
+    figure.tight_layout()
+
+    buffer=io.BytesIO()
+    figure.savefig(buffer,format=fmt)
+
+    return buffer.getvalue()
+
+
+def chart_key(user_id,metric,start,end,fmt,days,values):
+    """
+        Content address of a chart. The digest of the plotted series is the data
+        version, so any change to the underlying rows yields a new key.
+    """
+    payload=json.dumps([user_id,metric,str(start),str(end),fmt,days,values])
+
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _get_executor():
+    global _executor
+
+    if _executor is None:
+        _executor=ProcessPoolExecutor(max_workers=CHART_WORKERS)
+
+    return _executor
+
+
+async def get_chart(user_id,metric,start,end,fmt,days,values):
+    """
+        Returns (key, image bytes), rendering on the process pool only on a cache miss
+    """
+    key=chart_key(user_id,metric,start,end,fmt,days,values)
+
+    image=chart_cache.get(key)
+
+    if image is not None:
+        return key,image
+
+    pending=_pending.get(key)
+
+    if pending is None:
+        loop=asyncio.get_running_loop()
+        pending=_pending[key]=loop.run_in_executor(_get_executor(),render_chart,days,values,metric,fmt)
+
+    try:
+        image=await asyncio.shield(pending)
+
+    finally:
+        if _pending.get(key) is pending and pending.done():
+            del _pending[key]
+
+    chart_cache.set(key,image)
+
+    return key,image
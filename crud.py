@@ -0,0 +1,643 @@
+import base64
+import json
+import os
+import time
+from datetime import datetime
+from sqlalchemy import insert,select,delete,text,func,tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import User,Exercise,ExerciseDailyRollup,PersonalRecord,ExerciseVersion,naive_utc
+from partitions import exercise_partitions
+import cache
+from cache import CachedUser,BloomFilter,user_cache
+
+
+EXERCISE_COLUMNS=(
+    "date",
+    "exercise_name",
+    "sets",
+    "repetitions",
+    "weight_lifted",
+    "distance_covered",
+    "calories_burned",
+    "intensity_level",
+    "user_id",
+)
+
+#columns of exercise_daily_rollups that sum the matching exercise columns
+ROLLUP_TOTALS=("sets","repetitions","calories_burned","distance_covered","weight_lifted")
+
+#columns of personal_records that keep the maximum of the matching exercise columns
+RECORD_METRICS=("weight_lifted","repetitions","distance_covered")
+
+EXERCISE_BATCH_CHUNK_SIZE=int(os.getenv("EXERCISE_BATCH_CHUNK_SIZE","1000"))
+
+#rows fetched per round trip by the export cursor
+EXERCISE_EXPORT_CHUNK_SIZE=int(os.getenv("EXERCISE_EXPORT_CHUNK_SIZE","1000"))
+
+
+async def get_cached_user(session,username):
+    """
+        Resolves a JWT subject to a CachedUser, only hitting the database on a cache miss
+    """
+    user=user_cache.get(username)
+
+    if user is not None:
+        return user
+
+    row=(await session.execute(
+        select(User.id,User.username,User.is_admin,User.is_active).where(User.username==username)
+    )).first()
+
+    if row is None:
+        return None
+
+    user=CachedUser(*row)
+    user_cache.set(username,user)
+
+    return user
+
+
+async def warm_username_filter(session):
+    """
+        Loads every username into a fresh Bloom filter, sized for twice the current
+        users, and swaps it in once complete
+    """
+    count=await session.scalar(select(func.count(User.id)))
+
+    usernames=BloomFilter(max(cache.USERNAME_FILTER_CAPACITY,2*count),cache.USERNAME_FILTER_ERROR_RATE)
+    usernames.synced_at=time.monotonic()
+
+    result=await session.stream(select(User.id,User.username).execution_options(yield_per=EXERCISE_EXPORT_CHUNK_SIZE))
+
+    async for user_id,username in result:
+        usernames.add(username)
+        usernames.last_id=max(usernames.last_id,user_id)
+
+    usernames.warm=True
+    cache.username_filter=usernames
+
+    return usernames
+
+
+async def sync_username_filter(session,usernames):
+    """
+        Adds the users signed up since the filter last caught up, on any process.
+        They come from a primary key range read, which finds none most of the time.
+    """
+    usernames.synced_at=time.monotonic()
+
+    for user_id,username in await session.execute(select(User.id,User.username).where(User.id>usernames.last_id).order_by(User.id)):
+        usernames.add(username)
+        usernames.last_id=user_id
+
+
+async def username_available(session,username):
+    """
+        True when no user has this username. A warm filter answers for names that
+        were never taken; a possible match is checked against the table. Names
+        other processes took in the last USERNAME_FILTER_SYNC seconds can be missed,
+        so the answer is a hint and signup's unique constraint has the last word.
+    """
+    usernames=cache.username_filter
+
+    if usernames.warm:
+        if time.monotonic()-usernames.synced_at>=cache.USERNAME_FILTER_SYNC:
+            await sync_username_filter(session,usernames)
+
+        if username not in usernames:
+            return True
+
+    return await session.scalar(select(User.id).where(User.username==username)) is None
+
+
+#SQL expressions that bucket exercise dates into summary periods. Weeks are
+#labelled with their Monday, like the weekly volume of /exercises/trends
+PERIOD_EXPRESSIONS={
+    "day":lambda column:func.strftime("%Y-%m-%d",column),
+    "week":lambda column:func.date(column,"weekday 0","-6 days"),
+    "month":lambda column:func.strftime("%Y-%m",column),
+}
+
+SUMMARY_METRICS=("calories_burned","distance_covered","weight_lifted")
+
+
+def choice_code(value):
+    """
+        Returns the stored code of a ChoiceType value
+    """
+    return getattr(value,"code",value)
+
+
+async def exercise_summary(session,user_id,period=None,start=None,end=None):
+    """
+        Aggregates a user's exercises in SQL, grouped by exercise, intensity and
+        optionally by period. Only the groups leave the database.
+    """
+    columns=[Exercise.exercise_name,Exercise.intensity_level]
+
+    if period is not None:
+        columns.insert(0,PERIOD_EXPRESSIONS[period](Exercise.date).label("period"))
+
+    aggregates=[func.count(Exercise.id).label("count")]
+
+    for metric in SUMMARY_METRICS:
+        column=getattr(Exercise,metric)
+        aggregates.append(func.sum(column).label(f"{metric}_sum"))
+        aggregates.append(func.avg(column).label(f"{metric}_avg"))
+
+    query=select(*columns,*aggregates).where(Exercise.user_id==user_id)
+
+    if start is not None:
+        query=query.where(Exercise.date>=naive_utc(start))
+
+    if end is not None:
+        query=query.where(Exercise.date<naive_utc(end))
+
+    query=query.group_by(*columns).order_by(*columns)
+
+    groups=[]
+
+    for row in await session.execute(query):
+        group={
+            "exercise_name":choice_code(row.exercise_name),
+            "intensity_level":choice_code(row.intensity_level),
+            "count":row.count
+        }
+
+        if period is not None:
+            group["period"]=row.period
+
+        for metric in SUMMARY_METRICS:
+            group[metric]={
+                "sum":getattr(row,f"{metric}_sum"),
+                "avg":getattr(row,f"{metric}_avg")
+            }
+
+        groups.append(group)
+
+    return groups
+
+
+def encode_cursor(exercise_date,exercise_id):
+    """
+        Opaque cursor pointing just after an exercise in (date, id) order
+    """
+    raw=json.dumps([exercise_date.isoformat(),exercise_id]).encode()
+
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+        Reverses encode_cursor, raises ValueError for anything it did not produce
+    """
+    try:
+        raw=base64.urlsafe_b64decode(cursor+"="*(-len(cursor)%4))
+        exercise_date,exercise_id=json.loads(raw)
+
+        return datetime.fromisoformat(exercise_date),int(exercise_id)
+
+    except (TypeError,ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+async def list_exercises(session,user_id,limit,cursor=None,exercise_name=None,intensity_level=None):
+    """
+        One page of a user's exercises, newest first, and the cursor of the next page.
+        Pages seek on the (user_id, date, id) index, so deep pages cost the same as the first.
+
+        SQLite sorts a UNION ALL of partitions as a whole, so the months still in the
+        exercises table are read first and the archived ones only when the page reaches
+        them, bounded by _archived_rows to the few months the page needs.
+    """
+    query=select(Exercise.id,*(getattr(Exercise,column) for column in EXERCISE_COLUMNS)).where(
+        Exercise.user_id==user_id,
+        Exercise.date.isnot(None)
+    )
+
+    if cursor is not None:
+        exercise_date,exercise_id=decode_cursor(cursor)
+        query=query.where(tuple_(Exercise.date,Exercise.id)<tuple_(exercise_date,exercise_id))
+
+    if exercise_name is not None:
+        query=query.where(Exercise.exercise_name==exercise_name)
+
+    if intensity_level is not None:
+        query=query.where(Exercise.intensity_level==intensity_level)
+
+    query=query.order_by(Exercise.date.desc(),Exercise.id.desc())
+    hot_start=exercise_partitions.hot_start()
+
+    if hot_start is None:
+        rows=(await session.execute(query.limit(limit+1))).all()
+
+    else:
+        rows=[]
+
+        if cursor is None or exercise_date>=hot_start:
+            rows=(await session.execute(query.where(Exercise.date>=hot_start).limit(limit+1))).all()
+
+        if len(rows)<=limit:
+            before=hot_start if cursor is None else min(hot_start,exercise_date)
+            rows+=await _archived_rows(session,query.where(Exercise.date<hot_start),user_id,before,limit+1-len(rows),exercise_name)
+
+    items=[]
+
+    for row in rows[:limit]:
+        item=dict(row._mapping)
+        item["exercise_name"]=choice_code(item["exercise_name"])
+        item["intensity_level"]=choice_code(item["intensity_level"])
+        items.append(item)
+
+    next_cursor=None
+
+    if len(rows)>limit:
+        next_cursor=encode_cursor(items[-1]["date"],items[-1]["id"])
+
+    return items,next_cursor
+
+
+async def _archived_rows(session,query,user_id,before,count,exercise_name=None):
+    """
+        The next `count` rows of a page query from before `before`. The daily rollups
+        tell which day the rows reach back to, so the query gets a lower date bound
+        and only reads the partitions of those days.
+    """
+    exercises=func.sum(ExerciseDailyRollup.exercises)
+    days=select(ExerciseDailyRollup.day,exercises).where(
+        ExerciseDailyRollup.user_id==user_id,
+        ExerciseDailyRollup.day<before.date()
+    )
+
+    if exercise_name is not None:
+        days=days.where(ExerciseDailyRollup.exercise_name==exercise_name)
+
+    #every day holds at least one row, so `count` days always reach far enough
+    days=(await session.execute(days.group_by(ExerciseDailyRollup.day).having(exercises>0).order_by(ExerciseDailyRollup.day.desc()).limit(count))).all()
+
+    floor=datetime.combine(before.date(),datetime.min.time())
+    total=0
+
+    for day,day_exercises in days:
+        floor=datetime.combine(day,datetime.min.time())
+        total+=day_exercises
+
+        if total>=count:
+            break
+
+    rows=[]
+
+    if floor<before:
+        rows=(await session.execute(query.where(Exercise.date>=floor).limit(count))).all()
+
+    #the rollups count every intensity level, a page filtered on one can fall short
+    #of them; its remaining rows are read below the floor without a lower bound
+    if len(rows)<count and total>=count:
+        rows+=(await session.execute(query.where(Exercise.date<floor).limit(count-len(rows)))).all()
+
+    return rows
+
+
+async def stream_exercises(session,user_id,start=None,end=None):
+    """
+        Yields a user's exercises in (date, id) order, one chunk of rows at a time.
+        Rows come from a server-side cursor, so only one chunk is ever in memory.
+    """
+    query=select(Exercise.id,*(getattr(Exercise,column) for column in EXERCISE_COLUMNS)).where(
+        Exercise.user_id==user_id
+    )
+
+    if start is not None:
+        query=query.where(Exercise.date>=naive_utc(start))
+
+    if end is not None:
+        query=query.where(Exercise.date<naive_utc(end))
+
+    query=query.order_by(Exercise.date,Exercise.id).execution_options(yield_per=EXERCISE_EXPORT_CHUNK_SIZE)
+
+    result=await session.stream(query)
+
+    async for rows in result.partitions():
+        yield rows
+
+
+def exercise_row(model,user_id):
+    """
+        Turns a validated WorkoutResponseModel into a row for the exercises table
+    """
+    row={column:getattr(model,column) for column in EXERCISE_COLUMNS}
+    row["user_id"]=user_id
+
+    return row
+
+
+def exercise_values(exercise):
+    """
+        Snapshot of an Exercise object as a row for the exercises table
+    """
+    row={column:getattr(exercise,column) for column in EXERCISE_COLUMNS}
+    row["exercise_name"]=choice_code(row["exercise_name"])
+    row["intensity_level"]=choice_code(row["intensity_level"])
+
+    return row
+
+
+def exercise_dict(exercise):
+    """
+        Plain dict of an Exercise object, ready for ORJSONResponse
+    """
+    return {"id":exercise.id,**exercise_values(exercise)}
+
+
+async def update_rollups(session,rows,sign=1):
+    """
+        Adds exercise rows to the daily rollups, or takes them out again with sign=-1.
+        Runs inside the caller's transaction so the rollups never drift from the rows.
+    """
+    await _apply_rollups(session,[(row,sign) for row in rows])
+
+
+async def replace_rollups(session,previous,current):
+    """
+        Moves an edited exercise from its previous values to its current ones in one upsert
+    """
+    await _apply_rollups(session,[(previous,-1),(current,1)])
+
+
+async def _apply_rollups(session,signed_rows):
+    totals={}
+
+    for row,sign in signed_rows:
+        if row["date"] is None:
+            continue
+
+        key=(row["user_id"],row["date"].date(),choice_code(row["exercise_name"]))
+
+        entry=totals.get(key)
+
+        if entry is None:
+            entry=totals[key]=dict.fromkeys(("exercises",)+ROLLUP_TOTALS,0)
+
+        entry["exercises"]+=sign
+
+        for column in ROLLUP_TOTALS:
+            entry[column]+=sign*(row[column] or 0)
+
+    if not totals:
+        return
+
+    params=[
+        {"user_id":user_id,"day":day,"exercise_name":exercise_name,**entry}
+        for (user_id,day,exercise_name),entry in totals.items()
+    ]
+
+    stmt=sqlite_insert(ExerciseDailyRollup)
+    stmt=stmt.on_conflict_do_update(
+        index_elements=[ExerciseDailyRollup.user_id,ExerciseDailyRollup.day,ExerciseDailyRollup.exercise_name],
+        set_={
+            column:getattr(ExerciseDailyRollup,column)+getattr(stmt.excluded,column)
+            for column in ("exercises",)+ROLLUP_TOTALS
+        }
+    )
+
+    await session.execute(stmt,params)
+
+    if any(sign<0 for _,sign in signed_rows):
+        await session.execute(
+            delete(ExerciseDailyRollup)
+            .where(ExerciseDailyRollup.user_id.in_({key[0] for key in totals}))
+            .where(ExerciseDailyRollup.exercises<=0)
+        )
+
+
+async def rebuild_rollups(session,user_id=None):
+    """
+        Recomputes the daily rollups from the exercises table, for one user or everyone
+    """
+    clear=delete(ExerciseDailyRollup)
+    query=select(
+        Exercise.user_id,
+        func.date(Exercise.date),
+        Exercise.exercise_name,
+        func.count(Exercise.id),
+        *(func.coalesce(func.sum(getattr(Exercise,column)),0) for column in ROLLUP_TOTALS)
+    ).where(Exercise.date.isnot(None)).group_by(Exercise.user_id,func.date(Exercise.date),Exercise.exercise_name)
+
+    if user_id is not None:
+        clear=clear.where(ExerciseDailyRollup.user_id==user_id)
+        query=query.where(Exercise.user_id==user_id)
+
+    await session.execute(clear)
+    await session.execute(
+        insert(ExerciseDailyRollup).from_select(
+            ["user_id","day","exercise_name","exercises",*ROLLUP_TOTALS],
+            query
+        )
+    )
+
+
+async def daily_totals(session,user_id,start,end,exercise_name=None):
+    """
+        Per day totals of a user between two dates (both inclusive), read from the rollups
+    """
+    query=select(
+        ExerciseDailyRollup.day,
+        func.sum(ExerciseDailyRollup.exercises).label("exercises"),
+        *(func.sum(getattr(ExerciseDailyRollup,column)).label(column) for column in ROLLUP_TOTALS)
+    ).where(
+        ExerciseDailyRollup.user_id==user_id,
+        ExerciseDailyRollup.day>=start,
+        ExerciseDailyRollup.day<=end
+    )
+
+    if exercise_name is not None:
+        query=query.where(ExerciseDailyRollup.exercise_name==exercise_name)
+
+    query=query.group_by(ExerciseDailyRollup.day).order_by(ExerciseDailyRollup.day)
+
+    return [dict(row._mapping) for row in await session.execute(query)]
+
+
+def _larger(current,value):
+    #SQLite's two-argument max() is NULL as soon as one side is NULL
+    return func.max(func.coalesce(current,value),func.coalesce(value,current))
+
+
+async def update_records(session,rows):
+    """
+        Raises the personal records to the best values of new exercise rows.
+        Runs inside the caller's transaction, like update_rollups.
+    """
+    bests={}
+
+    for row in rows:
+        key=(row["user_id"],choice_code(row["exercise_name"]))
+        entry=bests.setdefault(key,dict.fromkeys(RECORD_METRICS))
+
+        for column in RECORD_METRICS:
+            if row[column] is not None and (entry[column] is None or row[column]>entry[column]):
+                entry[column]=row[column]
+
+    if not bests:
+        return
+
+    params=[
+        {"user_id":user_id,"exercise_name":exercise_name,**entry}
+        for (user_id,exercise_name),entry in bests.items()
+    ]
+
+    stmt=sqlite_insert(PersonalRecord)
+    stmt=stmt.on_conflict_do_update(
+        index_elements=[PersonalRecord.user_id,PersonalRecord.exercise_name],
+        set_={column:_larger(getattr(PersonalRecord,column),getattr(stmt.excluded,column)) for column in RECORD_METRICS}
+    )
+
+    await session.execute(stmt,params)
+
+
+async def rebuild_records(session,user_id=None,exercise_name=None):
+    """
+        Recomputes personal records from the exercises table, for everyone, one user
+        or one user's exercise
+    """
+    clear=delete(PersonalRecord)
+    query=select(
+        Exercise.user_id,
+        Exercise.exercise_name,
+        *(func.max(getattr(Exercise,column)) for column in RECORD_METRICS)
+    ).where(Exercise.user_id.isnot(None)).group_by(Exercise.user_id,Exercise.exercise_name)
+
+    if user_id is not None:
+        clear=clear.where(PersonalRecord.user_id==user_id)
+        query=query.where(Exercise.user_id==user_id)
+
+    if exercise_name is not None:
+        clear=clear.where(PersonalRecord.exercise_name==exercise_name)
+        query=query.where(Exercise.exercise_name==exercise_name)
+
+    await session.execute(clear)
+    await session.execute(
+        insert(PersonalRecord).from_select(["user_id","exercise_name",*RECORD_METRICS],query)
+    )
+
+
+async def replace_records(session,previous,current):
+    """
+        Moves the records from an exercise's previous values to its current ones.
+        The previous exercise is only recomputed when the old row held one of its
+        records and the edit lowered or moved it; otherwise the new values are
+        simply compared with the records.
+    """
+    record=(await session.execute(
+        select(*(getattr(PersonalRecord,column) for column in RECORD_METRICS)).where(
+            PersonalRecord.user_id==previous["user_id"],
+            PersonalRecord.exercise_name==choice_code(previous["exercise_name"])
+        )
+    )).first()
+
+    moved=choice_code(previous["exercise_name"])!=choice_code(current["exercise_name"])
+
+    lowered=record is not None and any(
+        previous[column] is not None
+        and previous[column]==getattr(record,column)
+        and (moved or current[column] is None or current[column]<previous[column])
+        for column in RECORD_METRICS
+    )
+
+    if lowered:
+        await rebuild_records(session,user_id=previous["user_id"],exercise_name=choice_code(previous["exercise_name"]))
+
+    await update_records(session,[current])
+
+
+async def personal_records(session,user_id):
+    """
+        The records of a user, one row per exercise they have done
+    """
+    query=select(PersonalRecord.exercise_name,*(getattr(PersonalRecord,column) for column in RECORD_METRICS)).where(
+        PersonalRecord.user_id==user_id
+    ).order_by(PersonalRecord.exercise_name)
+
+    records=[]
+
+    for row in await session.execute(query):
+        record=dict(row._mapping)
+        record["exercise_name"]=choice_code(record["exercise_name"])
+        records.append(record)
+
+    return records
+
+
+async def bump_exercise_versions(session,user_ids):
+    """
+        Counts one more exercise write for each user, in the caller's transaction,
+        and returns the users' new versions
+    """
+    if not user_ids:
+        return {}
+
+    stmt=sqlite_insert(ExerciseVersion)
+    stmt=stmt.on_conflict_do_update(
+        index_elements=[ExerciseVersion.user_id],
+        set_={"version":ExerciseVersion.version+1}
+    )
+
+    await session.execute(stmt,[{"user_id":user_id,"version":1} for user_id in user_ids])
+
+    return dict((await session.execute(
+        select(ExerciseVersion.user_id,ExerciseVersion.version).where(ExerciseVersion.user_id.in_(list(user_ids)))
+    )).all())
+
+
+async def exercise_version(session,user_id):
+    """
+        The number of exercise writes of a user, 0 before the first one
+    """
+    version=await session.scalar(select(ExerciseVersion.version).where(ExerciseVersion.user_id==user_id))
+
+    return version or 0
+
+
+async def reserve_exercise_ids(session,count):
+    """
+        Hands out `count` new exercise ids by moving the AUTOINCREMENT sequence of the
+        exercises table forward, in the caller's transaction. SQLite gives no other row
+        those ids, nor ever again the id of a deleted row.
+    """
+    if not count:
+        return []
+
+    moved=(await session.execute(text("UPDATE sqlite_sequence SET seq=seq+:count WHERE name='exercises'"),{"count":count})).rowcount
+
+    if not moved:
+        #nothing was ever inserted, the sequence has no row yet
+        await session.execute(text("INSERT INTO sqlite_sequence (name,seq) SELECT 'exercises',coalesce(max(id),0)+:count FROM exercises"),{"count":count})
+
+    last_id=await session.scalar(text("SELECT seq FROM sqlite_sequence WHERE name='exercises'"))
+
+    return list(range(last_id-count+1,last_id+1))
+
+
+async def insert_exercises(session,rows):
+    """
+        Inserts exercise rows chunk by chunk, adds them to the rollups and personal
+        records, bumps the users' exercise versions and returns the rows' ids and the
+        new versions. The caller owns the transaction and commits it.
+
+        The ids are reserved up front and inserted with the rows. Each chunk runs one
+        prepared INSERT over all its rows. A multi-row VALUES statement would be
+        recompiled by SQLAlchemy on every call, which costs far more than the insert itself.
+    """
+    ids=await reserve_exercise_ids(session,len(rows))
+
+    for start in range(0,len(rows),EXERCISE_BATCH_CHUNK_SIZE):
+        await session.execute(insert(Exercise),[
+            {**row,"id":exercise_id}
+            for row,exercise_id in zip(rows[start:start+EXERCISE_BATCH_CHUNK_SIZE],ids[start:start+EXERCISE_BATCH_CHUNK_SIZE])
+        ])
+
+    await update_rollups(session,rows)
+    await update_records(session,rows)
+    versions=await bump_exercise_versions(session,{row["user_id"] for row in rows})
+
+    return ids,versions
@@ -0,0 +1,291 @@
+import asyncio
+import contextvars
+import csv
+import io
+import logging
+import os
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pydantic import ValidationError
+from database import AsyncSessionLocal
+from crud import EXERCISE_COLUMNS,insert_exercises
+from series_cache import series_cache
+from leaderboard import leaderboard
+
+
+#rows validated and inserted together, each chunk is committed on its own
+IMPORT_CHUNK_ROWS=int(os.getenv("IMPORT_CHUNK_ROWS","5000"))
+IMPORT_WORKERS=int(os.getenv("IMPORT_WORKERS","2"))
+
+#largest upload accepted, in bytes
+IMPORT_MAX_BYTES=int(os.getenv("IMPORT_MAX_BYTES",str(512*1024*1024)))
+
+#imports allowed to run at once, later ones wait in "queued"
+IMPORT_MAX_RUNNING=int(os.getenv("IMPORT_MAX_RUNNING","2"))
+
+#finished jobs kept for their status and error report
+IMPORT_JOBS_KEPT=int(os.getenv("IMPORT_JOBS_KEPT","100"))
+
+IMPORT_COLUMNS=tuple(column for column in EXERCISE_COLUMNS if column!="user_id")
+
+ERROR_REPORT_FIELDS=("line","errors","row")
+
+logger=logging.getLogger(__name__)
+
+
+class ImportTooLarge(Exception):
+    """
+        Raised when an upload is larger than IMPORT_MAX_BYTES
+    """
+
+
+def validate_rows(rows,first_line,user_id):
+    """
+        Validates CSV rows (dicts keyed by the header) in a worker process.
+        Returns the valid rows ready for insert_exercises, and (line, errors, row)
+        for the others.
+    """
+    from schemas import WorkoutResponseModel
+
+    valid=[]
+    invalid=[]
+
+    for line,raw in enumerate(rows,first_line):
+        item={column:value for column,value in raw.items() if column in IMPORT_COLUMNS and value not in ("",None)}
+
+        try:
+            model=WorkoutResponseModel.parse_obj(item)
+
+        except ValidationError as e:
+            errors="; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors())
+            invalid.append((line,errors,raw))
+            continue
+
+        row={column:getattr(model,column) for column in IMPORT_COLUMNS}
+        row["user_id"]=user_id
+        valid.append(row)
+
+    return valid,invalid
+
+
+class ImportJob:
+    """
+        Progress of one CSV import
+    """
+
+    def __init__(self,user_id,filename,upload_path):
+        self.id=uuid.uuid4().hex
+        self.user_id=user_id
+        self.filename=filename
+        self.upload_path=upload_path
+        self.report_path=None
+        self.status="queued"
+        self.bytes_total=os.path.getsize(upload_path)
+        self.bytes_read=0
+        self.rows_read=0
+        self.rows_imported=0
+        self.rows_invalid=0
+        self.error=None
+        self.created_at=time.time()
+        self.finished_at=None
+        self.task=None
+
+    def to_dict(self):
+        return {
+            "job_id":self.id,
+            "filename":self.filename,
+            "status":self.status,
+            "progress":round(self.bytes_read/self.bytes_total,4) if self.bytes_total else 1.0,
+            "rows_read":self.rows_read,
+            "rows_imported":self.rows_imported,
+            "rows_invalid":self.rows_invalid,
+            "error":self.error,
+            "has_error_report":self.rows_invalid>0,
+            "created_at":self.created_at,
+            "finished_at":self.finished_at,
+        }
+
+
+class ExerciseImporter:
+    """
+        Runs CSV imports in the background. The file is read one chunk of rows at
+        a time; chunks are validated on a process pool with at most IMPORT_WORKERS
+        of them in flight, and valid rows are inserted and committed chunk by chunk.
+        Invalid rows go to a CSV error report on disk, so memory stays bounded
+        whatever the size of the file.
+    """
+
+    def __init__(self,session_factory=AsyncSessionLocal):
+        self.session_factory=session_factory
+        self.jobs=OrderedDict()
+        self._executor=None
+        self._running=None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor=ProcessPoolExecutor(max_workers=IMPORT_WORKERS)
+
+        return self._executor
+
+    async def spool(self,upload,chunk_size=1024*1024):
+        """
+            Copies an uploaded file to a temporary file of our own, chunk by chunk
+        """
+        fd,path=tempfile.mkstemp(suffix=".csv",prefix="import-")
+        size=0
+
+        try:
+            with os.fdopen(fd,"wb") as spooled:
+                while True:
+                    data=await upload.read(chunk_size)
+
+                    if not data:
+                        break
+
+                    size+=len(data)
+
+                    if size>IMPORT_MAX_BYTES:
+                        raise ImportTooLarge()
+
+                    spooled.write(data)
+
+        except BaseException:
+            os.remove(path)
+            raise
+
+        return path
+
+    def submit(self,user_id,filename,upload_path):
+        job=ImportJob(user_id,filename,upload_path)
+        self.jobs[job.id]=job
+        self._evict()
+
+        #started in a fresh context, so the statements of the import are not counted
+        #against the upload request by the query budget and the SQL metrics
+        job.task=contextvars.Context().run(asyncio.create_task,self._run(job))
+
+        return job
+
+    def get(self,job_id,user_id):
+        job=self.jobs.get(job_id)
+
+        if job is None or job.user_id!=user_id:
+            return None
+
+        return job
+
+    def _evict(self):
+        finished=[job for job in self.jobs.values() if job.finished_at is not None]
+
+        while len(self.jobs)>IMPORT_JOBS_KEPT and finished:
+            job=finished.pop(0)
+            del self.jobs[job.id]
+
+            if job.report_path and os.path.exists(job.report_path):
+                os.remove(job.report_path)
+
+    async def _run(self,job):
+        if self._running is None:
+            self._running=asyncio.Semaphore(IMPORT_MAX_RUNNING)
+
+        async with self._running:
+            job.status="running"
+
+            try:
+                await self._import(job)
+                job.status="done"
+
+            except Exception as e:
+                logger.exception("import %s failed",job.id)
+                job.status="failed"
+                job.error=repr(e)
+
+            finally:
+                job.finished_at=time.time()
+                os.remove(job.upload_path)
+
+    async def _import(self,job):
+        loop=asyncio.get_running_loop()
+        executor=self._get_executor()
+        pending=[]
+        report=None
+
+        with open(job.upload_path,newline="",encoding="utf-8-sig") as upload:
+            reader=csv.DictReader(upload)
+
+            if reader.fieldnames is None:
+                return
+
+            missing={"date","exercise_name","sets"}-set(reader.fieldnames)
+
+            if missing:
+                raise ValueError(f"Missing columns: {', '.join(sorted(missing))}")
+
+            try:
+                while True:
+                    first_line=reader.line_num+1
+                    rows=[row for _,row in zip(range(IMPORT_CHUNK_ROWS),reader)]
+
+                    if rows:
+                        job.rows_read+=len(rows)
+                        job.bytes_read=upload.buffer.tell()
+                        pending.append(loop.run_in_executor(executor,validate_rows,rows,first_line,job.user_id))
+
+                    #keep the pool busy but never hold more than IMPORT_WORKERS chunks
+                    if pending and (len(pending)>=IMPORT_WORKERS or not rows):
+                        valid,invalid=await pending.pop(0)
+                        report=self._report(job,report,invalid)
+                        await self._insert(job,valid)
+
+                    if not rows and not pending:
+                        break
+
+            finally:
+                if report is not None:
+                    report.close()
+
+        job.bytes_read=job.bytes_total
+
+    async def _insert(self,job,rows):
+        if not rows:
+            return
+
+        async with self.session_factory() as session:
+            ids,versions=await insert_exercises(session,rows)
+            await session.commit()
+
+        series_cache.append(rows,ids)
+        leaderboard.record(rows,versions=versions)
+
+        job.rows_imported+=len(rows)
+
+    def _report(self,job,report,invalid):
+        if not invalid:
+            return report
+
+        if report is None:
+            fd,job.report_path=tempfile.mkstemp(suffix=".csv",prefix="import-errors-")
+            report=os.fdopen(fd,"w",newline="")
+            csv.writer(report).writerow(ERROR_REPORT_FIELDS)
+
+        writer=csv.writer(report)
+        buffer=io.StringIO()
+        row_writer=csv.writer(buffer,lineterminator="")
+
+        for line,errors,raw in invalid:
+            #the offending row as it was uploaded, extra cells included
+            values=[value for column,value in raw.items() if column is not None]+(raw.get(None) or [])
+            row_writer.writerow(values)
+            writer.writerow((line,errors,buffer.getvalue()))
+            buffer.seek(0)
+            buffer.truncate()
+
+        job.rows_invalid+=len(invalid)
+
+        return report
+
+
+importer=ExerciseImporter()
@@ -1,11 +1,170 @@
-from sqlalchemy import create_engine
+import os
+from urllib.parse import quote
+from sqlalchemy import create_engine,event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine,AsyncSession
 from sqlalchemy.orm import declarative_base,sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///D:/Data science/Fitness_tracker/fitness.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL","sqlite:///./fitness.db")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL",
+    SQLALCHEMY_DATABASE_URL.replace("sqlite://","sqlite+aiosqlite://",1)
+)
+
+
+def is_sqlite(url):
+    return url.startswith("sqlite")
+
+
+def read_only_url(url):
+    """
+        Read-only variant of a SQLite file URL, opened through a `mode=ro` URI filename.
+        Other databases keep the async URL and rely on their own replicas or grants.
+    """
+    database=make_url(url).database if is_sqlite(url) else None
+
+    if not database or database==":memory:":
+        return ASYNC_SQLALCHEMY_DATABASE_URL
+
+    path=quote(os.path.abspath(database))
+
+    return f"sqlite+aiosqlite:///file:{path}?mode=ro&uri=true"
+
+
+#analytics queries (summaries, exports, charts) get their own read-only pool
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL",read_only_url(SQLALCHEMY_DATABASE_URL))
+
+#connection pool used by the API, tune it per deployment
+DB_POOL_SIZE=int(os.getenv("DB_POOL_SIZE","5"))
+DB_MAX_OVERFLOW=int(os.getenv("DB_MAX_OVERFLOW","10"))
+DB_POOL_TIMEOUT=float(os.getenv("DB_POOL_TIMEOUT","30"))
+DB_POOL_RECYCLE=int(os.getenv("DB_POOL_RECYCLE","-1"))
+
+READ_DB_POOL_SIZE=int(os.getenv("READ_DB_POOL_SIZE","5"))
+READ_DB_MAX_OVERFLOW=int(os.getenv("READ_DB_MAX_OVERFLOW","5"))
+
+#pragmas applied to every new SQLite connection. WAL lets readers run while a
+#writer commits, and NORMAL only syncs the WAL at checkpoints instead of every commit
+SQLITE_PRAGMAS={
+    "journal_mode":os.getenv("SQLITE_JOURNAL_MODE","WAL"),
+    "synchronous":os.getenv("SQLITE_SYNCHRONOUS","NORMAL"),
+    "mmap_size":os.getenv("SQLITE_MMAP_SIZE",str(256*1024*1024)),
+    "cache_size":os.getenv("SQLITE_CACHE_SIZE",str(-64*1024)),
+    "busy_timeout":os.getenv("SQLITE_BUSY_TIMEOUT","5000"),
+}
+
+#a read-only connection cannot change the journal mode, which lives in the file anyway
+SQLITE_READ_PRAGMAS={
+    "mmap_size":SQLITE_PRAGMAS["mmap_size"],
+    "cache_size":SQLITE_PRAGMAS["cache_size"],
+    "busy_timeout":SQLITE_PRAGMAS["busy_timeout"],
+    "query_only":"ON",
+}
+
+
+def connect_args(url):
+    return {"check_same_thread": False} if is_sqlite(url) else {}
+
+
+def configure_sqlite(engine,pragmas=None):
+    """
+        Applies the SQLite pragmas to every connection the engine opens
+    """
+    pragmas=SQLITE_PRAGMAS if pragmas is None else pragmas
+    sync_engine=getattr(engine,"sync_engine",engine)
+
+    @event.listens_for(sync_engine,"connect")
+    def set_sqlite_pragmas(dbapi_connection,connection_record):
+        cursor=dbapi_connection.cursor()
+
+        for name,value in pragmas.items():
+            if value:
+                cursor.execute(f"PRAGMA {name}={value}")
+
+        cursor.close()
+
+    return engine
+
+
+#sync engine for scripts such as init_db.py
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args(SQLALCHEMY_DATABASE_URL))
+
+#async engine used by the request handlers
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    connect_args=connect_args(ASYNC_SQLALCHEMY_DATABASE_URL)
+)
+
+#read-only async engine for analytics. Under WAL each query reads a consistent
+#snapshot and neither blocks nor waits for writers
+read_engine = create_async_engine(READ_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=READ_DB_POOL_SIZE,
+    max_overflow=READ_DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    connect_args=connect_args(READ_DATABASE_URL)
+)
+
+if is_sqlite(SQLALCHEMY_DATABASE_URL):
+    configure_sqlite(engine)
+    configure_sqlite(async_engine)
+
+if is_sqlite(READ_DATABASE_URL):
+    configure_sqlite(read_engine,SQLITE_READ_PRAGMAS)
+
+
+class PoolUsage:
+    """
+        Counts checkouts of a pool, so read and write pools can be watched separately
+    """
+
+    def __init__(self,engine):
+        self.engine=engine
+        self.checkouts=0
+        self.checked_out=0
+        self.peak_checked_out=0
+        self.connects=0
+
+        sync_engine=getattr(engine,"sync_engine",engine)
+        event.listen(sync_engine,"connect",self.on_connect)
+        event.listen(sync_engine,"checkout",self.on_checkout)
+        event.listen(sync_engine,"checkin",self.on_checkin)
+
+    def on_connect(self,dbapi_connection,connection_record):
+        self.connects+=1
+
+    def on_checkout(self,dbapi_connection,connection_record,connection_proxy):
+        self.checkouts+=1
+        self.checked_out+=1
+        self.peak_checked_out=max(self.peak_checked_out,self.checked_out)
+
+    def on_checkin(self,dbapi_connection,connection_record):
+        self.checked_out-=1
+
+    def stats(self):
+        pool=getattr(self.engine,"sync_engine",self.engine).pool
+
+        return {
+            "pool_size":pool.size() if hasattr(pool,"size") else None,
+            "connects":self.connects,
+            "checkouts":self.checkouts,
+            "checked_out":self.checked_out,
+            "peak_checked_out":self.peak_checked_out,
+        }
+
+
+pool_usage={
+    "write":PoolUsage(async_engine),
+    "read":PoolUsage(read_engine),
+}
 
 
 
@@ -13,3 +172,26 @@ Base=declarative_base()
 
 Session=sessionmaker()
 
+AsyncSessionLocal=sessionmaker(bind=async_engine,class_=AsyncSession,expire_on_commit=False)
+
+ReadSessionLocal=sessionmaker(bind=read_engine,class_=AsyncSession,expire_on_commit=False)
+
+
+async def get_db():
+    """
+        Hands out one session per request and closes it once the response is sent
+    """
+    async with AsyncSessionLocal() as session:
+        yield session
+
+
+async def get_read_db():
+    """
+        Hands out a session on the read-only analytics pool
+    """
+    async with ReadSessionLocal() as session:
+        yield session
+
+
+def pool_stats():
+    return {name:usage.stats() for name,usage in pool_usage.items()}
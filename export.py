@@ -0,0 +1,76 @@
+import csv
+import io
+import zlib
+import orjson
+from crud import EXERCISE_COLUMNS,choice_code
+
+
+EXPORT_FIELDS=("id",)+EXERCISE_COLUMNS
+
+MEDIA_TYPES={
+    "csv":"text/csv",
+    "ndjson":"application/x-ndjson",
+}
+
+
+def _values(row):
+    values=dict(row._mapping)
+    values["exercise_name"]=choice_code(values["exercise_name"])
+    values["intensity_level"]=choice_code(values["intensity_level"])
+
+    return values
+
+
+async def encode_csv(chunks):
+    """
+        Turns chunks of exercise rows into CSV text, header first
+    """
+    buffer=io.StringIO()
+    writer=csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+
+    async for rows in chunks:
+        for row in rows:
+            values=_values(row)
+
+            if values["date"] is not None:
+                values["date"]=values["date"].isoformat()
+
+            writer.writerow([values[field] for field in EXPORT_FIELDS])
+
+        yield buffer.getvalue().encode()
+
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def encode_ndjson(chunks):
+    """
+        Turns chunks of exercise rows into one JSON object per line
+    """
+    async for rows in chunks:
+        yield b"".join(orjson.dumps(_values(row))+b"\n" for row in rows)
+
+
+async def gzip_stream(stream):
+    """
+        Compresses a byte stream on the fly into a single gzip member
+    """
+    compressor=zlib.compressobj(6,zlib.DEFLATED,31)
+
+    async for data in stream:
+        compressed=compressor.compress(data)
+
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+
+ENCODERS={
+    "csv":encode_csv,
+    "ndjson":encode_ndjson,
+}
@@ -0,0 +1,301 @@
+"""
+    Generates a synthetic fitness database for scale testing: users and their
+    exercises, sampled with NumPy in large chunks and written with bulk core
+    inserts. The exercise indexes are created after the load, then the daily
+    rollups and personal records are computed from the exercises.
+
+        python generate_data.py --output fitness-100k.db --users 100000 --exercises 50000000
+        python generate_data.py --output small.db --users 1000 --exercises 200000 --seed 7
+
+    The history ends the day before --end (today by default); the same seed, sizes and
+    end date always give the same database. Every user is named user<id> and
+    logs in with the password "password".
+"""
+import argparse
+import asyncio
+import os
+import time
+from datetime import date,timedelta
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine,AsyncSession
+from werkzeug.security import generate_password_hash
+from database import Base
+from models import Exercise
+from crud import rebuild_rollups,rebuild_records
+
+
+EXERCISE_CODES=[code for code,_ in Exercise.EXERCISES_TYPES]
+INTENSITY_CODES=[code for code,_ in Exercise.INTENSITY_LEVELS]
+
+#rows sampled at once. Fixed, so the data only depends on the seed and the sizes
+CHUNK_ROWS=250000
+
+#per exercise type: mean repetitions, calories per repetition and whether it is loaded
+REPETITIONS=np.array([15.0,12.0,1.0])
+CALORIES_PER_REPETITION=np.array([0.5,0.6,4.0])
+LOADED=np.array([False,True,False])
+
+#per exercise type: share of sessions that start with a run, logged as the distance
+#covered, and its mean length in km. Planks are done on the spot
+RUN_SHARE=np.array([0.15,0.2,0.0])
+RUN_KM=np.array([2.5,3.5,0.0])
+CALORIES_PER_KM=60.0
+
+#calories multiplier of the low, medium and high intensity levels
+INTENSITY_FACTORS=np.array([0.8,1.0,1.25])
+
+#share of exercises per weekday, Monday first
+WEEKDAY_WEIGHTS=np.array([1.25,1.1,1.05,1.0,0.9,0.8,0.9])
+
+#load-time pragmas, the file is rebuilt from the seed if the load is interrupted
+LOAD_PRAGMAS={
+    "journal_mode":"OFF",
+    "synchronous":"OFF",
+    "cache_size":str(-512*1024),
+    "temp_store":"MEMORY",
+    "locking_mode":"EXCLUSIVE",
+}
+
+USER_INSERT="INSERT INTO user (id,username,email,password,is_admin,is_active) VALUES (?,?,?,?,0,1)"
+
+#dates are whole seconds, written in the format SQLAlchemy uses for SQLite DateTime
+EXERCISE_INSERT=(
+    "INSERT INTO exercises (id,date,exercise_name,sets,repetitions,weight_lifted,distance_covered,"
+    "calories_burned,intensity_level,user_id) "
+    "VALUES (?,datetime(?,'unixepoch')||'.000000',?,?,?,?,?,?,NULLIF(?,''),?)"
+)
+
+
+class Population:
+    """
+        Per-user traits drawn once: how active each user is, the day they signed
+        up, their favourite exercise, usual intensity and starting strength
+    """
+
+    def __init__(self,rng,users,start,days):
+        self.users=users
+        self.start=start
+        self.start_epoch=(start-date(1970,1,1)).days*86400
+        self.days=days
+        #a few users log most of the exercises
+        self.activity=np.cumsum(rng.lognormal(0.0,1.0,users))
+        #ids follow the signup order, a fifth of the users is there from the first day
+        self.active=np.maximum(1,(users*(0.2+0.8*np.arange(days)/max(days-1,1))).astype(np.int64))
+        self.favourite=rng.integers(0,len(EXERCISE_CODES),users)
+        self.intensity=rng.choice(len(INTENSITY_CODES),users,p=[0.3,0.5,0.2])
+        self.strength=rng.lognormal(np.log(60.0),0.35,users)
+
+    def sample(self,rng,day_offsets):
+        """
+            Picks the user of each exercise among the users signed up on its day
+        """
+        limit=self.activity[self.active[day_offsets]-1]
+
+        return np.searchsorted(self.activity,rng.random(len(day_offsets))*limit,side="right")
+
+
+def day_counts(rng,population,exercises):
+    """
+        Exercises per day: growing with the user base, fewer on weekends
+    """
+    days=np.arange(population.days)
+    weights=population.active*WEEKDAY_WEIGHTS[(days+population.start.weekday())%7]
+
+    return rng.multinomial(exercises,weights/weights.sum())
+
+
+def exercise_chunk(rng,population,day_offsets):
+    """
+        Samples the exercises of the given days, returned as insert parameters
+    """
+    count=len(day_offsets)
+    user_index=population.sample(rng,day_offsets)
+
+    #mostly evenings, some mornings
+    evening=rng.random(count)<0.6
+    hours=np.where(evening,rng.normal(18.5,1.5,count),rng.normal(7.0,1.0,count)).clip(5.0,23.5)
+    seconds=population.start_epoch+day_offsets*86400+(hours*3600).astype(np.int64)//60*60
+
+    exercise=np.where(rng.random(count)<0.6,population.favourite[user_index],rng.integers(0,len(EXERCISE_CODES),count))
+
+    intensity=np.where(rng.random(count)<0.7,population.intensity[user_index],rng.integers(0,len(INTENSITY_CODES),count))
+
+    sets=1+rng.binomial(5,0.5,count)
+    repetitions=1+rng.poisson(REPETITIONS[exercise]-1)
+
+    #loaded exercises get heavier over the user's history, in 2.5 kg steps
+    progress=1.0+0.3*day_offsets/max(population.days-1,1)
+    weight=population.strength[user_index]*progress*rng.normal(1.0,0.05,count)
+    weight=np.where(LOADED[exercise],np.round(weight/2.5)*2.5,np.nan)
+
+    run=rng.random(count)<RUN_SHARE[exercise]
+    distance=np.where(run,np.round(RUN_KM[exercise]*rng.lognormal(0.0,0.4,count),2),np.nan)
+
+    calories=sets*repetitions*CALORIES_PER_REPETITION[exercise]*INTENSITY_FACTORS[intensity]
+    calories=calories*np.nan_to_num(1.0+weight/400.0,nan=1.0)+np.nan_to_num(distance)*CALORIES_PER_KM
+    calories=np.round(calories*rng.lognormal(0.0,0.15,count),1)
+
+    #a few exercises were logged without an intensity
+    intensity_codes=np.array(INTENSITY_CODES+[""])[np.where(rng.random(count)<0.03,len(INTENSITY_CODES),intensity)]
+
+    #in time order, and sqlite stores the NaN weights and distances as NULL
+    order=np.argsort(seconds,kind="stable")
+
+    return zip(
+        seconds[order].tolist(),
+        np.array(EXERCISE_CODES)[exercise[order]].tolist(),
+        sets[order].tolist(),
+        repetitions[order].tolist(),
+        weight[order].tolist(),
+        distance[order].tolist(),
+        calories[order].tolist(),
+        intensity_codes[order].tolist(),
+        (user_index[order]+1).tolist(),
+    )
+
+
+def chunks(counts):
+    """
+        Splits consecutive days into runs of about CHUNK_ROWS exercises
+    """
+    first=0
+    total=0
+
+    for day,count in enumerate(counts):
+        total+=count
+
+        if total>=CHUNK_ROWS:
+            yield first,day+1
+            first,total=day+1,0
+
+    if first<len(counts):
+        yield first,len(counts)
+
+
+def create_schema(engine):
+    """
+        Creates the tables with the exercise indexes left out, and returns them for later
+    """
+    Base.metadata.create_all(engine)
+    deferred=list(Exercise.__table__.indexes)
+
+    with engine.begin() as connection:
+        for index in deferred:
+            index.drop(connection)
+
+    return deferred
+
+
+def load_users(connection,users):
+    password=generate_password_hash("password","pbkdf2:sha256:1000")
+
+    connection.exec_driver_sql(USER_INSERT,[
+        (user_id,f"user{user_id}",f"user{user_id}@example.com",password)
+        for user_id in range(1,users+1)
+    ])
+
+
+def load_exercises(connection,rng,population,counts,transaction_rows):
+    """
+        Inserts the exercises in date order, so ids grow with the dates like they
+        do through the API, committing every `transaction_rows` rows
+    """
+    next_id=1
+    uncommitted=0
+    transaction=connection.begin()
+
+    for first,last in chunks(counts):
+        day_offsets=np.repeat(np.arange(first,last),counts[first:last])
+        rows=exercise_chunk(rng,population,day_offsets)
+        ids=range(next_id,next_id+len(day_offsets))
+
+        connection.exec_driver_sql(EXERCISE_INSERT,[(exercise_id,*row) for exercise_id,row in zip(ids,rows)])
+
+        next_id+=len(day_offsets)
+        uncommitted+=len(day_offsets)
+
+        if uncommitted>=transaction_rows:
+            transaction.commit()
+            transaction=connection.begin()
+            uncommitted=0
+            print(f"{next_id-1} exercises written")
+
+    transaction.commit()
+
+
+async def build_derived(path):
+    engine=create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    try:
+        async with AsyncSession(engine) as session:
+            await rebuild_rollups(session)
+            await rebuild_records(session)
+            await session.commit()
+
+    finally:
+        await engine.dispose()
+
+
+def main(output,users,exercises,end,days,seed,transaction_rows,overwrite):
+    if os.path.exists(output):
+        if not overwrite:
+            raise SystemExit(f"{output} exists, pass --overwrite to replace it")
+
+        os.remove(output)
+
+    rng=np.random.default_rng(seed)
+    population=Population(rng,users,end-timedelta(days=days),days)
+    counts=day_counts(rng,population,exercises)
+
+    engine=create_engine(f"sqlite:///{output}")
+    started=time.perf_counter()
+
+    try:
+        deferred=create_schema(engine)
+
+        with engine.connect() as connection:
+            for name,value in LOAD_PRAGMAS.items():
+                connection.exec_driver_sql(f"PRAGMA {name}={value}")
+
+            with connection.begin():
+                load_users(connection,users)
+
+            load_exercises(connection,rng,population,counts,transaction_rows)
+            loaded=time.perf_counter()
+
+            with connection.begin():
+                for index in deferred:
+                    print(f"create index {index.name}")
+                    index.create(connection)
+
+            indexed=time.perf_counter()
+
+    finally:
+        engine.dispose()
+
+    asyncio.run(build_derived(output))
+
+    with create_engine(f"sqlite:///{output}").connect() as connection:
+        connection.exec_driver_sql("ANALYZE")
+        connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+    print(
+        f"{users} users and {exercises} exercises in {time.perf_counter()-started:.1f}s "
+        f"(load {loaded-started:.1f}s, indexes {indexed-loaded:.1f}s, rollups and records {time.perf_counter()-indexed:.1f}s)"
+    )
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output",default="fitness.db",help="SQLite file to create")
+    parser.add_argument("--users",type=int,default=1000)
+    parser.add_argument("--exercises",type=int,default=100000)
+    parser.add_argument("--end",type=date.fromisoformat,default=date.today(),help="day after the last exercise, YYYY-MM-DD (default today)")
+    parser.add_argument("--days",type=int,default=3*365,help="history length in days")
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--transaction-rows",type=int,default=5000000,help="rows per commit")
+    parser.add_argument("--overwrite",action="store_true",help="replace the output file if it exists")
+    args=parser.parse_args()
+
+    main(args.output,args.users,args.exercises,args.end,args.days,args.seed,args.transaction_rows,args.overwrite)
@@ -0,0 +1,520 @@
+import asyncio
+import fcntl
+import itertools
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import orjson
+from sqlalchemy import select,func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from database import AsyncSessionLocal
+from models import IngestCheckpoint
+from crud import insert_exercises
+from series_cache import series_cache
+from leaderboard import leaderboard
+
+
+#"direct" commits every exercise in its request, "write_behind" queues it
+EXERCISE_INGEST_MODE=os.getenv("EXERCISE_INGEST_MODE","direct")
+
+#each API process claims its own log by locking it: the first one gets this
+#path, the next ones this path suffixed with .1, .2 and so on
+INGEST_LOG_PATH=os.getenv("INGEST_LOG_PATH","./ingest.log")
+INGEST_BATCH_SIZE=int(os.getenv("INGEST_BATCH_SIZE","500"))
+INGEST_FLUSH_INTERVAL=float(os.getenv("INGEST_FLUSH_INTERVAL","0.2"))
+INGEST_QUEUE_MAX=int(os.getenv("INGEST_QUEUE_MAX","50000"))
+
+#fsync the log before acknowledging. Without it a record survives a process
+#crash but not a power loss
+INGEST_LOG_FSYNC=os.getenv("INGEST_LOG_FSYNC","1")=="1"
+
+#longest wait, in seconds, between attempts at a batch the database turned away
+#(locked, busy, unreachable). Such batches are retried until they commit
+INGEST_RETRY_MAX_DELAY=float(os.getenv("INGEST_RETRY_MAX_DELAY","30"))
+
+CHECKPOINT_NAME="exercises"
+
+logger=logging.getLogger(__name__)
+
+
+class IngestQueueFull(Exception):
+    """
+        Raised when the write-behind queue holds INGEST_QUEUE_MAX records
+    """
+
+
+class IngestNotRunning(Exception):
+    """
+        Raised when a record is submitted while no writer would commit it,
+        before start() or after stop()
+    """
+
+
+def _transient(error):
+    #the database could not take the write right now, the records themselves are fine
+    return isinstance(error,OperationalError)
+
+
+def _record_row(record):
+    """
+        Turns a log record back into a row for insert_exercises
+    """
+    row={key:value for key,value in record.items() if key not in ("seq","error")}
+    row["date"]=datetime.fromisoformat(row["date"]) if row["date"] else None
+
+    return row
+
+
+@contextmanager
+def _dead_letter_file(path):
+    """
+        Opens a dead-letter file locked against the other writers and the replay
+    """
+    with open(path,"a+b") as dead:
+        fcntl.flock(dead.fileno(),fcntl.LOCK_EX)
+        yield dead
+
+
+class AppendLog:
+    """
+        Newline-delimited JSON log of accepted records. Concurrent appends share
+        one fsync, so a burst costs a single disk sync instead of one per record.
+    """
+
+    def __init__(self,path):
+        self.path=path
+        self._file=open(path,"ab")
+        self._written=0
+        self._synced=0
+        self._syncing=None
+
+    @classmethod
+    def claim(cls,path):
+        """
+            Opens the log and locks it for this process, returns None when another
+            process holds it
+        """
+        log=cls(path)
+
+        try:
+            fcntl.flock(log._file.fileno(),fcntl.LOCK_EX|fcntl.LOCK_NB)
+
+        except BlockingIOError:
+            log._file.close()
+            return None
+
+        return log
+
+    def append(self,record):
+        self._file.write(orjson.dumps(record)+b"\n")
+        self._written+=1
+
+        return self._written
+
+    async def sync(self,upto):
+        """
+            Returns once everything up to the `upto`-th append is on disk
+        """
+        while self._synced<upto:
+            if self._syncing is None:
+                self._syncing=asyncio.ensure_future(self._sync())
+
+            syncing=self._syncing
+            await asyncio.shield(syncing)
+
+    async def _sync(self):
+        target=self._written
+
+        try:
+            self._file.flush()
+
+            if INGEST_LOG_FSYNC:
+                loop=asyncio.get_running_loop()
+                await loop.run_in_executor(None,os.fsync,self._file.fileno())
+
+            self._synced=max(self._synced,target)
+
+        finally:
+            self._syncing=None
+
+    def truncate(self):
+        self._file.flush()
+        self._file.truncate(0)
+        self._file.seek(0)
+
+    def size(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.flush()
+        #closing releases the lock
+        self._file.close()
+
+    @staticmethod
+    def read(path):
+        if not os.path.exists(path):
+            return []
+
+        records=[]
+
+        with open(path,"rb") as log:
+            for line in log:
+                try:
+                    records.append(orjson.loads(line))
+
+                except orjson.JSONDecodeError:
+                    #a torn last line from a crash was never acknowledged
+                    logger.warning("skipping unreadable ingest log line")
+
+        return records
+
+
+class ExerciseIngestor:
+    """
+        Write-behind ingestion for exercises. Handlers append validated rows to the
+        durable log and the queue; a background writer commits them in batches,
+        one transaction per batch, once INGEST_BATCH_SIZE rows are waiting or
+        INGEST_FLUSH_INTERVAL seconds have passed. On start the log is replayed
+        past the checkpoint, so nothing acknowledged is lost or doubled.
+
+        Every process claims a log of its own, with a checkpoint of the same slot,
+        so several API workers never replay or truncate each other's records.
+
+        A batch the database turns away (locked, busy) is retried with backoff. A
+        batch it rejects is split in halves until the rejected records are alone;
+        those go to the dead-letter file (the log path suffixed with .dead), and
+        replay_dead_letters.py commits them once fixed. The checkpoint counts the
+        records processed, committed or dead-lettered; committed_seq only moves for
+        committed ones, and flush() lists the dead-lettered seqs separately.
+    """
+
+    def __init__(self,log_path=INGEST_LOG_PATH,session_factory=AsyncSessionLocal):
+        self.base_log_path=log_path
+        self.log_path=log_path
+        self.checkpoint_name=CHECKPOINT_NAME
+        self.session_factory=session_factory
+        self.log=None
+        self.dead_seqs=[]
+        self.queue=None
+        self.seq=0
+        #every record up to processed_seq is committed or dead-lettered
+        self.processed_seq=0
+        #the last record committed, dead-lettered ones never move it
+        self.committed_seq=0
+        self.replayed=0
+        self.last_commit_at=None
+        self.last_error=None
+        self._writer=None
+        self._committed=None
+
+    @property
+    def running(self):
+        return self._writer is not None and not self._writer.done()
+
+    def _claim(self):
+        for slot in itertools.count():
+            path=self.base_log_path if slot==0 else f"{self.base_log_path}.{slot}"
+            log=AppendLog.claim(path)
+
+            if log is not None:
+                self.log_path=path
+                self.checkpoint_name=CHECKPOINT_NAME if slot==0 else f"{CHECKPOINT_NAME}.{slot}"
+                return log
+
+    async def start(self):
+        self.queue=asyncio.Queue()
+        self._committed=asyncio.Condition()
+        log=self._claim()
+
+        async with self.session_factory() as session:
+            self.processed_seq=await session.scalar(
+                select(IngestCheckpoint.last_seq).where(IngestCheckpoint.name==self.checkpoint_name)
+            ) or 0
+
+        self.dead_seqs=sorted(record["seq"] for record in AppendLog.read(f"{self.log_path}.dead") if record["seq"]<=self.processed_seq)
+        dead=set(self.dead_seqs)
+        self.committed_seq=next((seq for seq in range(self.processed_seq,0,-1) if seq not in dead),0)
+
+        pending=[record for record in AppendLog.read(self.log_path) if record["seq"]>self.processed_seq]
+        self.seq=max([self.processed_seq]+[record["seq"] for record in pending])
+
+        if pending:
+            await self._write(pending)
+            self.replayed=len(pending)
+            logger.info("replayed %d exercises from %s",len(pending),self.log_path)
+
+        self.log=log
+        self.log.truncate()
+
+        self._writer=asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._writer is None:
+            return
+
+        await self.flush()
+
+        self._writer.cancel()
+
+        try:
+            await self._writer
+
+        except asyncio.CancelledError:
+            pass
+
+        self._writer=None
+        self.log.close()
+        self.log=None
+
+    async def submit(self,row):
+        """
+            Makes a row durable and queues it, returns its sequence number
+        """
+        if not self.running:
+            raise IngestNotRunning()
+
+        if self.queue.qsize()>=INGEST_QUEUE_MAX:
+            raise IngestQueueFull()
+
+        self.seq+=1
+        record={"seq":self.seq,**row,"date":row["date"].isoformat() if row["date"] else None}
+
+        written=self.log.append(record)
+        self.queue.put_nowait(record)
+
+        await self.log.sync(written)
+
+        return record["seq"]
+
+    async def flush(self):
+        """
+            Waits until every record submitted so far is committed or dead-lettered.
+            Returns the last committed seq and the dead-lettered seqs up to then.
+        """
+        target=self.seq
+
+        if self._committed is not None:
+            async with self._committed:
+                await self._committed.wait_for(lambda:self.processed_seq>=target or not self.running)
+
+        return {
+            "committed_seq":self.committed_seq,
+            "dead_lettered_seqs":[seq for seq in self.dead_seqs if seq<=target],
+        }
+
+    def health(self):
+        return {
+            "mode":EXERCISE_INGEST_MODE,
+            "running":self.running,
+            "queued":self.queue.qsize() if self.queue else 0,
+            "submitted_seq":self.seq,
+            "committed_seq":self.committed_seq,
+            "processed_seq":self.processed_seq,
+            "replayed_at_start":self.replayed,
+            "log_path":self.log_path,
+            "dead_lettered":len(self.dead_seqs),
+            "log_bytes":self.log.size() if self.log else 0,
+            "last_commit_at":self.last_commit_at,
+            "last_error":self.last_error,
+        }
+
+    async def _run(self):
+        loop=asyncio.get_running_loop()
+
+        while True:
+            batch=[await self.queue.get()]
+            deadline=loop.time()+INGEST_FLUSH_INTERVAL
+
+            while len(batch)<INGEST_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+
+                except asyncio.QueueEmpty:
+                    pass
+
+                timeout=deadline-loop.time()
+
+                if timeout<=0:
+                    break
+
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(),timeout))
+
+                except asyncio.TimeoutError:
+                    break
+
+            await self._write(batch)
+
+    async def _retrying(self,attempt,error,what):
+        """
+            Waits before the next attempt at something the database turned away
+        """
+        self.last_error=repr(error)
+        delay=min(INGEST_RETRY_MAX_DELAY,0.05*2**attempt)
+        logger.warning("%s failed, retrying in %.2fs: %r",what,delay,error)
+
+        await asyncio.sleep(delay)
+
+    async def _write(self,batch):
+        """
+            Commits a batch, retrying while the database turns it away. A batch it
+            rejects is split, so only the records it rejects on their own are set aside.
+        """
+        attempt=0
+
+        while True:
+            try:
+                await self._commit(batch)
+                return
+
+            except Exception as e:
+                if not _transient(e):
+                    error=e
+                    break
+
+                await self._retrying(attempt,e,f"ingest batch of {len(batch)}")
+                attempt+=1
+
+        if len(batch)==1:
+            await self._dead_letter(batch[0],error)
+            return
+
+        logger.warning("ingest batch of %d rejected, splitting it: %r",len(batch),error)
+        middle=len(batch)//2
+
+        await self._write(batch[:middle])
+        await self._write(batch[middle:])
+
+    async def _dead_letter(self,record,error):
+        """
+            Sets a rejected record aside in the dead-letter file and moves the
+            checkpoint past it, so it neither blocks the queue nor comes back on
+            the next replay
+        """
+        path=f"{self.log_path}.dead"
+
+        with _dead_letter_file(path) as dead:
+            dead.write(orjson.dumps({**record,"error":repr(error)})+b"\n")
+            dead.flush()
+            os.fsync(dead.fileno())
+
+        self.dead_seqs.append(record["seq"])
+        self.last_error=repr(error)
+        logger.error("moved ingest record %d to %s: %r",record["seq"],path,error)
+
+        attempt=0
+
+        while True:
+            try:
+                async with self.session_factory() as session:
+                    await self._checkpoint(session,record["seq"])
+                    await session.commit()
+
+                break
+
+            except Exception as e:
+                await self._retrying(attempt,e,"ingest checkpoint")
+                attempt+=1
+
+        await self._processed_upto(record["seq"])
+
+    async def _checkpoint(self,session,last_seq):
+        #never moves back, batches of one log commit in order but replays may overlap
+        checkpoint=sqlite_insert(IngestCheckpoint).values(name=self.checkpoint_name,last_seq=last_seq)
+        await session.execute(checkpoint.on_conflict_do_update(
+            index_elements=[IngestCheckpoint.name],
+            set_={"last_seq":func.max(IngestCheckpoint.last_seq,checkpoint.excluded.last_seq)}
+        ))
+
+    async def _processed_upto(self,last_seq):
+        self.processed_seq=max(self.processed_seq,last_seq)
+
+        if self._committed is not None:
+            async with self._committed:
+                self._committed.notify_all()
+
+        #everything acknowledged is in the database or the dead-letter file, start the log over
+        if self.log is not None and self.processed_seq==self.seq:
+            self.log.truncate()
+
+    async def _commit(self,records):
+        rows=[_record_row(record) for record in records]
+        last_seq=max(record["seq"] for record in records)
+
+        async with self.session_factory() as session:
+            ids,versions=await insert_exercises(session,rows)
+            await self._checkpoint(session,last_seq)
+            await session.commit()
+
+        series_cache.append(rows,ids)
+        leaderboard.record(rows,versions=versions)
+
+        self.committed_seq=max(self.committed_seq,last_seq)
+        self.last_commit_at=time.time()
+        self.last_error=None
+
+        await self._processed_upto(last_seq)
+
+
+async def replay_dead_letters(path,session_factory=AsyncSessionLocal):
+    """
+        Commits the records of a dead-letter file, one transaction each, and puts
+        the ones that fail again back in it. Returns (replayed, failed).
+
+        The records are first moved to a .replaying file, so new dead letters keep
+        landing in the dead-letter file meanwhile. Each replayed record leaves a
+        checkpoint row named after the file and its seq, in its own transaction,
+        so a replay that crashed midway can run again without inserting twice.
+    """
+    pending=f"{path}.replaying"
+
+    if not os.path.exists(pending):
+        with _dead_letter_file(path) as dead:
+            dead.seek(0)
+            content=dead.read()
+
+            if not content:
+                return 0,0
+
+            with open(pending,"wb") as moving:
+                moving.write(content)
+                moving.flush()
+                os.fsync(moving.fileno())
+
+            dead.truncate(0)
+
+    replayed=0
+    failed=[]
+
+    for record in AppendLog.read(pending):
+        marker=f"{os.path.basename(path)}:{record['seq']}"
+
+        try:
+            async with session_factory() as session:
+                if await session.get(IngestCheckpoint,marker) is None:
+                    await insert_exercises(session,[_record_row(record)])
+                    session.add(IngestCheckpoint(name=marker,last_seq=record["seq"]))
+                    await session.commit()
+
+            replayed+=1
+
+        except Exception as e:
+            logger.error("ingest record %d failed again: %r",record["seq"],e)
+            failed.append({**record,"error":repr(e)})
+
+    if failed:
+        with _dead_letter_file(path) as dead:
+            dead.write(b"".join(orjson.dumps(record)+b"\n" for record in failed))
+            dead.flush()
+            os.fsync(dead.fileno())
+
+    os.remove(pending)
+
+    return replayed,len(failed)
+
+
+ingestor=ExerciseIngestor()
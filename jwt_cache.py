@@ -0,0 +1,41 @@
+import hashlib
+import os
+import time
+from fastapi_jwt_auth import AuthJWT
+from cache import TTLCache
+
+
+JWT_CLAIMS_CACHE_SIZE=int(os.getenv("JWT_CLAIMS_CACHE_SIZE","10000"))
+JWT_CLAIMS_CACHE_TTL=float(os.getenv("JWT_CLAIMS_CACHE_TTL","300"))
+
+claims_cache=TTLCache(JWT_CLAIMS_CACHE_SIZE,JWT_CLAIMS_CACHE_TTL)
+
+
+class CachedAuthJWT(AuthJWT):
+    """
+        AuthJWT that remembers the claims of tokens it already verified.
+
+        A request used to decode and HMAC-check the same token up to three times
+        (jwt_required, its type check and get_jwt_subject). Claims are now cached
+        by token digest until the token's `exp`. Only successful verifications are
+        cached, and the denylist check still runs on every request because the
+        library applies it after `_verified_token`.
+    """
+
+    def _verified_token(self,encoded_token,issuer=None):
+        key=(hashlib.sha256(encoded_token.encode()).digest(),issuer)
+
+        claims=claims_cache.get(key)
+
+        if claims is not None:
+            return claims
+
+        claims=super()._verified_token(encoded_token,issuer)
+
+        expires=claims.get("exp")
+        ttl=None if expires is None else expires-time.time()
+
+        if ttl is None or ttl>0:
+            claims_cache.set(key,claims,ttl=ttl)
+
+        return claims
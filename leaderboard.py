@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import os
+from datetime import date,timedelta
+from itertools import islice
+from sortedcontainers import SortedList
+from sqlalchemy import select,func,null,union_all
+from database import AsyncSessionLocal
+from models import User,ExerciseDailyRollup,ExerciseVersion
+
+
+#sliding windows in days, ending today
+LEADERBOARD_WINDOWS={
+    "week":7,
+    "month":30,
+}
+
+LEADERBOARD_MAX_LIMIT=100
+
+#seconds between rebuilds from the rollups, which also picks up writes made by
+#other processes. 0 turns it off
+LEADERBOARD_REBUILD_INTERVAL=float(os.getenv("LEADERBOARD_REBUILD_INTERVAL","300"))
+
+logger=logging.getLogger(__name__)
+
+
+class WindowedLeaderboard:
+    """
+        Calories burned per user over the last `days` days. Calories are kept in
+        daily buckets; the per-user totals of the window sit in a sorted list, so an
+        insert costs O(log n) and top-N or a rank is a slice or a bisect.
+        Buckets before the window are dropped as days pass, and buckets dated in
+        the future only count once their day has come.
+    """
+
+    def __init__(self,days):
+        self.days=days
+        self.today=None
+        self.buckets={}
+        self.totals={}
+        self.ranking=SortedList()
+
+    @property
+    def start(self):
+        return self.today-timedelta(days=self.days-1)
+
+    def _change(self,user_id,delta):
+        if not delta:
+            return
+
+        total=self.totals.get(user_id,0.0)
+
+        if user_id in self.totals:
+            self.ranking.remove((-total,user_id))
+
+        total+=delta
+
+        if abs(total)<1e-9:
+            del self.totals[user_id]
+            return
+
+        self.totals[user_id]=total
+        self.ranking.add((-total,user_id))
+
+    def advance(self,today):
+        """
+            Slides the window so it ends on `today`
+        """
+        if self.today is None:
+            self.today=today
+            return
+
+        if today<=self.today:
+            return
+
+        previous_start,previous_today=self.start,self.today
+        self.today=today
+
+        for day in list(self.buckets):
+            if day<self.start:
+                #only buckets that were inside the old window are in the totals
+                if previous_start<=day<=previous_today:
+                    for user_id,calories in self.buckets[day].items():
+                        self._change(user_id,-calories)
+
+                del self.buckets[day]
+
+            elif previous_today<day<=today:
+                for user_id,calories in self.buckets[day].items():
+                    self._change(user_id,calories)
+
+    def add(self,user_id,day,calories):
+        if day<self.start or not calories:
+            return
+
+        bucket=self.buckets.setdefault(day,{})
+        bucket[user_id]=bucket.get(user_id,0.0)+calories
+
+        if day<=self.today:
+            self._change(user_id,calories)
+
+    def top(self,limit):
+        #competition ranking like rank(), users with the same total share a rank
+        return [
+            {"rank":self.ranking.bisect_left((negative,))+1,"user_id":user_id,"calories_burned":round(-negative,2)}
+            for negative,user_id in islice(self.ranking,limit)
+        ]
+
+    def rank(self,user_id):
+        total=self.totals.get(user_id)
+
+        if total is None:
+            return None
+
+        #competition ranking, users with the same total share a rank
+        return {"rank":self.ranking.bisect_left((-total,))+1,"calories_burned":round(total,2)}
+
+
+class Leaderboard:
+    """
+        The weekly and monthly calorie leaderboards of all users. Filled from the
+        daily rollups at startup and fed by every exercise insert afterwards.
+        Rows recorded while a rebuild reads the rollups are replayed once it has
+        swapped the windows in, so they are not lost with the old windows. The
+        rebuild reads each user's exercise version with the rollups, and a write
+        the rollups already hold (its version is not newer) is not replayed.
+    """
+
+    def __init__(self,session_factory=AsyncSessionLocal):
+        self.session_factory=session_factory
+        self.windows={}
+        self.usernames={}
+        self._refresher=None
+        #rows recorded during a rebuild, None when none is running
+        self._recorded=None
+        self._reset(date.today())
+
+    def _reset(self,today):
+        self.windows={period:WindowedLeaderboard(days) for period,days in LEADERBOARD_WINDOWS.items()}
+
+        for window in self.windows.values():
+            window.advance(today)
+
+    def _advance(self):
+        today=date.today()
+
+        for window in self.windows.values():
+            window.advance(today)
+
+    def record(self,rows,sign=1,versions=None):
+        """
+            Adds committed exercise rows, or takes edited ones out again with sign=-1.
+            `versions` are the users' exercise versions the write committed.
+        """
+        if self._recorded is not None:
+            self._recorded.append((rows,sign,versions))
+
+        self._advance()
+
+        for row in rows:
+            if row["date"] is None or not row["calories_burned"]:
+                continue
+
+            for window in self.windows.values():
+                window.add(row["user_id"],row["date"].date(),sign*row["calories_burned"])
+
+    async def rebuild(self):
+        """
+            Recomputes every window from the daily rollups
+        """
+        today=date.today()
+        start=today-timedelta(days=max(LEADERBOARD_WINDOWS.values())-1)
+
+        self._recorded=[]
+
+        try:
+            #one statement, so the versions match the rollups it reads
+            async with self.session_factory() as session:
+                rows=(await session.execute(union_all(
+                    select(
+                        ExerciseDailyRollup.user_id,
+                        ExerciseDailyRollup.day,
+                        func.sum(ExerciseDailyRollup.calories_burned).label("calories_burned"),
+                        null().label("version")
+                    ).where(ExerciseDailyRollup.day>=start).group_by(ExerciseDailyRollup.user_id,ExerciseDailyRollup.day),
+                    select(ExerciseVersion.user_id,null().label("day"),null().label("calories_burned"),ExerciseVersion.version)
+                ))).all()
+
+        finally:
+            recorded,self._recorded=self._recorded,None
+
+        self._reset(today)
+
+        versions={}
+
+        for user_id,day,calories,version in rows:
+            if version is not None:
+                versions[user_id]=version
+                continue
+
+            for window in self.windows.values():
+                window.add(user_id,day,calories)
+
+        for recorded_rows,sign,written in recorded:
+            if written is not None:
+                recorded_rows=[row for row in recorded_rows if written.get(row["user_id"],0)>versions.get(row["user_id"],0)]
+
+            self.record(recorded_rows,sign)
+
+    async def start(self):
+        await self.rebuild()
+
+        if LEADERBOARD_REBUILD_INTERVAL>0:
+            self._refresher=asyncio.create_task(self._refresh())
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher=None
+
+    async def _refresh(self):
+        while True:
+            await asyncio.sleep(LEADERBOARD_REBUILD_INTERVAL)
+
+            try:
+                await self.rebuild()
+
+            except Exception:
+                logger.exception("leaderboard rebuild failed")
+
+    async def _usernames(self,user_ids):
+        missing=[user_id for user_id in user_ids if user_id not in self.usernames]
+
+        if missing:
+            async with self.session_factory() as session:
+                for user_id,username in await session.execute(select(User.id,User.username).where(User.id.in_(missing))):
+                    self.usernames[user_id]=username
+
+        return self.usernames
+
+    async def standings(self,period,limit,user_id):
+        """
+            Top `limit` users of a period and the rank of `user_id`
+        """
+        self._advance()
+
+        window=self.windows[period]
+        top=window.top(limit)
+        usernames=await self._usernames([entry["user_id"] for entry in top])
+
+        for entry in top:
+            entry["username"]=usernames.get(entry["user_id"])
+
+        return {
+            "period":period,
+            "start":window.start,
+            "end":window.today,
+            "top":top,
+            "me":window.rank(user_id),
+        }
+
+
+leaderboard=Leaderboard()
@@ -1,8 +1,21 @@
-from fastapi import FastAPI
+from fastapi import FastAPI,Response
 from auth_routes import auth_router
 from workout_routes import exercise_router
 from fastapi_jwt_auth import AuthJWT
 from schemas import Settings
+from database import engine,async_engine,read_engine,AsyncSessionLocal,pool_stats
+from crud import warm_username_filter
+from jwt_cache import CachedAuthJWT
+from ingest import ingestor,EXERCISE_INGEST_MODE
+from leaderboard import leaderboard
+from metrics import registry,MetricsMiddleware,instrument_engine,METRICS_ENABLED,CONTENT_TYPE
+from cache import user_cache
+import cache
+from jwt_cache import claims_cache
+from charts import chart_cache
+from series_cache import series_cache
+from query_budget import QueryBudgetMiddleware,watch_engine,QUERY_BUDGET_MODE
+from partitions import exercise_partitions
 import inspect,re
 from fastapi.routing import APIRoute
 from fastapi.openapi.utils import get_openapi
@@ -58,9 +71,83 @@ def custom_openapi():
 app.openapi = custom_openapi
 
 
+settings=Settings()
+
 @AuthJWT.load_config
 def get_config():
-    return Settings()
+    return settings
+
+#every route asks for AuthJWT, hand out the variant that caches verified claims
+app.dependency_overrides[AuthJWT]=CachedAuthJWT
+
+#reads of archived months go to their partitions
+exercise_partitions.install(async_engine)
+exercise_partitions.install(read_engine)
+
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware,router_app=app)
+
+    instrument_engine(engine,"sync")
+    instrument_engine(async_engine,"write")
+    instrument_engine(read_engine,"read")
+
+    @registry.collector
+    def collect_app_stats():
+        caches={
+            "user":user_cache.stats(),
+            "jwt_claims":claims_cache.stats(),
+            "chart":chart_cache.stats(),
+            "series":series_cache.stats(),
+        }
+        pools=pool_stats()
+        ingest=ingestor.health()
+
+        return [
+            ("app_cache_hits_total","counter","Cache hits",[({"cache":name},stats["hits"]) for name,stats in caches.items()]),
+            ("app_cache_misses_total","counter","Cache misses",[({"cache":name},stats.get("misses")) for name,stats in caches.items()]),
+            ("app_username_filter_keys","gauge","Usernames in the availability filter",[({},cache.username_filter.count)]),
+            ("db_pool_checked_out","gauge","Connections checked out of a pool",[({"pool":name},stats["checked_out"]) for name,stats in pools.items()]),
+            ("db_pool_peak_checked_out","gauge","Most connections checked out at once",[({"pool":name},stats["peak_checked_out"]) for name,stats in pools.items()]),
+            ("db_pool_connects_total","counter","Connections opened by a pool",[({"pool":name},stats["connects"]) for name,stats in pools.items()]),
+            ("ingest_queue_depth","gauge","Exercises waiting for the write-behind writer",[({},ingest["queued"])]),
+            ("ingest_committed_seq","gauge","Last ingest log sequence committed",[({},ingest["committed_seq"])]),
+        ]
+
+    @app.get("/metrics",include_in_schema=False)
+    async def metrics():
+        return Response(registry.render(),media_type=CONTENT_TYPE)
+
+
+if QUERY_BUDGET_MODE!="off":
+    app.add_middleware(QueryBudgetMiddleware)
+
+    watch_engine(async_engine)
+    watch_engine(read_engine)
+
+@app.on_event("startup")
+async def start_ingestor():
+    #replays whatever the last run accepted but did not commit
+    if EXERCISE_INGEST_MODE=="write_behind":
+        await ingestor.start()
+
+@app.on_event("startup")
+async def start_leaderboard():
+    await leaderboard.start()
+
+@app.on_event("startup")
+async def load_usernames():
+    async with AsyncSessionLocal() as session:
+        await warm_username_filter(session)
+
+@app.on_event("shutdown")
+async def dispose_engines():
+    await ingestor.stop()
+    await leaderboard.stop()
+
+    #pooled connections keep their aiosqlite threads alive until closed
+    await async_engine.dispose()
+    await read_engine.dispose()
 
 app.include_router(auth_router)
 app.include_router(exercise_router)
@@ -0,0 +1,250 @@
+import bisect
+import contextvars
+import os
+import time
+from sqlalchemy import event
+
+
+METRICS_ENABLED=os.getenv("METRICS_ENABLED","1")=="1"
+
+LATENCY_BUCKETS=(0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0)
+QUERY_BUCKETS=(0.0001,0.00025,0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,1.0)
+COUNT_BUCKETS=(0,1,2,3,5,10,20,50,100)
+
+#starlette appends the charset
+CONTENT_TYPE="text/plain; version=0.0.4"
+
+#statements run and SQL seconds spent by the request being served
+_request_queries=contextvars.ContextVar("request_queries",default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\","\\\\").replace('"','\\"').replace("\n","\\n")
+
+
+def _format_labels(names,values,extra=None):
+    pairs=list(zip(names,values))
+
+    if extra is not None:
+        pairs.append(extra)
+
+    if not pairs:
+        return ""
+
+    return "{"+",".join(f'{name}="{_escape(value)}"' for name,value in pairs)+"}"
+
+
+class Counter:
+    def __init__(self,name,documentation,labels=()):
+        self.name=name
+        self.documentation=documentation
+        self.labels=labels
+        self.type="counter"
+        self._values={}
+
+    def inc(self,*labels,amount=1):
+        self._values[labels]=self._values.get(labels,0)+amount
+
+    def samples(self):
+        for labels,value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels,labels)} {value}"
+
+
+class Gauge(Counter):
+    def __init__(self,name,documentation,labels=()):
+        super().__init__(name,documentation,labels)
+        self.type="gauge"
+
+    def dec(self,*labels,amount=1):
+        self.inc(*labels,amount=-amount)
+
+
+class Histogram:
+    """
+        Cumulative histogram with fixed buckets. An observation is one bisect and
+        two additions, the cumulative counts are only summed on a scrape.
+    """
+
+    def __init__(self,name,documentation,labels=(),buckets=LATENCY_BUCKETS):
+        self.name=name
+        self.documentation=documentation
+        self.labels=labels
+        self.buckets=tuple(buckets)
+        self.type="histogram"
+        self._values={}
+
+    def observe(self,value,*labels):
+        entry=self._values.get(labels)
+
+        if entry is None:
+            entry=self._values[labels]=[[0]*(len(self.buckets)+1),0.0]
+
+        entry[0][bisect.bisect_left(self.buckets,value)]+=1
+        entry[1]+=value
+
+    def samples(self):
+        for labels,(counts,total) in self._values.items():
+            cumulative=0
+
+            for bound,count in zip(self.buckets+("+Inf",),counts):
+                cumulative+=count
+                yield f"{self.name}_bucket{_format_labels(self.labels,labels,('le',bound))} {cumulative}"
+
+            yield f"{self.name}_sum{_format_labels(self.labels,labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels,labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics=[]
+        #callables returning (name, type, help, [(labels dict, value)]) at scrape time
+        self.collectors=[]
+
+    def register(self,metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self,function):
+        self.collectors.append(function)
+        return function
+
+    def render(self):
+        lines=[]
+
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+
+        for function in self.collectors:
+            for name,kind,documentation,samples in function():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+
+                for labels,value in samples:
+                    if value is None:
+                        continue
+
+                    lines.append(f"{name}{_format_labels(tuple(labels),tuple(labels.values()))} {float(value)}")
+
+        return "\n".join(lines)+"\n"
+
+
+registry=Registry()
+
+requests_total=registry.register(Counter(
+    "http_requests_total","Requests served, by route and status code",("method","route","status")
+))
+request_duration=registry.register(Histogram(
+    "http_request_duration_seconds","Time from receiving a request to sending the end of its response",("method","route")
+))
+requests_in_flight=registry.register(Gauge(
+    "http_requests_in_flight","Requests being served"
+))
+request_queries=registry.register(Histogram(
+    "http_request_db_queries","SQL statements run per request",("method","route"),COUNT_BUCKETS
+))
+request_query_duration=registry.register(Histogram(
+    "http_request_db_seconds","SQL time per request",("method","route")
+))
+queries_total=registry.register(Counter(
+    "db_queries_total","SQL statements run, by engine",("engine",)
+))
+query_duration=registry.register(Histogram(
+    "db_query_duration_seconds","Duration of single SQL statements, by engine",("engine",),QUERY_BUCKETS
+))
+
+
+def instrument_engine(engine,name):
+    """
+        Times every statement an engine runs, async engines through their sync_engine
+    """
+    sync_engine=getattr(engine,"sync_engine",engine)
+
+    #the start time lives on the statement's execution context, which goes away with
+    #it, so a statement that raises leaves nothing behind on the connection
+    def before_cursor_execute(conn,cursor,statement,parameters,context,executemany):
+        if context is not None:
+            context._metrics_query_start=time.perf_counter()
+
+    def after_cursor_execute(conn,cursor,statement,parameters,context,executemany):
+        start=getattr(context,"_metrics_query_start",None)
+
+        if start is None:
+            return
+
+        elapsed=time.perf_counter()-start
+
+        queries_total.inc(name)
+        query_duration.observe(elapsed,name)
+
+        stats=_request_queries.get()
+
+        if stats is not None:
+            stats[0]+=1
+            stats[1]+=elapsed
+
+    event.listen(sync_engine,"before_cursor_execute",before_cursor_execute)
+    event.listen(sync_engine,"after_cursor_execute",after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """
+        ASGI middleware recording latency, status codes, in-flight requests and the
+        SQL run by each request. It wraps `send` only, so streamed bodies pass through.
+
+        Series are labelled with the route's path template, so /items/1 and /items/2
+        share one. The router leaves the matched endpoint in the scope, and its
+        template is looked up once per endpoint.
+    """
+
+    def __init__(self,app,router_app):
+        self.app=app
+        self.router_app=router_app
+        self._routes=None
+
+    def route_name(self,scope):
+        endpoint=scope.get("endpoint")
+
+        if endpoint is None:
+            return "unmatched"
+
+        if self._routes is None or endpoint not in self._routes:
+            self._routes={
+                getattr(route,"endpoint",None):route.path
+                for route in self.router_app.router.routes
+                if hasattr(route,"path")
+            }
+
+        return self._routes.get(endpoint,"unmatched")
+
+    async def __call__(self,scope,receive,send):
+        if scope["type"]!="http":
+            await self.app(scope,receive,send)
+            return
+
+        method=scope["method"]
+        status=[500]
+        stats=[0,0.0]
+        token=_request_queries.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"]=="http.response.start":
+                status[0]=message["status"]
+
+            await send(message)
+
+        requests_in_flight.inc()
+        start=time.perf_counter()
+
+        try:
+            await self.app(scope,receive,send_wrapper)
+
+        finally:
+            route=self.route_name(scope)
+            request_duration.observe(time.perf_counter()-start,method,route)
+            requests_in_flight.dec()
+            requests_total.inc(method,route,str(status[0]))
+            request_queries.observe(stats[0],method,route)
+            request_query_duration.observe(stats[1],method,route)
+            _request_queries.reset(token)
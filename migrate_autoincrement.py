@@ -0,0 +1,66 @@
+"""
+    Rebuilds the exercises table of an existing database with AUTOINCREMENT, so
+    SQLite never hands out the id of a deleted row again. Archiving months with
+    partition_exercises.py and the batch inserts, which reserve their ids up
+    front, rely on it. Rows, ids and indexes are kept.
+
+        python migrate_autoincrement.py
+        python migrate_autoincrement.py --dry-run
+"""
+import argparse
+from sqlalchemy import inspect,insert,select,func,text
+from database import engine
+from models import Exercise,ExercisePartition
+from partitions import uses_autoincrement
+
+exercises=Exercise.__table__
+
+
+def main(dry_run):
+    with engine.connect() as connection:
+        if uses_autoincrement(connection):
+            print("exercises already uses AUTOINCREMENT")
+            return
+
+        triggers=connection.execute(text("SELECT name FROM sqlite_master WHERE type='trigger' AND tbl_name='exercises'")).scalars().all()
+
+    if triggers:
+        #dropping the table would drop them, run partition_exercises.py to the end first
+        raise SystemExit(f"exercises still has the triggers {', '.join(triggers)}")
+
+    if dry_run:
+        print("would rebuild exercises with AUTOINCREMENT")
+        return
+
+    with engine.begin() as connection:
+        table=exercises.to_metadata(exercises.metadata,name="exercises_autoincrement")
+        table.indexes.clear()
+        table.create(connection)
+
+        columns=[column.name for column in exercises.columns]
+        copied=connection.execute(insert(table).from_select(columns,select(*exercises.columns).order_by(exercises.c.id))).rowcount
+
+        #ids of deleted and archived rows stay used up
+        last_id=connection.execute(select(func.max(exercises.c.id))).scalar() or 0
+
+        if inspect(connection).has_table(ExercisePartition.__tablename__):
+            last_id=max(last_id,connection.execute(select(func.max(ExercisePartition.max_id))).scalar() or 0)
+
+        connection.execute(text("DROP TABLE exercises"))
+        connection.execute(text("ALTER TABLE exercises_autoincrement RENAME TO exercises"))
+
+        for index in exercises.indexes:
+            index.create(connection)
+
+        connection.execute(text("DELETE FROM sqlite_sequence WHERE name='exercises'"))
+        connection.execute(text("INSERT INTO sqlite_sequence (name,seq) VALUES ('exercises',:last_id)"),{"last_id":last_id})
+
+    print(f"rebuilt exercises with AUTOINCREMENT, {copied} rows, next id {last_id+1}")
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run",action="store_true",help="only print whether the table would be rebuilt")
+    args=parser.parse_args()
+
+    main(args.dry_run)
@@ -0,0 +1,74 @@
+"""
+    Brings the indexes of an existing database in line with models.py.
+    Indexes the models no longer declare are dropped, declared ones that are
+    missing are created, then ANALYZE refreshes the planner statistics.
+
+        python migrate_indexes.py
+        python migrate_indexes.py --dry-run
+"""
+import argparse
+from sqlalchemy import inspect,text
+from database import engine,Base
+import models
+
+
+def plan(connection):
+    """
+        Returns the index names to drop and the Index objects to create
+    """
+    inspector=inspect(connection)
+    tables=set(inspector.get_table_names())
+
+    to_drop=[]
+    to_create=[]
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+
+        existing={index["name"] for index in inspector.get_indexes(table.name)}
+        columns={column["name"] for column in inspector.get_columns(table.name)}
+        declared={index.name:index for index in table.indexes}
+
+        to_drop.extend(name for name in sorted(existing) if name not in declared)
+
+        for name,index in sorted(declared.items()):
+            if name in existing:
+                continue
+
+            if not {column.name for column in index.columns}<=columns:
+                print(f"skipping {name}: {table.name} lacks some of its columns")
+                continue
+
+            to_create.append(index)
+
+    return to_drop,to_create
+
+
+def main(dry_run):
+    with engine.begin() as connection:
+        to_drop,to_create=plan(connection)
+
+        for name in to_drop:
+            print(f"drop index {name}")
+            if not dry_run:
+                connection.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+
+        for index in to_create:
+            print(f"create index {index.name}")
+            if not dry_run:
+                index.create(connection)
+
+        if not dry_run and (to_drop or to_create):
+            connection.execute(text("ANALYZE"))
+
+    if not (to_drop or to_create):
+        print("indexes already match the models")
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run",action="store_true",help="only print what would change")
+    args=parser.parse_args()
+
+    main(args.dry_run)
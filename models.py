@@ -1,9 +1,27 @@
-from sqlalchemy import Float, DateTime
+from sqlalchemy import Float, DateTime, Date
 from sqlalchemy_utils import ChoiceType
 from database import Base
-from sqlalchemy import Column, Integer, Boolean, Text, String, ForeignKey
+from sqlalchemy import Column, Integer, Boolean, Text, String, ForeignKey, Index, Table
 from sqlalchemy.orm import relationship
-from datetime import datetime
+from datetime import datetime, timezone
+
+
+def naive_utc(value):
+    """
+        Exercise dates are stored naive, in UTC. An offset-aware datetime is converted
+        to UTC and loses its offset; a naive one is taken to be UTC already.
+    """
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class PartitionedTable(Table):
+    """
+        Table class of the exercises table. partitions.py tags it in the SQL it
+        compiles to, so reads can be routed to the archived months.
+    """
+    inherit_cache = True
 
 
 class User(Base):
@@ -28,18 +46,112 @@ class Exercise(Base):
         ('Plank', 'plank'),
     )
 
+    INTENSITY_LEVELS = (
+        ('low', 'Low'),
+        ('medium', 'Medium'),
+        ('high', 'High'),
+    )
+
     __tablename__ = "exercises"
-    id = Column(Integer, primary_key=True, index=True)
-    date = Column(DateTime, index=True)  
+    __table_cls__ = PartitionedTable
+    id = Column(Integer, primary_key=True)
+    date = Column(DateTime)
     exercise_name = Column(ChoiceType(choices=EXERCISES_TYPES), default="PUSHUPS", nullable=False)
     sets = Column(Integer, nullable=False)
     repetitions = Column(Integer)
-    weight_lifted = Column(Float, index=True)
-    distance_covered = Column(Float, index=True)
-    calories_burned = Column(Float, index=True)
-    intensity_level = Column(ChoiceType([("low", "Low"), ("medium", "Medium"), ("high", "High")]), index=True)
+    weight_lifted = Column(Float)
+    distance_covered = Column(Float)
+    calories_burned = Column(Float)
+    intensity_level = Column(ChoiceType(INTENSITY_LEVELS))
     user_id = Column(Integer, ForeignKey('user.id'))
     user = relationship("User", back_populates="exercises")
 
+    #every read is "this user, this date range", so one composite index serves them all
+    #and each insert only updates it and the primary key. Totals come from the rollups.
+    #AUTOINCREMENT keeps the ids of deleted (archived) rows from being handed out again.
+    __table_args__ = (
+        Index("ix_exercises_user_date_id", "user_id", "date", "id"),
+        {"sqlite_autoincrement": True},
+    )
+
     def __repr__(self):
         return f"<Exercise {self.id}>"
+
+
+class ExerciseDailyRollup(Base):
+    """
+        Per user, day and exercise totals of the exercises table.
+        Kept up to date in the same transaction as every exercise write.
+    """
+    __tablename__ = "exercise_daily_rollups"
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    exercise_name = Column(ChoiceType(choices=Exercise.EXERCISES_TYPES), primary_key=True)
+    exercises = Column(Integer, nullable=False, default=0)
+    sets = Column(Integer, nullable=False, default=0)
+    repetitions = Column(Integer, nullable=False, default=0)
+    calories_burned = Column(Float, nullable=False, default=0)
+    distance_covered = Column(Float, nullable=False, default=0)
+    weight_lifted = Column(Float, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ExerciseDailyRollup {self.user_id} {self.day} {self.exercise_name}>"
+
+
+class PersonalRecord(Base):
+    """
+        Best weight, repetitions and distance of a user per exercise.
+        Kept up to date in the same transaction as every exercise write.
+    """
+    __tablename__ = "personal_records"
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    exercise_name = Column(ChoiceType(choices=Exercise.EXERCISES_TYPES), primary_key=True)
+    weight_lifted = Column(Float)
+    repetitions = Column(Integer)
+    distance_covered = Column(Float)
+
+    def __repr__(self):
+        return f"<PersonalRecord {self.user_id} {self.exercise_name}>"
+
+
+class ExercisePartition(Base):
+    """
+        A month of exercises moved out of the exercises table into its own
+        read-only table. Rows of the month with an id up to max_id live there.
+    """
+    __tablename__ = "exercise_partitions"
+    name = Column(String(40), primary_key=True)
+    start = Column(Date, nullable=False, unique=True)
+    end = Column(Date, nullable=False)
+    rows = Column(Integer, nullable=False, default=0)
+    max_id = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<ExercisePartition {self.name}>"
+
+
+class IngestCheckpoint(Base):
+    """
+        Last append-log sequence number processed by the write-behind ingestor.
+        Written in the same transaction as the rows, so a replay never inserts twice.
+        A replayed dead letter leaves a row named after its file and seq.
+    """
+    __tablename__ = "ingest_checkpoints"
+    name = Column(String(50), primary_key=True)
+    last_seq = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<IngestCheckpoint {self.name} {self.last_seq}>"
+
+
+class ExerciseVersion(Base):
+    """
+        Per user count of exercise writes, bumped in the same transaction as every
+        insert and edit. The series cache compares it with the count it was built at.
+    """
+    __tablename__ = "exercise_versions"
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ExerciseVersion {self.user_id} {self.version}>"
@@ -3,7 +3,10 @@ from fastapi.exceptions import HTTPException
 from fastapi_jwt_auth import AuthJWT
 from models import User,Order
 from schemas import OrderModel,OrderStatusModel
-from database import Session , engine
+from database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from fastapi.encoders import jsonable_encoder
 
 order_router=APIRouter(
@@ -12,8 +15,6 @@ order_router=APIRouter(
 )
 
 
-session=Session(bind=engine)
-
 @order_router.get('/')
 async def hello(Authorize:AuthJWT=Depends()):
 
@@ -34,7 +35,7 @@ async def hello(Authorize:AuthJWT=Depends()):
 
 
 @order_router.post('/order',status_code=status.HTTP_201_CREATED)
-async def place_an_order(order:OrderModel,Authorize:AuthJWT=Depends()):
+async def place_an_order(order:OrderModel,Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
     """
         ## Placing an Order
         This requires the following
@@ -55,7 +56,7 @@ async def place_an_order(order:OrderModel,Authorize:AuthJWT=Depends()):
 
     current_user=Authorize.get_jwt_subject()
 
-    user=session.query(User).filter(User.username==current_user).first()
+    user=await session.scalar(select(User).where(User.username==current_user))
 
 
     new_order=Order(
@@ -67,7 +68,7 @@ async def place_an_order(order:OrderModel,Authorize:AuthJWT=Depends()):
 
     session.add(new_order)
 
-    session.commit()
+    await session.commit()
 
 
     response={
@@ -83,7 +84,7 @@ async def place_an_order(order:OrderModel,Authorize:AuthJWT=Depends()):
 
     
 @order_router.get('/orders')
-async def list_all_orders(Authorize:AuthJWT=Depends()):
+async def list_all_orders(Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
     """
         ## List all orders
         This lists all  orders made. It can be accessed by superusers
@@ -101,10 +102,10 @@ async def list_all_orders(Authorize:AuthJWT=Depends()):
 
     current_user=Authorize.get_jwt_subject()
 
-    user=session.query(User).filter(User.username==current_user).first()
+    user=await session.scalar(select(User).where(User.username==current_user))
 
     if user.is_staff:
-        orders=session.query(Order).all()
+        orders=(await session.execute(select(Order))).scalars().all()
 
         return jsonable_encoder(orders)
 
@@ -114,7 +115,7 @@ async def list_all_orders(Authorize:AuthJWT=Depends()):
 
 
 @order_router.get('/orders/{id}')
-async def get_order_by_id(id:int,Authorize:AuthJWT=Depends()):
+async def get_order_by_id(id:int,Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
     """
         ## Get an order by its ID
         This gets an order by its ID and is only accessed by a superuser
@@ -133,10 +134,10 @@ async def get_order_by_id(id:int,Authorize:AuthJWT=Depends()):
 
     user=Authorize.get_jwt_subject()
 
-    current_user=session.query(User).filter(User.username==user).first()
+    current_user=await session.scalar(select(User).where(User.username==user))
 
     if current_user.is_staff:
-        order=session.query(Order).filter(Order.id==id).first()
+        order=await session.scalar(select(Order).where(Order.id==id))
 
         return jsonable_encoder(order)
 
@@ -147,7 +148,7 @@ async def get_order_by_id(id:int,Authorize:AuthJWT=Depends()):
 
     
 @order_router.get('/user/orders')
-async def get_user_orders(Authorize:AuthJWT=Depends()):
+async def get_user_orders(Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
     """
         ## Get a current user's orders
         This lists the orders made by the currently logged in users
@@ -166,13 +167,13 @@ async def get_user_orders(Authorize:AuthJWT=Depends()):
     user=Authorize.get_jwt_subject()
 
 
-    current_user=session.query(User).filter(User.username==user).first()
+    current_user=await session.scalar(select(User).options(selectinload(User.orders)).where(User.username==user))
 
     return jsonable_encoder(current_user.orders)
 
 
 @order_router.get('/user/order/{id}/')
-async def get_specific_order(id:int,Authorize:AuthJWT=Depends()):
+async def get_specific_order(id:int,Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
     """
         ## Get a specific order by the currently logged in user
         This returns an order by ID for the currently logged in user
@@ -189,21 +190,21 @@ async def get_specific_order(id:int,Authorize:AuthJWT=Depends()):
 
     subject=Authorize.get_jwt_subject()
 
-    current_user=session.query(User).filter(User.username==subject).first()
+    #one query for the order itself instead of loading every order of the user
+    order=await session.scalar(
+        select(Order).join(User,User.orders).where(Order.id==id,User.username==subject)
+    )
 
-    orders=current_user.orders
+    if order is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No order with such id"
+        )
 
-    for o in orders:
-        if o.id == id:
-            return jsonable_encoder(o)
-    
-    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-        detail="No order with such id"
-    )
+    return jsonable_encoder(order)
 
 
 @order_router.put('/order/update/{id}/')
-async def update_order(id:int,order:OrderModel,Authorize:AuthJWT=Depends()):
+async def update_order(id:int,order:OrderModel,Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
     """
         ## Updating an order
         This udates an order and requires the following fields
@@ -218,12 +219,12 @@ async def update_order(id:int,order:OrderModel,Authorize:AuthJWT=Depends()):
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail="Invalid Token")
 
-    order_to_update=session.query(Order).filter(Order.id==id).first()
+    order_to_update=await session.scalar(select(Order).where(Order.id==id))
 
     order_to_update.quantity=order.quantity
     order_to_update.pizza_size=order.pizza_size
 
-    session.commit()
+    await session.commit()
 
 
     response={
@@ -239,7 +240,7 @@ async def update_order(id:int,order:OrderModel,Authorize:AuthJWT=Depends()):
 @order_router.patch('/order/update/{id}/')
 async def update_order_status(id:int,
         order:OrderStatusModel,
-        Authorize:AuthJWT=Depends()):
+        Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
 
 
     """
@@ -254,14 +255,14 @@ async def update_order_status(id:int,
 
     username=Authorize.get_jwt_subject()
 
-    current_user=session.query(User).filter(User.username==username).first()
+    current_user=await session.scalar(select(User).where(User.username==username))
 
     if current_user.is_staff:
-        order_to_update=session.query(Order).filter(Order.id==id).first()
+        order_to_update=await session.scalar(select(Order).where(Order.id==id))
 
         order_to_update.order_status=order.order_status
 
-        session.commit()
+        await session.commit()
 
         response={
                 "id":order_to_update.id,
@@ -274,7 +275,7 @@ async def update_order_status(id:int,
 
 
 @order_router.delete('/order/delete/{id}/',status_code=status.HTTP_204_NO_CONTENT)
-async def delete_an_order(id:int,Authorize:AuthJWT=Depends()):
+async def delete_an_order(id:int,Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
 
     """
         ## Delete an Order
@@ -288,10 +289,10 @@ async def delete_an_order(id:int,Authorize:AuthJWT=Depends()):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail="Invalid Token")
 
 
-    order_to_delete=session.query(Order).filter(Order.id==id).first()
+    order_to_delete=await session.scalar(select(Order).where(Order.id==id))
 
-    session.delete(order_to_delete)
+    await session.delete(order_to_delete)
 
-    session.commit()
+    await session.commit()
 
     return order_to_delete
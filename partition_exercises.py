@@ -0,0 +1,73 @@
+"""
+    Moves every month of exercises older than the hot window (EXERCISE_HOT_MONTHS,
+    the current month included) out of the exercises table into its own read-only
+    table. Each month is copied and registered in one transaction; once the API
+    processes had time to load the new partitions (--grace seconds) the copied
+    rows are deleted from the exercises table.
+
+        python partition_exercises.py
+        python partition_exercises.py --hot-months 6 --dry-run
+        python partition_exercises.py --vacuum
+"""
+import argparse
+import time
+from sqlalchemy import text
+from database import engine
+from models import ExercisePartition
+from partitions import EXERCISE_HOT_MONTHS,EXERCISE_PARTITION_REFRESH,archive_month,drop_archived,months_to_archive,partition_name,uses_autoincrement
+
+
+def main(hot_months,grace,dry_run,vacuum):
+    ExercisePartition.__table__.create(engine,checkfirst=True)
+
+    with engine.connect() as connection:
+        if not uses_autoincrement(connection):
+            raise SystemExit("the exercises table lacks AUTOINCREMENT, run python migrate_autoincrement.py first")
+
+        months=months_to_archive(connection,hot_months)
+
+    if dry_run:
+        for start in months:
+            print(f"would archive {partition_name(start)}")
+
+        return
+
+    archived=0
+
+    for start in months:
+        with engine.begin() as connection:
+            partition=archive_month(connection,start)
+
+        if partition is None:
+            continue
+
+        with engine.begin() as connection:
+            connection.execute(text(f"ANALYZE {partition.name}"))
+
+        archived+=1
+        print(f"archived {partition.name}, rows up to id {partition.max_id}")
+
+    if archived:
+        print(f"waiting {grace:g}s for the API processes to load the new partitions")
+        time.sleep(grace)
+
+    with engine.begin() as connection:
+        deleted=drop_archived(connection)
+
+    print(f"deleted {deleted} archived exercises from the exercises table")
+
+    if vacuum and deleted:
+        #gives the pages freed in the exercises table back to the file system
+        with engine.connect() as connection:
+            connection.execute(text("VACUUM"))
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hot-months",type=int,default=EXERCISE_HOT_MONTHS,help="months kept in the exercises table")
+    parser.add_argument("--grace",type=float,default=EXERCISE_PARTITION_REFRESH*2+5,help="seconds between archiving and deleting the copied rows")
+    parser.add_argument("--dry-run",action="store_true",help="only print the months that would move")
+    parser.add_argument("--vacuum",action="store_true",help="VACUUM the database afterwards")
+    args=parser.parse_args()
+
+    main(args.hot_months,args.grace,args.dry_run,args.vacuum)
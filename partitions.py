@@ -0,0 +1,450 @@
+import os
+import re
+import time
+import weakref
+from datetime import date,datetime
+from sqlalchemy import Table,MetaData,Index,select,insert,delete,func,event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import operators,visitors
+from sqlalchemy.sql.elements import BinaryExpression,BindParameter,BooleanClauseList,Tuple
+from sqlalchemy.sql.selectable import Select
+from sqlalchemy.sql.util import find_tables
+from models import Exercise,ExercisePartition,PartitionedTable,naive_utc
+
+
+#months kept in the exercises table, the current one included. Older months are
+#moved to their own read-only table by partition_exercises.py
+EXERCISE_HOT_MONTHS=int(os.getenv("EXERCISE_HOT_MONTHS","3"))
+
+#seconds between checks for new partitions, on connection checkout
+EXERCISE_PARTITION_REFRESH=float(os.getenv("EXERCISE_PARTITION_REFRESH","5"))
+
+exercises=Exercise.__table__
+
+#tags the exercises table wherever a query reads from it, so the router can swap
+#it for the partitions without parsing the SQL. Rendered as a comment
+MARKER="/*partitioned*/ "
+
+_marked=re.compile(re.escape(MARKER)+r"exercises( AS (\w+))?")
+
+
+@compiles(PartitionedTable)
+def _mark_exercises(element,compiler,**kw):
+    text=compiler.visit_table(element,**kw)
+
+    #UPDATE and DELETE target the hot table only, archived months are read-only
+    if kw.get("asfrom") and not kw.get("iscrud"):
+        return MARKER+text
+
+    return text
+
+
+class PartitionRoutingError(Exception):
+    """
+        A statement reads the exercises table in a form the router cannot rewrite
+    """
+
+
+class IdsReusable(Exception):
+    """
+        The exercises table could hand the ids of deleted rows out again
+    """
+
+
+def month_start(day):
+    return date(day.year,day.month,1)
+
+
+def add_months(day,months):
+    month=day.year*12+day.month-1+months
+
+    return date(month//12,month%12+1,1)
+
+
+def partition_name(start):
+    return f"exercises_{start:%Y_%m}"
+
+
+def partition_table(name):
+    """
+        A table with the exercises columns and index, for one archived month
+    """
+    return Table(
+        name,MetaData(),
+        *(column.copy() for column in exercises.columns),
+        Index(f"ix_{name}_user_date_id","user_id","date","id")
+    )
+
+
+def _as_datetime(value):
+    #partition bounds are naive UTC like the stored dates, so offset-aware bounds are converted
+    if isinstance(value,datetime):
+        return naive_utc(value)
+
+    if isinstance(value,date):
+        return datetime(value.year,value.month,value.day)
+
+    return None
+
+
+def _literal(moment):
+    #the format SQLAlchemy stores SQLite DateTime columns in
+    return f"'{moment:%Y-%m-%d %H:%M:%S.%f}'"
+
+
+def _conjuncts(clause):
+    if isinstance(clause,BooleanClauseList) and clause.operator is operators.and_:
+        for inner in clause.clauses:
+            yield from _conjuncts(inner)
+
+    elif clause is not None:
+        yield clause
+
+
+def _is_date(column):
+    return getattr(column,"table",None) is exercises and column.name=="date"
+
+
+class Partition:
+    def __init__(self,name,start,end,max_id):
+        self.name=name
+        self.start=start
+        self.end=end
+        self.max_id=max_id
+        self.start_at=_as_datetime(start)
+        self.end_at=_as_datetime(end)
+
+
+class PartitionRouter:
+    """
+        Routes reads of the exercises table to the partitions they need.
+
+        The exercises table keeps the recent months and every row written since;
+        older months are moved to read-only tables listed in exercise_partitions.
+        Just before a statement reading exercises is sent, its date bounds are taken
+        from the WHERE clause (date comparisons and (date, id) cursors, joined by
+        AND) and the table is replaced by a UNION ALL of itself and the overlapping
+        partitions. A statement without bounds reads every partition. SQLite pushes
+        the outer WHERE down into each branch, so each one seeks its own index.
+
+        While a month is being archived its rows are in both places, so the hot
+        branch leaves out the rows a partition holds (its month, up to its max_id).
+        The exercises table uses AUTOINCREMENT, so ids are never handed out twice
+        and that bound stays exact.
+        The registry is reloaded on connection checkout, at most every `refresh`
+        seconds and only once the schema changed, which every archived month does.
+    """
+
+    def __init__(self,refresh=EXERCISE_PARTITION_REFRESH):
+        self.refresh=refresh
+        self.partitions=[]
+        self.schema_version=None
+        self._checked=None
+        self._unions={}
+        self._plans=weakref.WeakKeyDictionary()
+        self.rewrites=0
+        self.partitions_read=0
+
+    def install(self,engine):
+        sync_engine=getattr(engine,"sync_engine",engine)
+
+        event.listen(sync_engine,"checkout",self._checkout)
+        event.listen(sync_engine,"before_cursor_execute",self._route,retval=True)
+
+    def _checkout(self,dbapi_connection,connection_record,connection_proxy):
+        now=time.monotonic()
+
+        if self._checked is not None and now-self._checked<self.refresh:
+            return
+
+        self._checked=now
+        cursor=dbapi_connection.cursor()
+
+        try:
+            cursor.execute("PRAGMA schema_version")
+            schema_version=cursor.fetchone()[0]
+
+            if schema_version==self.schema_version:
+                return
+
+            cursor.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name='exercise_partitions'")
+            rows=[]
+
+            if cursor.fetchone()[0]:
+                cursor.execute("SELECT name,start,\"end\",max_id FROM exercise_partitions ORDER BY start")
+                rows=cursor.fetchall()
+
+        finally:
+            cursor.close()
+
+        self.load([
+            Partition(name,date.fromisoformat(str(start)[:10]),date.fromisoformat(str(end)[:10]),max_id)
+            for name,start,end,max_id in rows
+        ])
+        self.schema_version=schema_version
+
+    def load(self,partitions):
+        self.partitions=partitions
+        self._unions={}
+
+    def _plan(self,compiled):
+        """
+            Where the date bounds of a compiled statement come from: per SELECT reading
+            exercises, the parameters (or literal values) of its lower and upper bounds.
+            Worked out once per compiled statement, which SQLAlchemy caches.
+        """
+        plan=[]
+
+        def source(bind):
+            if not isinstance(bind,BindParameter):
+                return None
+
+            return ("parameter",compiled.bind_names[bind]) if bind in compiled.bind_names else ("value",bind.effective_value)
+
+        for element in visitors.iterate(compiled.statement):
+            if not isinstance(element,Select):
+                continue
+
+            if not any(exercises in find_tables(from_) for from_ in element.get_final_froms()):
+                continue
+
+            lows,highs=[],[]
+
+            for clause in _conjuncts(element.whereclause):
+                if not isinstance(clause,BinaryExpression):
+                    continue
+
+                left,right,operator=clause.left,clause.right,clause.operator
+
+                #keyset cursors compare (date, id) tuples, the date bounds the tuple
+                if isinstance(left,Tuple) and isinstance(right,Tuple) and left.clauses and _is_date(left.clauses[0]):
+                    left,right=left.clauses[0],right.clauses[0]
+
+                    if operator is operators.eq:
+                        operator=None
+
+                bound=source(right)
+
+                if not _is_date(left) or bound is None:
+                    continue
+
+                if operator in (operators.ge,operators.gt,operators.eq):
+                    lows.append(bound)
+
+                if operator in (operators.le,operators.lt,operators.eq):
+                    highs.append(bound)
+
+            plan.append((lows,highs))
+
+        return plan
+
+    def bounds(self,context):
+        """
+            Earliest and latest date a statement can read, None when unbounded
+        """
+        compiled=context.compiled
+        plan=self._plans.get(compiled)
+
+        if plan is None:
+            plan=self._plans[compiled]=self._plan(compiled)
+
+        parameters=context.compiled_parameters[0] if context.compiled_parameters else {}
+
+        def values(sources):
+            values=(_as_datetime(parameters.get(key) if kind=="parameter" else key) for kind,key in sources)
+            return [value for value in values if value is not None]
+
+        lowest,highest=[],[]
+
+        for lows,highs in plan:
+            lows,highs=values(lows),values(highs)
+
+            #one unbounded SELECT opens that side for the whole statement
+            lowest.append(max(lows) if lows else None)
+            highest.append(min(highs) if highs else None)
+
+        low=None if None in lowest or not lowest else min(lowest)
+        high=None if None in highest or not highest else max(highest)
+
+        return low,high
+
+    def select(self,low,high):
+        """
+            The partitions overlapping [low, high]
+        """
+        low,high=_as_datetime(low),_as_datetime(high)
+
+        return tuple(
+            partition for partition in self.partitions
+            if (low is None or low<partition.end_at) and (high is None or high>=partition.start_at)
+        )
+
+    def _union(self,partitions):
+        key=tuple(partition.name for partition in partitions)
+        union=self._unions.get(key)
+
+        if union is None:
+            columns=", ".join(column.name for column in exercises.columns)
+            archived=" AND ".join(
+                f"(id > {partition.max_id} OR date IS NULL OR date < {_literal(partition.start_at)} OR date >= {_literal(partition.end_at)})"
+                for partition in partitions
+            )
+            branches=[f"SELECT {columns} FROM exercises WHERE {archived}"]
+            branches.extend(f"SELECT {columns} FROM {partition.name}" for partition in partitions)
+
+            union=self._unions[key]="("+" UNION ALL ".join(branches)+")"
+
+        return union
+
+    def _route(self,conn,cursor,statement,parameters,context,executemany):
+        if not self.partitions or context is None or context.compiled is None or MARKER not in statement:
+            return statement,parameters
+
+        partitions=self.select(*self.bounds(context))
+
+        if not partitions:
+            return statement,parameters
+
+        union=self._union(partitions)
+        self.rewrites+=1
+        self.partitions_read+=len(partitions)
+
+        markers=statement.count(MARKER)
+        statement,routed=_marked.subn(lambda match:f"{union} AS {match.group(2) or 'exercises'}",statement)
+
+        #reading only the exercises table would silently leave the archived months out
+        if routed!=markers:
+            raise PartitionRoutingError(f"{markers-routed} of {markers} reads of exercises could not be routed: {statement}")
+
+        return statement,parameters
+
+    def hot_start(self):
+        """
+            End of the newest partition, reads from then on only need the exercises table
+        """
+        return self.partitions[-1].end_at if self.partitions else None
+
+    def read_only(self,exercise_date,exercise_id):
+        """
+            Whether an exercise lives in an archived partition
+        """
+        exercise_date=_as_datetime(exercise_date)
+
+        if exercise_date is None:
+            return False
+
+        return any(
+            partition.start_at<=exercise_date<partition.end_at and exercise_id<=partition.max_id
+            for partition in self.partitions
+        )
+
+    def stats(self):
+        return {
+            "partitions":len(self.partitions),
+            "rewrites":self.rewrites,
+            "partitions_read":self.partitions_read,
+        }
+
+
+def archive_month(connection,start):
+    """
+        Copies one month of exercises into a new read-only partition table and
+        registers it, in the caller's transaction. The rows stay in the exercises
+        table until drop_archived, so routers that have not seen the partition yet
+        still find them; a trigger rejects updates of them meanwhile, which the
+        partition would not see. Returns the partition, or None for an empty month.
+    """
+    end=add_months(start,1)
+    name=partition_name(start)
+    table=partition_table(name)
+    indexes=list(table.indexes)
+    table.indexes.clear()
+    table.create(connection)
+
+    #written in index order, so both the table and its index end up densely packed
+    copied=connection.execute(insert(table).from_select(
+        [column.name for column in exercises.columns],
+        select(*exercises.columns).where(
+            exercises.c.date>=_as_datetime(start),exercises.c.date<_as_datetime(end)
+        ).order_by(exercises.c.user_id,exercises.c.date,exercises.c.id)
+    )).rowcount
+
+    if not copied:
+        table.drop(connection)
+        return None
+
+    for index in indexes:
+        index.create(connection)
+
+    for action in ("INSERT","UPDATE","DELETE"):
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER {name}_read_only_{action.lower()} BEFORE {action} ON {name} "
+            f"BEGIN SELECT RAISE(ABORT,'{name} is a read-only partition'); END"
+        )
+
+    #nothing else writes during this transaction, so later rows of the month have larger ids
+    max_id=connection.execute(select(func.max(table.c.id))).scalar()
+    connection.execute(insert(ExercisePartition.__table__).values(name=name,start=start,end=end,rows=copied,max_id=max_id))
+
+    connection.exec_driver_sql(
+        f"CREATE TRIGGER {name}_archived_update BEFORE UPDATE ON exercises "
+        f"WHEN OLD.id <= {max_id} AND OLD.date >= {_literal(_as_datetime(start))} AND OLD.date < {_literal(_as_datetime(end))} "
+        f"BEGIN SELECT RAISE(ABORT,'{name} is archived'); END"
+    )
+
+    return Partition(name,start,end,max_id)
+
+
+def uses_autoincrement(connection):
+    """
+        Whether the exercises table was created with AUTOINCREMENT, see migrate_autoincrement.py
+    """
+    sql=connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type='table' AND name='exercises'").scalar()
+
+    return "AUTOINCREMENT" in (sql or "").upper()
+
+
+def drop_archived(connection):
+    """
+        Deletes the rows every partition holds from the exercises table, and the
+        triggers that froze them. Run it once the API processes had time to load
+        the new partitions. Returns the rows deleted.
+
+        Without AUTOINCREMENT SQLite would hand the largest deleted ids out again,
+        and the partitions' id bounds would hide the new rows, so it refuses to run.
+    """
+    if not uses_autoincrement(connection):
+        raise IdsReusable("the exercises table lacks AUTOINCREMENT, run migrate_autoincrement.py first")
+
+    deleted=0
+
+    for partition in connection.execute(select(ExercisePartition.__table__)).all():
+        #the id bound lets SQLite walk the primary key instead of the whole table
+        deleted+=connection.execute(delete(exercises).where(
+            exercises.c.id<=partition.max_id,
+            exercises.c.date>=_as_datetime(partition.start),
+            exercises.c.date<_as_datetime(partition.end)
+        )).rowcount
+
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {partition.name}_archived_update")
+
+    return deleted
+
+
+def months_to_archive(connection,hot_months=EXERCISE_HOT_MONTHS,today=None):
+    """
+        Months before the hot window that still have rows in the exercises table
+        and no partition yet
+    """
+    cutoff=add_months(month_start(today or date.today()),-(hot_months-1))
+    archived={row.start for row in connection.execute(select(ExercisePartition.start))}
+
+    month=func.strftime("%Y-%m-01",exercises.c.date)
+    rows=connection.execute(
+        select(month).where(exercises.c.date<_as_datetime(cutoff)).group_by(month).order_by(month)
+    )
+
+    return [start for start in (date.fromisoformat(row[0]) for row in rows) if start not in archived]
+
+
+exercise_partitions=PartitionRouter()
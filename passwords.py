@@ -0,0 +1,63 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash , check_password_hash
+
+
+#cost of a new hash, existing hashes keep the cost they were created with
+PASSWORD_HASH_ITERATIONS=int(os.getenv("PASSWORD_HASH_ITERATIONS","600000"))
+
+#hashlib releases the GIL while it derives the key, so threads run in parallel
+PASSWORD_HASH_WORKERS=int(os.getenv("PASSWORD_HASH_WORKERS",str(os.cpu_count() or 1)))
+
+#hashes allowed to run or wait for a worker before callers are turned away
+PASSWORD_HASH_MAX_PENDING=int(os.getenv("PASSWORD_HASH_MAX_PENDING",str(PASSWORD_HASH_WORKERS*8)))
+
+#seconds a caller waits for a slot before giving up
+PASSWORD_HASH_WAIT_TIMEOUT=float(os.getenv("PASSWORD_HASH_WAIT_TIMEOUT","2"))
+
+
+_executor=ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,thread_name_prefix="password-hash")
+
+_slots=None
+
+
+class HashingPoolBusy(Exception):
+    """
+        Raised when the hashing pool has no free slot within the wait timeout
+    """
+
+
+async def _run(fn,*args):
+    global _slots
+
+    if _slots is None:
+        _slots=asyncio.Semaphore(PASSWORD_HASH_MAX_PENDING)
+
+    try:
+        await asyncio.wait_for(_slots.acquire(),PASSWORD_HASH_WAIT_TIMEOUT)
+
+    except asyncio.TimeoutError:
+        raise HashingPoolBusy()
+
+    try:
+        loop=asyncio.get_running_loop()
+
+        return await loop.run_in_executor(_executor,fn,*args)
+
+    finally:
+        _slots.release()
+
+
+async def hash_password(password:str)->str:
+    """
+        Hashes a password on the worker pool
+    """
+    return await _run(generate_password_hash,password,f"pbkdf2:sha256:{PASSWORD_HASH_ITERATIONS}")
+
+
+async def verify_password(pwhash:str,password:str)->bool:
+    """
+        Checks a password against its stored hash on the worker pool
+    """
+    return await _run(check_password_hash,pwhash,password)
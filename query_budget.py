@@ -0,0 +1,118 @@
+import contextvars
+import logging
+import os
+from collections import Counter
+from sqlalchemy import event
+
+
+#"off" in production, "warn" logs offending requests, "raise" fails them (for tests and benchmarks)
+QUERY_BUDGET_MODE=os.getenv("QUERY_BUDGET_MODE","off")
+
+#an identical statement run this many times in one request is reported as N+1
+QUERY_REPEAT_THRESHOLD=int(os.getenv("QUERY_REPEAT_THRESHOLD","3"))
+
+#statements run by the request being served
+_statements=contextvars.ContextVar("query_budget_statements",default=None)
+
+logger=logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """
+        Raised in "raise" mode when a request runs more statements than its route
+        declared, or repeats one statement QUERY_REPEAT_THRESHOLD times
+    """
+
+
+def query_budget(statements=None,repeats=QUERY_REPEAT_THRESHOLD):
+    """
+        Declares the most SQL statements a route may run per request, and how often
+        one statement may repeat (None for routes that repeat by design, such as
+        chunked inserts). Put it under the router decorator:
+
+            @exercise_router.get('/mine')
+            @query_budget(2)
+            async def list_my_exercises(...):
+    """
+    def declare(endpoint):
+        endpoint.query_budget=statements
+        endpoint.query_repeats=repeats
+        return endpoint
+
+    return declare
+
+
+def watch_engine(engine):
+    """
+        Records the statements an engine runs for the current request
+    """
+    sync_engine=getattr(engine,"sync_engine",engine)
+
+    def before_cursor_execute(conn,cursor,statement,parameters,context,executemany):
+        statements=_statements.get()
+
+        if statements is not None:
+            statements.append(statement)
+
+    event.listen(sync_engine,"before_cursor_execute",before_cursor_execute)
+
+
+def check(endpoint,statements):
+    """
+        Returns the problems of a request: the budget overrun and the repeated statements
+    """
+    problems=[]
+    budget=getattr(endpoint,"query_budget",None)
+
+    if budget is not None and len(statements)>budget:
+        problems.append(f"ran {len(statements)} statements, budget is {budget}")
+
+    repeats=getattr(endpoint,"query_repeats",QUERY_REPEAT_THRESHOLD)
+
+    if repeats is None:
+        return problems
+
+    for statement,count in Counter(statements).items():
+        if count>=repeats:
+            problems.append(f"ran {count} times, likely N+1: {' '.join(statement.split())[:200]}")
+
+    return problems
+
+
+class QueryBudgetMiddleware:
+    """
+        Counts the statements of every request and compares them with the budget
+        declared on its route. Only installed when QUERY_BUDGET_MODE is not "off".
+    """
+
+    def __init__(self,app,mode=QUERY_BUDGET_MODE):
+        self.app=app
+        self.mode=mode
+
+    async def __call__(self,scope,receive,send):
+        if scope["type"]!="http":
+            await self.app(scope,receive,send)
+            return
+
+        statements=[]
+        token=_statements.set(statements)
+
+        try:
+            await self.app(scope,receive,send)
+
+        finally:
+            _statements.reset(token)
+
+        endpoint=scope.get("endpoint")
+        problems=check(endpoint,statements)
+
+        if not problems:
+            return
+
+        route=f"{scope['method']} {scope['path']}"
+
+        if self.mode=="raise":
+            raise QueryBudgetExceeded(f"{route}: "+"; ".join(problems))
+
+        for problem in problems:
+            logger.warning("%s %s",route,problem)
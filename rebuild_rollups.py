@@ -0,0 +1,31 @@
+"""
+    Recomputes the daily exercise rollups and the personal records from the exercises table.
+    Run it after a backfill or any write that bypassed the API.
+
+        python rebuild_rollups.py
+        python rebuild_rollups.py --user-id 42
+"""
+import argparse
+import asyncio
+from database import AsyncSessionLocal,async_engine
+from crud import rebuild_rollups,rebuild_records
+from partitions import exercise_partitions
+
+
+async def main(user_id):
+    exercise_partitions.install(async_engine)
+
+    async with AsyncSessionLocal() as session:
+        await rebuild_rollups(session,user_id=user_id)
+        await rebuild_records(session,user_id=user_id)
+        await session.commit()
+
+    await async_engine.dispose()
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id",type=int,default=None,help="only rebuild this user's rollups and records")
+    args=parser.parse_args()
+
+    asyncio.run(main(args.user_id))
@@ -0,0 +1,35 @@
+"""
+    Commits the exercises the write-behind ingestor set aside in its dead-letter
+    files (the ingest log paths suffixed with .dead), once whatever rejected them
+    is fixed. Records that fail again stay in their file. It can run while the API
+    is up, and again after a crash: no record is inserted twice.
+
+    The API processes see the replayed exercises in their trends at once (the
+    user's exercise version moved) and in the leaderboards after their next rebuild.
+
+        python replay_dead_letters.py
+        python replay_dead_letters.py --path ./ingest.log.1.dead
+"""
+import argparse
+import asyncio
+import glob
+from database import async_engine
+from ingest import INGEST_LOG_PATH,replay_dead_letters
+
+
+async def main(paths):
+    try:
+        for path in paths:
+            replayed,failed=await replay_dead_letters(path)
+            print(f"{path}: {replayed} replayed, {failed} failed again")
+
+    finally:
+        await async_engine.dispose()
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path",action="append",default=None,help="dead-letter file to replay, every one next to INGEST_LOG_PATH by default")
+    args=parser.parse_args()
+
+    asyncio.run(main(args.path or sorted(glob.glob(f"{INGEST_LOG_PATH}*.dead"))))
@@ -1,5 +1,8 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel,validator
+from typing import Optional,List
+from datetime import datetime
+from enum import Enum
+from models import Exercise,naive_utc
 
 class SignUpModel(BaseModel):
     id:Optional[int]
@@ -32,23 +35,118 @@ class LoginModel(BaseModel):
 
 class WorkoutResponseModel(BaseModel):
     id:Optional[int]
-    date:str
-    user_id:int
-    exercise_name =str
-    sets =int
-    repetitions =int
-    weight_lifted =float
-    distance_covered =float
-    calories_burned =float
-    intensity_level =str
-    schema_extra={
+    date:datetime
+    user_id:Optional[int]
+    exercise_name:str
+    sets:int
+    repetitions:Optional[int]
+    weight_lifted:Optional[float]
+    distance_covered:Optional[float]
+    calories_burned:Optional[float]
+    intensity_level:Optional[str]
+
+    @validator('date')
+    def check_date(cls,value):
+        return naive_utc(value)
+
+    @validator('exercise_name')
+    def check_exercise_name(cls,value):
+        if value not in dict(Exercise.EXERCISES_TYPES):
+            raise ValueError(f"exercise_name must be one of {', '.join(dict(Exercise.EXERCISES_TYPES))}")
+        return value
+
+    @validator('intensity_level')
+    def check_intensity_level(cls,value):
+        if value is not None and value not in dict(Exercise.INTENSITY_LEVELS):
+            raise ValueError(f"intensity_level must be one of {', '.join(dict(Exercise.INTENSITY_LEVELS))}")
+        return value
+
+    class Config:
+        orm_mode=True
+        schema_extra={
             'example':{
+                "date":"2024-01-01T07:30:00",
                 "exercise_name":"PUSHUPS",
-                "sets":3
+                "sets":3,
+                "repetitions":12,
+                "weight_lifted":0,
+                "distance_covered":0,
+                "calories_burned":45.5,
+                "intensity_level":"medium"
             }
         }
 
 
+class SummaryPeriod(str,Enum):
+    day="day"
+    week="week"
+    month="month"
+
+
+class ChartMetric(str,Enum):
+    exercises="exercises"
+    sets="sets"
+    repetitions="repetitions"
+    calories_burned="calories_burned"
+    distance_covered="distance_covered"
+    weight_lifted="weight_lifted"
+
+
+class ChartFormat(str,Enum):
+    png="png"
+    svg="svg"
+
+
+class LeaderboardPeriod(str,Enum):
+    week="week"
+    month="month"
+
+
+class ExportFormat(str,Enum):
+    csv="csv"
+    ndjson="ndjson"
+
+
+class UserResponseModel(BaseModel):
+    id:int
+    username:str
+    email:str
+    is_admin:Optional[bool]
+    is_active:Optional[bool]
+
+
+class TokenPairModel(BaseModel):
+    access:str
+    refresh:str
+
+
+class AccessTokenModel(BaseModel):
+    access:str
+
+
+class ExerciseResponseModel(BaseModel):
+    id:int
+    date:Optional[datetime]
+    exercise_name:str
+    sets:int
+    repetitions:Optional[int]
+    weight_lifted:Optional[float]
+    distance_covered:Optional[float]
+    calories_burned:Optional[float]
+    intensity_level:Optional[str]
+    user_id:int
+
+
+class IngestAcceptedModel(BaseModel):
+    status:str
+    seq:int
+
+
+class ExercisePageModel(BaseModel):
+    items:List[ExerciseResponseModel]
+    next_cursor:Optional[str]
+
+
 
 
 
@@ -0,0 +1,367 @@
+import asyncio
+import fcntl
+import itertools
+import json
+import os
+import numpy as np
+from models import Exercise,naive_utc
+from crud import choice_code,stream_exercises,exercise_version
+
+
+#each API process claims its own worker_<n> directory under it, by locking worker_<n>.lock.
+#It is a cache and is rebuilt from the database when missing or out of date
+SERIES_CACHE_DIR=os.getenv("SERIES_CACHE_DIR","./series_cache")
+
+EXERCISE_CODES=[code for code,_ in Exercise.EXERCISES_TYPES]
+INTENSITY_CODES=[code for code,_ in Exercise.INTENSITY_LEVELS]
+
+METRICS=("sets","repetitions","weight_lifted","distance_covered","calories_burned")
+
+#column files of a user, dates are epoch seconds, missing metrics are NaN and a missing intensity is -1
+COLUMNS={
+    "id":np.int64,
+    "date":np.int64,
+    "exercise_name":np.int8,
+    "intensity_level":np.int8,
+    **{metric:np.float32 for metric in METRICS},
+}
+
+DAY=86400
+
+
+def to_columns(rows,ids):
+    """
+        Turns exercise rows and their ids into column arrays. Rows without a date are left out,
+        dates with an offset are converted to naive UTC like the database stores them.
+    """
+    rows=[(row,exercise_id) for row,exercise_id in zip(rows,ids) if row["date"] is not None]
+
+    columns={
+        "id":np.fromiter((exercise_id for _,exercise_id in rows),np.int64,len(rows)),
+        "date":np.array([naive_utc(row["date"]) for row,_ in rows],dtype="datetime64[s]").astype(np.int64),
+        "exercise_name":np.fromiter((EXERCISE_CODES.index(choice_code(row["exercise_name"])) for row,_ in rows),np.int8,len(rows)),
+        "intensity_level":np.fromiter(
+            (INTENSITY_CODES.index(choice_code(row["intensity_level"])) if row["intensity_level"] is not None else -1 for row,_ in rows),
+            np.int8,len(rows)
+        ),
+    }
+
+    for metric in METRICS:
+        columns[metric]=np.array([np.nan if row[metric] is None else row[metric] for row,_ in rows],dtype=np.float32)
+
+    return columns
+
+
+class SeriesCache:
+    """
+        Columnar copy of each user's exercise history, one raw file per column read
+        back as NumPy memory maps. New rows are appended after every insert; an edit
+        drops the user's files and they are rebuilt from the database on next use.
+
+        meta.json holds the number of valid rows and is always written last, so a
+        crash mid-append leaves trailing bytes that the next append cuts off. It also
+        holds the user's exercise version (their count of writes) the files match:
+        every append adds one, like the write did, and a read that finds another
+        version in the database, after a write by another process, rebuilds the files.
+    """
+
+    def __init__(self,root=SERIES_CACHE_DIR):
+        self.root=root
+        self._claimed=None
+        self._lock=None
+        self.hits=0
+        self.builds=0
+        self.appends=0
+        #users being rebuilt, with the batches appended meanwhile
+        self._building={}
+        #builds in progress, so concurrent readers wait for one build
+        self._pending={}
+
+    def _claim(self):
+        for slot in itertools.count():
+            path=os.path.join(self.root,f"worker_{slot}")
+            os.makedirs(path,exist_ok=True)
+            lock=open(path+".lock","a")
+
+            try:
+                fcntl.flock(lock.fileno(),fcntl.LOCK_EX|fcntl.LOCK_NB)
+
+            except BlockingIOError:
+                lock.close()
+                continue
+
+            if self._lock is not None:
+                self._lock.close()
+
+            self._lock=lock
+            return path
+
+    def _worker_dir(self):
+        """
+            The directory of this process, claimed on first use
+        """
+        if self._claimed is None or self._claimed[0]!=self.root:
+            self._claimed=(self.root,self._claim())
+
+        return self._claimed[1]
+
+    def _dir(self,user_id):
+        return os.path.join(self._worker_dir(),f"user_{user_id}")
+
+    def _path(self,user_id,column):
+        return os.path.join(self._dir(user_id),f"{column}.bin")
+
+    def _read_meta(self,user_id):
+        try:
+            with open(os.path.join(self._dir(user_id),"meta.json")) as meta:
+                return json.load(meta)
+
+        except (OSError,ValueError):
+            return None
+
+    def _write_meta(self,user_id,meta):
+        path=os.path.join(self._dir(user_id),"meta.json")
+
+        with open(path+".tmp","w") as tmp:
+            json.dump(meta,tmp)
+
+        os.replace(path+".tmp",path)
+
+    def _write_columns(self,user_id,columns):
+        """
+            Replaces the column files. Readers holding a memory map keep the old file.
+        """
+        os.makedirs(self._dir(user_id),exist_ok=True)
+
+        for column,dtype in COLUMNS.items():
+            path=self._path(user_id,column)
+            columns[column].astype(dtype,copy=False).tofile(path+".tmp")
+            os.replace(path+".tmp",path)
+
+    def invalidate(self,user_id):
+        if user_id in self._building:
+            #the rebuild in progress may have read the old rows, do not keep it
+            self._building[user_id]=None
+
+        try:
+            os.remove(os.path.join(self._dir(user_id),"meta.json"))
+
+        except FileNotFoundError:
+            pass
+
+    def append(self,rows,ids):
+        """
+            Adds freshly committed rows (and their ids) to the cached users they belong to.
+            Users without a cache are skipped, their next read builds it from the database.
+        """
+        by_user={}
+
+        for row,exercise_id in zip(rows,ids):
+            by_user.setdefault(row["user_id"],([],[]))
+            by_user[row["user_id"]][0].append(row)
+            by_user[row["user_id"]][1].append(exercise_id)
+
+        for user_id,(user_rows,user_ids) in by_user.items():
+            if user_id in self._building:
+                if self._building[user_id] is not None:
+                    self._building[user_id].append((user_rows,user_ids))
+                continue
+
+            meta=self._read_meta(user_id)
+
+            if meta is not None:
+                self._append(user_id,meta,to_columns(user_rows,user_ids))
+
+    def _append(self,user_id,meta,columns,writes=1):
+        #one version per write, even when the rows are already there
+        meta["version"]=meta.get("version",0)+writes
+
+        #the snapshot a rebuild read may already hold some of these rows
+        keep=columns["id"]>meta["max_id"]
+
+        if not keep.any():
+            self._write_meta(user_id,meta)
+            return
+
+        for column,dtype in COLUMNS.items():
+            with open(self._path(user_id,column),"r+b") as data:
+                data.truncate(meta["rows"]*np.dtype(dtype).itemsize)
+                data.seek(0,os.SEEK_END)
+                data.write(columns[column][keep].astype(dtype,copy=False).tobytes())
+
+        dates=columns["date"][keep]
+
+        meta["sorted"]=bool(meta["sorted"] and (meta["rows"]==0 or dates.min()>=meta["last_date"]) and (np.diff(dates)>=0).all())
+        meta["rows"]+=int(keep.sum())
+        meta["max_id"]=max(meta["max_id"],int(columns["id"][keep].max()))
+        meta["last_date"]=max(meta["last_date"],int(dates.max()))
+
+        self._write_meta(user_id,meta)
+        self.appends+=1
+
+    async def _build(self,session,user_id,version):
+        #the version is read before the rows, so a write landing in between is
+        #either in both or caught by the next read
+        self._building[user_id]=[]
+
+        try:
+            chunks=[]
+
+            async for rows in stream_exercises(session,user_id):
+                rows=[row._mapping for row in rows]
+                chunks.append(to_columns(rows,[row["id"] for row in rows]))
+
+            columns={
+                column:np.concatenate([chunk[column] for chunk in chunks]) if chunks else np.empty(0,dtype)
+                for column,dtype in COLUMNS.items()
+            }
+
+            self._write_columns(user_id,columns)
+
+            meta={
+                "rows":len(columns["id"]),
+                "max_id":int(columns["id"].max()) if len(columns["id"]) else 0,
+                "last_date":int(columns["date"].max()) if len(columns["date"]) else 0,
+                "sorted":True,
+                "version":version,
+            }
+
+            self._write_meta(user_id,meta)
+
+        finally:
+            appended=self._building.pop(user_id)
+
+        if appended is None:
+            self.invalidate(user_id)
+
+        elif appended:
+            rows=[row for user_rows,_ in appended for row in user_rows]
+            ids=[exercise_id for _,user_ids in appended for exercise_id in user_ids]
+            self._append(user_id,meta,to_columns(rows,ids),writes=len(appended))
+
+        self.builds+=1
+
+        return meta
+
+    async def get(self,session,user_id):
+        """
+            Returns the user's columns ordered by date, building them first if they
+            are missing or older than the user's exercise version
+        """
+        version=await exercise_version(session,user_id)
+        meta=self._read_meta(user_id)
+
+        if meta is not None and meta.get("version")==version:
+            self.hits+=1
+
+        elif user_id in self._pending:
+            meta=await asyncio.shield(self._pending[user_id])
+
+        else:
+            self._pending[user_id]=asyncio.get_running_loop().create_future()
+
+            try:
+                meta=await self._build(session,user_id,version)
+                self._pending[user_id].set_result(meta)
+
+            except BaseException as e:
+                self._pending[user_id].set_exception(e)
+                raise
+
+            finally:
+                del self._pending[user_id]
+
+        columns={}
+
+        for column,dtype in COLUMNS.items():
+            if meta["rows"]==0:
+                columns[column]=np.empty(0,dtype)
+            else:
+                columns[column]=np.memmap(self._path(user_id,column),dtype=dtype,mode="r",shape=(meta["rows"],))
+
+        if not meta["sorted"]:
+            #back-dated rows were appended, sort once and write the sorted files back
+            order=np.argsort(columns["date"],kind="stable")
+            columns={column:values[order] for column,values in columns.items()}
+
+            self._write_columns(user_id,columns)
+            meta["sorted"]=True
+            self._write_meta(user_id,meta)
+
+        return columns
+
+    def stats(self):
+        return {
+            "hits":self.hits,
+            "builds":self.builds,
+            "appends":self.appends,
+        }
+
+
+def trend_stats(columns,days,window,exercise_name=None,today=None):
+    """
+        Vectorized trends over a user's columns: a rolling average of daily calories,
+        weekly training volume (sets x repetitions x weight) and all-time bests per exercise
+    """
+    if exercise_name is not None:
+        selected=columns["exercise_name"]==EXERCISE_CODES.index(exercise_name)
+        columns={column:values[selected] for column,values in columns.items()}
+
+    day_numbers=columns["date"]//DAY
+    last_day=int(np.datetime64(today,"D").astype(np.int64)) if today is not None else (int(day_numbers[-1]) if len(day_numbers) else 0)
+    first_day=last_day-days+1
+
+    #the window needs window-1 days before the first reported one
+    in_range=(day_numbers>=first_day-window+1)&(day_numbers<=last_day)
+    offsets=day_numbers[in_range]-(first_day-window+1)
+    calories=np.nan_to_num(columns["calories_burned"][in_range])
+    daily=np.bincount(offsets,weights=calories,minlength=days+window-1)
+
+    cumulative=np.concatenate(([0.0],np.cumsum(daily)))
+    rolling=(cumulative[window:]-cumulative[:-window])/window
+
+    day_labels=np.arange(first_day,last_day+1).astype("datetime64[D]").astype(str)
+
+    rolling_calories=[
+        {"day":day,"calories":round(float(total),2),"rolling_avg":round(float(average),2)}
+        for day,total,average in zip(day_labels,daily[window-1:],rolling)
+    ]
+
+    #weeks start on Monday, 1970-01-01 was a Thursday
+    weeks=(day_numbers+3)//7
+    volume=np.nan_to_num(columns["sets"])*np.nan_to_num(columns["repetitions"])*np.nan_to_num(columns["weight_lifted"],nan=1.0)
+    recent=day_numbers>=first_day
+
+    weekly_volume=[]
+
+    if recent.any():
+        week_numbers,inverse=np.unique(weeks[recent],return_inverse=True)
+        week_volume=np.bincount(inverse,weights=volume[recent])
+        week_count=np.bincount(inverse)
+
+        weekly_volume=[
+            {"week":str(np.datetime64(int(week)*7-3,"D")),"exercises":int(count),"volume":round(float(total),2)}
+            for week,count,total in zip(week_numbers,week_count,week_volume)
+        ]
+
+    bests=[]
+
+    for code_index in np.unique(columns["exercise_name"]):
+        selected=columns["exercise_name"]==code_index
+        best={"exercise_name":EXERCISE_CODES[code_index],"exercises":int(selected.sum())}
+
+        for metric in ("weight_lifted","repetitions","distance_covered","calories_burned"):
+            values=columns[metric][selected]
+            best[metric]=float(np.nanmax(values)) if not np.isnan(values).all() else None
+
+        bests.append(best)
+
+    return {
+        "window":window,
+        "rolling_calories":rolling_calories,
+        "weekly_volume":weekly_volume,
+        "bests":bests,
+    }
+
+
+series_cache=SeriesCache()
@@ -0,0 +1,18 @@
+"""
+    Settings shared by the tests, applied before the app is imported: routes fail
+    when they go over their query budget, and nothing is written next to the code.
+"""
+import os
+import sys
+import tempfile
+
+_scratch=tempfile.mkdtemp(prefix="fitness-tests-")
+
+os.environ["QUERY_BUDGET_MODE"]="raise"
+os.environ.setdefault("PASSWORD_HASH_ITERATIONS","1000")
+os.environ.setdefault("DATABASE_URL",f"sqlite:///{_scratch}/unused.db")
+os.environ.setdefault("SERIES_CACHE_DIR",os.path.join(_scratch,"series_cache"))
+os.environ.setdefault("INGEST_LOG_PATH",os.path.join(_scratch,"ingest.log"))
+os.environ.setdefault("LEADERBOARD_REBUILD_INTERVAL","0")
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
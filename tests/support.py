@@ -0,0 +1,40 @@
+"""
+    Helpers of the tests: a fresh database behind the app for each test, and the
+    in-process client of the benchmarks to call it
+"""
+from contextlib import asynccontextmanager
+from datetime import date
+import cache
+from cache import BloomFilter,user_cache
+from series_cache import series_cache
+from leaderboard import leaderboard
+from partitions import exercise_partitions
+from benchmarks.common import setup_database,client
+
+
+@asynccontextmanager
+async def api(tmp_path,partitioned=False):
+    """
+        Yields (client, engine) over a new database in `tmp_path`. The process-wide
+        caches start empty, so nothing leaks from one test to the next.
+        With `partitioned` the partition router reads through the test engines.
+    """
+    exercise_partitions.refresh=0
+    engine,_=await setup_database(str(tmp_path/"test.db"),partitioned)
+
+    user_cache.clear()
+    cache.username_filter=BloomFilter(1000,0.01)
+    series_cache.root=str(tmp_path/"series_cache")
+    leaderboard._reset(date.today())
+    exercise_partitions.load([])
+    exercise_partitions.schema_version=None
+    exercise_partitions._checked=None
+
+    try:
+        async with client() as http:
+            yield http,engine
+
+    finally:
+        exercise_partitions.load([])
+        exercise_partitions.schema_version=None
+        await engine.dispose()
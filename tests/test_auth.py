@@ -0,0 +1,46 @@
+import asyncio
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+import cache
+from crud import warm_username_filter
+from models import User
+from support import api
+
+
+def test_signup_names_the_taken_field(tmp_path):
+    async def run():
+        async with api(tmp_path) as (http,_):
+            first=await http.post('/auth/signup',json={"username":"taken","email":"taken@example.com","password":"password"})
+            username=await http.post('/auth/signup',json={"username":"taken","email":"other@example.com","password":"password"})
+            email=await http.post('/auth/signup',json={"username":"other","email":"taken@example.com","password":"password"})
+
+            return first.status_code,username.json(),email.json()
+
+    created,username,email=asyncio.run(run())
+
+    assert created==201
+    assert username=={"detail":"User with the username already exists"}
+    assert email=={"detail":"User with the email already exists"}
+
+
+def test_availability_catches_up_with_other_processes(tmp_path,monkeypatch):
+    monkeypatch.setattr(cache,"USERNAME_FILTER_SYNC",0)
+
+    async def run():
+        async with api(tmp_path) as (http,engine):
+            factory=sessionmaker(bind=engine,class_=AsyncSession,expire_on_commit=False)
+
+            async with factory() as session:
+                await warm_username_filter(session)
+
+                #signed up on another API process, this one's filter never saw it
+                await session.execute(insert(User).values(username="elsewhere",email="elsewhere@example.com"))
+                await session.commit()
+
+            elsewhere=await http.get('/auth/available',params={"username":"elsewhere"})
+            free=await http.get('/auth/available',params={"username":"free"})
+
+            return elsewhere.json()["available"],free.json()["available"],"elsewhere" in cache.username_filter
+
+    assert asyncio.run(run())==(False,True,True)
@@ -0,0 +1,74 @@
+import asyncio
+from benchmarks.common import signup_and_login
+from support import api
+
+
+def exercise(date,**values):
+    return {"date":date,"exercise_name":"PUSHUPS","sets":3,"repetitions":12,"calories_burned":20.0,"intensity_level":"low",**values}
+
+
+def test_offset_dates_are_stored_in_utc_by_every_route(tmp_path):
+    async def run():
+        async with api(tmp_path) as (http,_):
+            headers=await signup_and_login(http,"offsets")
+
+            single=await http.post('/exercises/exercise',headers=headers,json=exercise("2024-05-01T10:00:00+02:00"))
+            batch=await http.post('/exercises/batch',headers=headers,json=[exercise("2024-05-01T10:00:00+02:00",sets=4),exercise("2024-05-01T08:00:00",sets=5)])
+            mine=await http.get('/exercises/mine',headers=headers)
+            summary=await http.get('/exercises/summary',headers=headers,params={"start":"2024-05-01T10:00:00+02:00","end":"2024-05-01T10:00:01+02:00"})
+
+            return single,batch,mine.json()["items"],summary.json()["groups"]
+
+    single,batch,items,groups=asyncio.run(run())
+
+    assert single.status_code==201
+    assert batch.json()["created"]==2
+    assert sorted((item["sets"],item["date"]) for item in items)==[(3,"2024-05-01T08:00:00"),(4,"2024-05-01T08:00:00"),(5,"2024-05-01T08:00:00")]
+    assert [group["count"] for group in groups]==[3]
+
+
+def test_batch_reports_each_item_and_keeps_the_valid_ones(tmp_path):
+    async def run():
+        async with api(tmp_path) as (http,_):
+            headers=await signup_and_login(http,"mixed")
+            response=await http.post('/exercises/batch',headers=headers,json=[
+                exercise("2024-05-01T08:00:00"),
+                exercise("not a date"),
+                exercise("2024-05-02T08:00:00",exercise_name="Burpees"),
+                exercise("2024-05-03T08:00:00",sets=6),
+            ])
+            mine=await http.get('/exercises/mine',headers=headers)
+
+            return response.json(),mine.json()["items"]
+
+    body,items=asyncio.run(run())
+
+    assert (body["created"],body["invalid"])==(2,2)
+    assert [(result["index"],result["status"]) for result in body["results"]]==[(0,"created"),(1,"invalid"),(2,"invalid"),(3,"created")]
+    assert body["results"][1]["errors"][0]["loc"]==["date"]
+    assert body["results"][2]["errors"][0]["loc"]==["exercise_name"]
+    assert sorted(item["id"] for item in items)==[body["results"][0]["id"],body["results"][3]["id"]]
+
+
+def test_csv_import_commits_valid_rows_and_reports_the_rest(tmp_path):
+    upload="date,exercise_name,sets,calories_burned\n2024-05-01T07:00:00+02:00,Squats,2,15\nnot a date,Squats,2,15\n2024-05-02T07:00:00,Plank,1,4.5\n"
+
+    async def run():
+        async with api(tmp_path) as (http,_):
+            headers=await signup_and_login(http,"importer")
+            job=(await http.post('/exercises/import',headers=headers,files={"file":("history.csv",upload,"text/csv")})).json()
+
+            while job["status"] not in ("done","failed"):
+                await asyncio.sleep(0.05)
+                job=(await http.get(f'/exercises/import/{job["job_id"]}',headers=headers)).json()
+
+            errors=await http.get(f'/exercises/import/{job["job_id"]}/errors',headers=headers)
+            mine=await http.get('/exercises/mine',headers=headers)
+
+            return job,errors.text,mine.json()["items"]
+
+    job,errors,items=asyncio.run(run())
+
+    assert (job["status"],job["rows_read"],job["rows_imported"],job["rows_invalid"])==("done",3,2,1)
+    assert errors.splitlines()[1].startswith("3,date:")
+    assert [(item["date"],item["exercise_name"]) for item in items]==[("2024-05-02T07:00:00","Plank"),("2024-05-01T05:00:00","Squats")]
@@ -0,0 +1,39 @@
+import asyncio
+import csv
+import gzip
+import io
+import orjson
+from benchmarks.common import signup_and_login
+from support import api
+
+
+def exercise(date,**values):
+    return {"date":date,"exercise_name":"Squats","sets":3,"repetitions":5,"weight_lifted":40.0,"calories_burned":12.5,"intensity_level":"high",**values}
+
+
+def test_export_streams_the_callers_history_in_every_format(tmp_path):
+    async def run():
+        async with api(tmp_path) as (http,_):
+            headers=await signup_and_login(http,"exporter")
+            other=await signup_and_login(http,"bystander")
+
+            await http.post('/exercises/batch',headers=headers,json=[exercise(f"2024-05-{day:02d}T08:00:00",sets=day) for day in (3,1,2,4)])
+            await http.post('/exercises/batch',headers=other,json=[exercise("2024-05-02T09:00:00")])
+
+            full=await http.get('/exercises/export',headers=headers,params={"format":"csv"})
+            #2024-05-02T10:00:00+02:00 is 08:00 UTC, the end is exclusive
+            bounded=await http.get('/exercises/export',headers=headers,params={"format":"ndjson","start":"2024-05-02T10:00:00+02:00","end":"2024-05-04T08:00:00Z"})
+            compressed=await http.get('/exercises/export',headers=headers,params={"format":"ndjson","gzip":"true"})
+
+            return full,bounded,compressed
+
+    full,bounded,compressed=asyncio.run(run())
+
+    rows=list(csv.DictReader(io.StringIO(full.text)))
+    assert full.headers["content-disposition"]=='attachment; filename="exercises-exporter.csv"'
+    assert [(row["date"],row["sets"],row["user_id"]) for row in rows]==[(f"2024-05-0{day}T08:00:00",str(day),"1") for day in (1,2,3,4)]
+
+    assert [orjson.loads(line)["sets"] for line in bounded.text.splitlines()]==[2,3]
+
+    assert compressed.headers["content-type"]=="application/gzip"
+    assert [orjson.loads(line)["sets"] for line in gzip.decompress(compressed.content).splitlines()]==[1,2,3,4]
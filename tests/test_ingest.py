@@ -0,0 +1,165 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+import orjson
+import pytest
+from sqlalchemy import select,func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+import ingest
+import workout_routes
+from main import app
+from ingest import ExerciseIngestor,IngestNotRunning,replay_dead_letters
+from models import Exercise
+from benchmarks.common import signup_and_login
+from support import api
+
+
+def row(sets=3):
+    return {
+        "date":datetime(2024,5,1,8),"exercise_name":"PUSHUPS","sets":sets,"repetitions":10,
+        "weight_lifted":None,"distance_covered":None,"calories_burned":12.0,"intensity_level":"low","user_id":1,
+    }
+
+
+async def count_exercises(factory):
+    async with factory() as session:
+        return await session.scalar(select(func.count(Exercise.id)))
+
+
+def test_rejected_record_is_dead_lettered_alone(tmp_path):
+    async def run():
+        async with api(tmp_path) as (_,engine):
+            factory=sessionmaker(bind=engine,class_=AsyncSession,expire_on_commit=False)
+            ingestor=ExerciseIngestor(str(tmp_path/"ingest.log"),factory)
+            await ingestor.start()
+
+            try:
+                for sets in (3,3,3,None,3,3):
+                    await ingestor.submit(row(sets))
+
+                flushed=await ingestor.flush()
+
+            finally:
+                await ingestor.stop()
+
+            dead=[orjson.loads(line) for line in (tmp_path/"ingest.log.dead").read_bytes().splitlines()]
+
+            return flushed,await count_exercises(factory),dead
+
+    flushed,rows,dead=asyncio.run(run())
+
+    assert rows==5
+    assert flushed=={"committed_seq":6,"dead_lettered_seqs":[4]}
+    assert [record["seq"] for record in dead]==[4]
+
+
+def test_locked_database_is_retried_not_dead_lettered(tmp_path,monkeypatch):
+    insert_exercises=ingest.insert_exercises
+    failures=[]
+
+    async def locked_twice(session,rows):
+        if len(failures)<2:
+            failures.append(len(rows))
+            raise OperationalError("INSERT INTO exercises",{},sqlite3.OperationalError("database is locked"))
+
+        return await insert_exercises(session,rows)
+
+    monkeypatch.setattr(ingest,"insert_exercises",locked_twice)
+
+    async def run():
+        async with api(tmp_path) as (_,engine):
+            factory=sessionmaker(bind=engine,class_=AsyncSession,expire_on_commit=False)
+            ingestor=ExerciseIngestor(str(tmp_path/"ingest.log"),factory)
+            await ingestor.start()
+
+            try:
+                for _ in range(4):
+                    await ingestor.submit(row())
+
+                flushed=await ingestor.flush()
+
+            finally:
+                await ingestor.stop()
+
+            return flushed,await count_exercises(factory)
+
+    flushed,rows=asyncio.run(run())
+
+    assert failures==[4,4]
+    assert rows==4
+    assert flushed=={"committed_seq":4,"dead_lettered_seqs":[]}
+    assert not (tmp_path/"ingest.log.dead").exists()
+
+
+def test_replay_commits_fixed_dead_letters_once(tmp_path):
+    async def run():
+        async with api(tmp_path) as (_,engine):
+            factory=sessionmaker(bind=engine,class_=AsyncSession,expire_on_commit=False)
+            path=tmp_path/"ingest.log.dead"
+            fixed={"seq":7,**row(),"date":"2024-05-01T08:00:00"}
+            broken={"seq":8,**row(None),"date":"2024-05-01T09:00:00","error":"IntegrityError()"}
+            path.write_bytes(orjson.dumps(fixed)+b"\n"+orjson.dumps(broken)+b"\n")
+
+            first=await replay_dead_letters(str(path),factory)
+            again=await replay_dead_letters(str(path),factory)
+
+            return first,again,await count_exercises(factory),[orjson.loads(line)["seq"] for line in path.read_bytes().splitlines()]
+
+    first,again,rows,left=asyncio.run(run())
+
+    assert first==(1,1)
+    assert again==(0,1)
+    assert rows==1
+    assert left==[8]
+
+
+def test_submit_before_start_is_refused(tmp_path):
+    ingestor=ExerciseIngestor(str(tmp_path/"ingest.log"))
+
+    with pytest.raises(IngestNotRunning):
+        asyncio.run(ingestor.submit(row()))
+
+
+def test_health_is_for_admins_only(tmp_path):
+    async def run():
+        async with api(tmp_path) as (http,_):
+            anonymous=await http.get('/exercises/ingest/health')
+            headers=await signup_and_login(http,"member")
+            member=await http.get('/exercises/ingest/health',headers=headers)
+
+            return anonymous.status_code,member.status_code
+
+    assert asyncio.run(run())==(401,401)
+
+
+def test_write_behind_answers_202_with_the_seq(tmp_path,monkeypatch):
+    async def run():
+        async with api(tmp_path) as (http,engine):
+            factory=sessionmaker(bind=engine,class_=AsyncSession,expire_on_commit=False)
+            ingestor=ExerciseIngestor(str(tmp_path/"ingest.log"),factory)
+            monkeypatch.setattr(workout_routes,"ingestor",ingestor)
+            monkeypatch.setattr(workout_routes,"EXERCISE_INGEST_MODE","write_behind")
+            await ingestor.start()
+
+            try:
+                headers=await signup_and_login(http,"behind")
+                response=await http.post('/exercises/exercise',headers=headers,json={"date":"2024-05-01T08:00:00","exercise_name":"PUSHUPS","sets":3})
+                await ingestor.flush()
+
+            finally:
+                await ingestor.stop()
+
+            mine=await http.get('/exercises/mine',headers=headers)
+
+            return response,[item["sets"] for item in mine.json()["items"]]
+
+    response,sets=asyncio.run(run())
+
+    assert response.status_code==202
+    assert response.json()=={"status":"accepted","seq":1}
+    assert sets==[3]
+
+    documented=app.openapi()["paths"]["/exercises/exercise"]["post"]["responses"]
+    assert documented["202"]["content"]["application/json"]["schema"]=={"$ref":"#/components/schemas/IngestAcceptedModel"}
@@ -0,0 +1,92 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime,date,timedelta
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from crud import insert_exercises
+from leaderboard import Leaderboard
+from benchmarks.common import signup_and_login
+from support import api
+
+
+def row(calories):
+    return {
+        "date":datetime.combine(date.today(),datetime.min.time()),"exercise_name":"PUSHUPS","sets":3,"repetitions":10,
+        "weight_lifted":None,"distance_covered":None,"calories_burned":calories,"intensity_level":"low","user_id":1,
+    }
+
+
+def test_rows_recorded_during_a_rebuild_count_once(tmp_path):
+    async def run():
+        async with api(tmp_path) as (http,engine):
+            await signup_and_login(http,"racer")
+            factory=sessionmaker(bind=engine,class_=AsyncSession,expire_on_commit=False)
+            snapshot_read,release=asyncio.Event(),asyncio.Event()
+
+            @asynccontextmanager
+            async def paused_after_read():
+                async with factory() as session:
+                    execute=session.execute
+
+                    async def paused(*args,**kwargs):
+                        result=await execute(*args,**kwargs)
+                        snapshot_read.set()
+                        await release.wait()
+
+                        return result
+
+                    session.execute=paused
+                    yield session
+
+            async def write(calories):
+                async with factory() as session:
+                    _,versions=await insert_exercises(session,[row(calories)])
+                    await session.commit()
+
+                return versions
+
+            #committed before the rebuild reads the rollups, recorded while it runs
+            before=await write(100.0)
+            board=Leaderboard(paused_after_read)
+            rebuild=asyncio.create_task(board.rebuild())
+            await asyncio.wait_for(snapshot_read.wait(),10)
+            board.record([row(100.0)],versions=before)
+
+            #committed after the read
+            board.record([row(40.0)],versions=await write(40.0))
+            board.record([row(40.0)],sign=-1,versions=await write(-40.0))
+            board.record([row(7.0)],versions=await write(7.0))
+
+            release.set()
+            await rebuild
+
+            return board.windows["week"].rank(1)
+
+    assert asyncio.run(run())=={"rank":1,"calories_burned":107.0}
+
+
+def test_standings_rank_users_by_calories_in_the_window(tmp_path):
+    today=date.today()
+
+    def burned(calories,days_ago=0):
+        return {"date":f"{today-timedelta(days=days_ago)}T08:00:00","exercise_name":"PUSHUPS","sets":3,"calories_burned":calories}
+
+    async def run():
+        async with api(tmp_path) as (http,_):
+            runner=await signup_and_login(http,"runner")
+            walker=await signup_and_login(http,"walker")
+
+            await http.post('/exercises/batch',headers=runner,json=[burned(50.0),burned(30.0,days_ago=2),burned(500.0,days_ago=20)])
+            await http.post('/exercises/exercise',headers=walker,json=burned(90.0,days_ago=1))
+
+            week=await http.get('/exercises/leaderboard',headers=walker,params={"period":"week"})
+            month=await http.get('/exercises/leaderboard',headers=walker,params={"period":"month"})
+
+            return week.json(),month.json()
+
+    week,month=asyncio.run(run())
+
+    assert [(entry["rank"],entry["username"],entry["calories_burned"]) for entry in week["top"]]==[(1,"walker",90.0),(2,"runner",80.0)]
+    assert week["me"]=={"rank":1,"calories_burned":90.0}
+    assert [(entry["username"],entry["calories_burned"]) for entry in month["top"]]==[("runner",580.0),("walker",90.0)]
+    assert month["me"]["rank"]==2
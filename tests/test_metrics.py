@@ -0,0 +1,23 @@
+import pytest
+from sqlalchemy import create_engine,text
+from sqlalchemy.exc import OperationalError
+from metrics import instrument_engine,queries_total
+
+
+def test_failed_statements_leave_no_timing_state(tmp_path):
+    engine=create_engine(f"sqlite:///{tmp_path/'metrics.db'}")
+    instrument_engine(engine,"failing")
+
+    try:
+        with engine.connect() as connection:
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    connection.execute(text("SELECT * FROM missing"))
+
+            assert connection.execute(text("SELECT 1")).scalar()==1
+            assert [key for key in connection.info if "start" in key]==[]
+
+    finally:
+        engine.dispose()
+
+    assert queries_total._values[("failing",)]==1
@@ -0,0 +1,53 @@
+import asyncio
+from benchmarks.common import signup_and_login
+from support import api
+
+
+def exercise(day,hour,exercise_name="PUSHUPS",**values):
+    return {"date":f"2024-05-{day:02d}T{hour:02d}:00:00","exercise_name":exercise_name,"sets":3,"repetitions":10,"calories_burned":10.0,"intensity_level":"low",**values}
+
+
+async def pages(http,headers,**params):
+    items,cursor=[],None
+
+    while True:
+        response=(await http.get('/exercises/mine',headers=headers,params={**params,**({"cursor":cursor} if cursor else {})})).json()
+        items.append(response["items"])
+        cursor=response["next_cursor"]
+
+        if cursor is None:
+            return items
+
+
+def test_pages_walk_every_exercise_once_newest_first(tmp_path):
+    async def run():
+        async with api(tmp_path) as (http,_):
+            headers=await signup_and_login(http,"pager")
+            other=await signup_and_login(http,"neighbour")
+
+            #several exercises share a date, the id breaks the tie
+            rows=[exercise(1+index//3,8,("PUSHUPS","Squats","Plank")[index%3]) for index in range(23)]
+            created=(await http.post('/exercises/batch',headers=headers,json=rows)).json()["results"]
+            await http.post('/exercises/batch',headers=other,json=rows[:5])
+
+            walked=await pages(http,headers,limit=4)
+            squats=await pages(http,headers,limit=3,exercise_name="Squats")
+
+            first=(await http.get('/exercises/mine',headers=headers,params={"limit":5})).json()
+            #a newer exercise written between two pages does not shift the next one
+            await http.post('/exercises/exercise',headers=headers,json=exercise(28,8))
+            second=(await http.get('/exercises/mine',headers=headers,params={"limit":5,"cursor":first["next_cursor"]})).json()
+
+            invalid=await http.get('/exercises/mine',headers=headers,params={"cursor":"not a cursor"})
+
+            return rows,created,walked,squats,first["items"],second["items"],invalid
+
+    rows,created,walked,squats,first,second,invalid=asyncio.run(run())
+
+    expected=sorted(((row["date"],item["id"]) for row,item in zip(rows,created)),reverse=True)
+
+    assert [len(page) for page in walked]==[4]*5+[3]
+    assert [(item["date"],item["id"]) for page in walked for item in page]==expected
+    assert [item["exercise_name"] for page in squats for item in page]==["Squats"]*8
+    assert [item["id"] for item in first+second]==[exercise_id for _,exercise_id in expected[:10]]
+    assert invalid.status_code==400
@@ -0,0 +1,192 @@
+import asyncio
+import pytest
+from datetime import date,datetime,timedelta,timezone
+from types import SimpleNamespace
+from sqlalchemy import create_engine,select,text
+from sqlalchemy.dialects import sqlite
+from partitions import MARKER,IdsReusable,Partition,PartitionRouter,PartitionRoutingError,exercises,exercise_partitions,archive_month,drop_archived,months_to_archive
+from benchmarks.common import signup_and_login
+from support import api
+
+
+def exercise(day,index):
+    return {
+        "date":f"{day}T{6+index%12:02d}:15:00","exercise_name":("PUSHUPS","Squats","Plank")[index%3],"sets":1+index%5,"repetitions":8+index%7,
+        "weight_lifted":(20.0+index%40 if index%3==1 else None),"calories_burned":10.0+index%17,"intensity_level":("low","medium","high")[index%3],
+    }
+
+
+def archive(path):
+    engine=create_engine(f"sqlite:///{path}")
+
+    try:
+        with engine.begin() as connection:
+            months=months_to_archive(connection)
+
+        for start in months:
+            with engine.begin() as connection:
+                archive_month(connection,start)
+
+        with engine.begin() as connection:
+            drop_archived(connection)
+
+        return months
+
+    finally:
+        engine.dispose()
+
+
+async def pages(http,headers,**params):
+    items,cursor=[],None
+
+    while True:
+        response=(await http.get('/exercises/mine',headers=headers,params={**params,**({"cursor":cursor} if cursor else {})})).json()
+        items.append(response["items"])
+        cursor=response["next_cursor"]
+
+        if cursor is None:
+            return items
+
+
+async def reads(http,headers,today):
+    first=today-timedelta(days=200)
+    #offset-aware bounds, the same instants as naive UTC ones
+    aware={"start":f"{first+timedelta(days=40)}T02:00:00+02:00","end":f"{today-timedelta(days=30)}T00:00:00Z"}
+
+    async def get(url,**params):
+        response=await http.get(url,headers=headers,params=params)
+        assert response.status_code==200,(url,response.text)
+
+        return response.text
+
+    return {
+        "summary":await get('/exercises/summary',period="month"),
+        "summary_aware":await get('/exercises/summary',period="day",**aware),
+        "daily":await get('/exercises/daily',start=str(first),end=str(today)),
+        "daily_squats":await get('/exercises/daily',start=str(first+timedelta(days=50)),end=str(today-timedelta(days=60)),exercise_name="Squats"),
+        "mine":await pages(http,headers,limit=17),
+        "mine_plank":await pages(http,headers,limit=9,exercise_name="Plank"),
+        "mine_high":await pages(http,headers,limit=4,intensity_level="high"),
+        "export":await get('/exercises/export',format="ndjson"),
+        "export_aware":await get('/exercises/export',format="csv",**aware),
+        "records":await get('/exercises/records'),
+    }
+
+
+def test_archived_months_read_like_the_unpartitioned_table(tmp_path):
+    today=date.today()
+
+    async def run():
+        async with api(tmp_path,partitioned=True) as (http,_):
+            headers=await signup_and_login(http,"archive")
+            rows=[exercise(today-timedelta(days=day),day) for day in range(200,-1,-1)]
+            response=await http.post('/exercises/batch',headers=headers,json=rows)
+            assert response.json()["created"]==len(rows)
+
+            before=await reads(http,headers,today)
+            months=await asyncio.to_thread(archive,tmp_path/"test.db")
+            read=exercise_partitions.partitions_read
+            after=await reads(http,headers,today)
+
+            return months,before,after,exercise_partitions.partitions_read-read
+
+    months,before,after,partitions_read=asyncio.run(run())
+
+    assert len(months)>=4
+    assert partitions_read>0
+
+    for name in before:
+        assert after[name]==before[name],name
+
+
+def test_offset_aware_bounds_select_partitions():
+    router=PartitionRouter()
+    router.load([Partition("exercises_2024_04",date(2024,4,1),date(2024,5,1),10),Partition("exercises_2024_05",date(2024,5,1),date(2024,6,1),20)])
+    plus_two=timezone(timedelta(hours=2))
+
+    #2024-05-01 01:00+02:00 is still April in UTC
+    selected=router.select(datetime(2024,5,1,1,tzinfo=plus_two),datetime(2024,5,3,tzinfo=timezone.utc))
+
+    assert [partition.name for partition in selected]==["exercises_2024_04","exercises_2024_05"]
+    assert router.read_only(datetime(2024,5,1,1,tzinfo=plus_two),5)
+
+
+def test_archived_ids_are_not_handed_out_again(tmp_path):
+    today=date.today()
+
+    async def run():
+        async with api(tmp_path,partitioned=True) as (http,_):
+            headers=await signup_and_login(http,"ids")
+            old=[exercise(today-timedelta(days=day),day) for day in range(200,150,-1)]
+            archived=[item["id"] for item in (await http.post('/exercises/batch',headers=headers,json=old)).json()["results"]]
+
+            #every row of the table is archived and deleted, the newest one included
+            await asyncio.to_thread(archive,tmp_path/"test.db")
+
+            batch=[item["id"] for item in (await http.post('/exercises/batch',headers=headers,json=[exercise(today,1),exercise(today,2)])).json()["results"]]
+            single=(await http.post('/exercises/exercise',headers=headers,json=exercise(today,3))).json()["id"]
+            mine=await pages(http,headers,limit=100)
+
+            return archived,batch,single,[item["id"] for page in mine for item in page]
+
+    archived,batch,single,listed=asyncio.run(run())
+
+    assert batch==[max(archived)+1,max(archived)+2]
+    assert single==max(archived)+3
+    assert sorted(listed)==sorted(archived+batch+[single])
+
+
+def test_drop_archived_needs_autoincrement(tmp_path):
+    engine=create_engine(f"sqlite:///{tmp_path/'old.db'}")
+
+    try:
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE exercises (id INTEGER NOT NULL PRIMARY KEY, date DATETIME)"))
+
+        with pytest.raises(IdsReusable):
+            with engine.begin() as connection:
+                drop_archived(connection)
+
+    finally:
+        engine.dispose()
+
+
+def test_deep_pages_read_only_the_months_they_reach(tmp_path):
+    today=date.today()
+
+    async def run():
+        async with api(tmp_path,partitioned=True) as (http,_):
+            headers=await signup_and_login(http,"deep")
+            rows=[exercise(today-timedelta(days=day),day) for day in range(300,-1,-1) for _ in range(2)]
+            await http.post('/exercises/batch',headers=headers,json=rows)
+            months=await asyncio.to_thread(archive,tmp_path/"test.db")
+            #the router loads the new partitions on the next checkout
+            await http.get('/exercises/records',headers=headers)
+
+            read,cursor=[],None
+
+            while True:
+                before=exercise_partitions.partitions_read
+                response=(await http.get('/exercises/mine',headers=headers,params={"limit":10,**({"cursor":cursor} if cursor else {})})).json()
+                read.append(exercise_partitions.partitions_read-before)
+                cursor=response["next_cursor"]
+
+                if cursor is None:
+                    return months,read
+
+    months,read=asyncio.run(run())
+
+    assert len(months)>=8
+    #ten rows span five days, which reach into two months at most
+    assert max(read)<=2
+
+
+def test_unroutable_reads_raise():
+    router=PartitionRouter()
+    router.load([Partition("exercises_2024_04",date(2024,4,1),date(2024,5,1),10)])
+    compiled=select(exercises.c.id).compile(dialect=sqlite.dialect())
+    context=SimpleNamespace(compiled=compiled,compiled_parameters=[{}])
+    statement=str(compiled).replace(MARKER+"exercises",MARKER+'"exercises"')
+
+    with pytest.raises(PartitionRoutingError):
+        router._route(None,None,statement,(),context,False)
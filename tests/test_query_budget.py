@@ -0,0 +1,123 @@
+"""
+    Drives every route that declares a query budget. conftest.py sets
+    QUERY_BUDGET_MODE=raise, so a route running more statements than it declared
+    fails the test.
+
+        python -m pytest -q tests
+"""
+import asyncio
+from datetime import date,timedelta
+from main import app
+from csv_import import importer
+from query_budget import _statements
+from benchmarks.common import signup_and_login
+from support import api
+
+
+def budgeted_routes():
+    return {
+        (method,route.path)
+        for route in app.routes
+        if hasattr(getattr(route,"endpoint",None),"query_budget")
+        for method in route.methods
+    }
+
+
+def exercise(day,**values):
+    return {"date":f"{day}T08:00:00","exercise_name":"PUSHUPS","sets":3,"repetitions":12,"calories_burned":20.0,"intensity_level":"low",**values}
+
+
+async def wait_for_import(http,headers,job_id):
+    while True:
+        response=await http.get(f'/exercises/import/{job_id}',headers=headers)
+
+        if response.json()["status"] in ("done","failed"):
+            return response
+
+        await asyncio.sleep(0.05)
+
+
+async def drive(tmp_path):
+    today=date.today()
+    driven=set()
+
+    async def call(method,route,url,**kwargs):
+        response=await http.request(method,url,**kwargs)
+        assert response.status_code<400,(url,response.status_code,response.text)
+        driven.add((method,route))
+
+        return response
+
+    async with api(tmp_path) as (http,_):
+        await call("GET",'/auth/available','/auth/available',params={"username":"budget"})
+        headers=await signup_and_login(http,"budget")
+        driven.update({("POST",'/auth/signup'),("POST",'/auth/login')})
+
+        response=await call("POST",'/exercises/exercise','/exercises/exercise',headers=headers,json=exercise(today))
+        exercise_id=response.json()["id"]
+
+        await call("POST",'/exercises/batch','/exercises/batch',headers=headers,json=[
+            exercise(today-timedelta(days=day),exercise_name=("PUSHUPS","Squats","Plank")[day%3],weight_lifted=(40.0 if day%3==1 else None))
+            for day in range(60)
+        ])
+
+        upload="date,exercise_name,sets,calories_burned\n"+"".join(f"{today-timedelta(days=day)}T07:00:00,Squats,2,15\n" for day in range(20))+"not a date,Squats,2,15\n"
+        response=await call("POST",'/exercises/import','/exercises/import',headers=headers,files={"file":("history.csv",upload,"text/csv")})
+        job_id=response.json()["job_id"]
+        await wait_for_import(http,headers,job_id)
+        driven.add(("GET",'/exercises/import/{job_id}'))
+        await call("GET",'/exercises/import/{job_id}/errors',f'/exercises/import/{job_id}/errors',headers=headers)
+
+        for period in ("day","week","month"):
+            await call("GET",'/exercises/summary','/exercises/summary',headers=headers,params={"period":period})
+
+        await call("GET",'/exercises/daily','/exercises/daily',headers=headers,params={"start":str(today-timedelta(days=30)),"end":str(today)})
+
+        response=await call("GET",'/exercises/mine','/exercises/mine',headers=headers,params={"limit":10})
+        await call("GET",'/exercises/mine','/exercises/mine',headers=headers,params={"limit":10,"cursor":response.json()["next_cursor"]})
+
+        for format in ("csv","ndjson"):
+            await call("GET",'/exercises/export','/exercises/export',headers=headers,params={"format":format})
+
+        await call("GET",'/exercises/records','/exercises/records',headers=headers)
+        await call("GET",'/exercises/leaderboard','/exercises/leaderboard',headers=headers,params={"period":"month"})
+
+        #the first read builds the series cache, the second one hits it
+        await call("GET",'/exercises/trends','/exercises/trends',headers=headers)
+        await call("GET",'/exercises/trends','/exercises/trends',headers=headers)
+
+        await call("GET",'/exercises/chart','/exercises/chart',headers=headers,params={"format":"svg"})
+        await call("PUT",'/exercises/exercise/update/{id}/',f'/exercises/exercise/update/{exercise_id}/',headers=headers,json=exercise(today,sets=5))
+
+    return driven
+
+
+def test_budgeted_routes_stay_under_budget(tmp_path):
+    driven=asyncio.run(drive(tmp_path))
+
+    assert budgeted_routes()<=driven
+
+
+def test_import_statements_are_not_counted_against_the_request(tmp_path):
+    async def run():
+        async with api(tmp_path):
+            path=tmp_path/"history.csv"
+            path.write_text(f"date,exercise_name,sets\n{date.today()}T07:00:00,Squats,2\n")
+
+            statements=[]
+            token=_statements.set(statements)
+
+            try:
+                job=importer.submit(1,"history.csv",str(path))
+
+            finally:
+                _statements.reset(token)
+
+            await job.task
+
+        return job,statements
+
+    job,statements=asyncio.run(run())
+
+    assert job.status=="done"
+    assert statements==[]
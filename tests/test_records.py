@@ -0,0 +1,45 @@
+import asyncio
+from benchmarks.common import signup_and_login
+from support import api
+
+
+def exercise(exercise_name,**values):
+    return {"date":"2024-05-01T08:00:00","exercise_name":exercise_name,"sets":3,"repetitions":10,"calories_burned":10.0,"intensity_level":"low",**values}
+
+
+async def records(http,headers):
+    response=await http.get('/exercises/records',headers=headers)
+
+    return {record["exercise_name"]:record for record in response.json()["records"]}
+
+
+def test_records_follow_writes_and_only_the_owner_can_edit(tmp_path):
+    async def run():
+        async with api(tmp_path) as (http,_):
+            owner=await signup_and_login(http,"lifter")
+            other=await signup_and_login(http,"intruder")
+
+            created=(await http.post('/exercises/batch',headers=owner,json=[
+                exercise("Squats",weight_lifted=60.0,repetitions=5),
+                exercise("Squats",weight_lifted=80.0,repetitions=3),
+                exercise("PUSHUPS",repetitions=25),
+            ])).json()["results"]
+            heaviest=created[1]["id"]
+
+            before=await records(http,owner)
+            refused=await http.put(f'/exercises/exercise/update/{heaviest}/',headers=other,json=exercise("PUSHUPS"))
+            after_refused=await records(http,owner)
+
+            #moving the heaviest squat to push-ups takes its weight out of the squat record
+            await http.put(f'/exercises/exercise/update/{heaviest}/',headers=owner,json=exercise("PUSHUPS"))
+
+            return before,refused,after_refused,await records(http,owner),await records(http,other)
+
+    before,refused,after_refused,after,others=asyncio.run(run())
+
+    assert (before["Squats"]["weight_lifted"],before["Squats"]["repetitions"],before["PUSHUPS"]["repetitions"])==(80.0,5,25)
+    assert refused.status_code==404
+    assert after_refused==before
+    assert (after["Squats"]["weight_lifted"],after["Squats"]["repetitions"])==(60.0,5)
+    assert (after["PUSHUPS"]["weight_lifted"],after["PUSHUPS"]["repetitions"])==(80.0,25)
+    assert others=={}
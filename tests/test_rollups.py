@@ -0,0 +1,45 @@
+import asyncio
+from benchmarks.common import signup_and_login
+from support import api
+
+
+def exercise(date,exercise_name,**values):
+    return {"date":date,"exercise_name":exercise_name,"sets":3,"repetitions":10,"calories_burned":10.0,"intensity_level":"low",**values}
+
+
+async def daily(http,headers,**params):
+    response=await http.get('/exercises/daily',headers=headers,params={"start":"2024-05-01","end":"2024-05-03",**params})
+
+    return response.json()["days"]
+
+
+def test_edits_move_daily_totals_and_only_the_owner_can_edit(tmp_path):
+    async def run():
+        async with api(tmp_path) as (http,_):
+            owner=await signup_and_login(http,"owner")
+            other=await signup_and_login(http,"other")
+
+            created=(await http.post('/exercises/batch',headers=owner,json=[
+                exercise("2024-05-01T08:00:00","Squats",weight_lifted=50.0),
+                exercise("2024-05-01T18:00:00","PUSHUPS"),
+                exercise("2024-05-02T08:00:00","Plank",calories_burned=4.5),
+            ])).json()["results"]
+            squats=created[0]["id"]
+
+            before=await daily(http,owner)
+            refused=await http.put(f'/exercises/exercise/update/{squats}/',headers=other,json=exercise("2024-05-01T08:00:00","Plank",sets=9))
+            after_refused=await daily(http,owner)
+
+            edited=await http.put(f'/exercises/exercise/update/{squats}/',headers=owner,json=exercise("2024-05-01T08:00:00","PUSHUPS",sets=5))
+
+            return before,refused,after_refused,edited,await daily(http,owner),await daily(http,owner,exercise_name="Squats"),await daily(http,owner,exercise_name="PUSHUPS")
+
+    before,refused,after_refused,edited,after,squats,pushups=asyncio.run(run())
+
+    assert [(day["day"],day["exercises"],day["sets"],day["calories_burned"]) for day in before]==[("2024-05-01",2,6,20.0),("2024-05-02",1,3,4.5)]
+    assert refused.status_code==404
+    assert after_refused==before
+    assert edited.status_code==200
+    assert [(day["day"],day["exercises"],day["sets"]) for day in after]==[("2024-05-01",2,8),("2024-05-02",1,3)]
+    assert [day["exercises"] for day in squats if day["exercises"]]==[]
+    assert [(day["day"],day["exercises"],day["sets"],day["weight_lifted"]) for day in pushups]==[("2024-05-01",2,8,50.0)]
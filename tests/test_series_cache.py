@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime,timedelta,timezone
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from series_cache import series_cache,to_columns
+from benchmarks.common import signup_and_login
+from support import api
+
+
+def exercise(date,**values):
+    return {"date":date,"exercise_name":"PUSHUPS","sets":3,"repetitions":12,"calories_burned":20.0,"intensity_level":"low",**values}
+
+
+def test_offset_dates_become_naive_utc_columns():
+    row={"date":None,"exercise_name":"PUSHUPS","intensity_level":"low","sets":3,"repetitions":12,"weight_lifted":None,"distance_covered":None,"calories_burned":20.0}
+    aware=to_columns([{**row,"date":datetime(2024,5,1,10,tzinfo=timezone(timedelta(hours=2)))}],[1])
+    naive=to_columns([{**row,"date":datetime(2024,5,1,8)}],[1])
+
+    assert aware["date"].tolist()==naive["date"].tolist()
+
+
+def test_appended_columns_match_a_rebuild_from_the_database(tmp_path):
+    async def run():
+        async with api(tmp_path) as (http,engine):
+            headers=await signup_and_login(http,"series")
+            factory=sessionmaker(bind=engine,class_=AsyncSession,expire_on_commit=False)
+
+            await http.post('/exercises/exercise',headers=headers,json=exercise("2024-05-01T06:00:00"))
+            await http.get('/exercises/trends',headers=headers)
+            appends=series_cache.appends
+
+            await http.post('/exercises/exercise',headers=headers,json=exercise("2024-05-02T01:30:00+05:00",sets=4))
+            await http.post('/exercises/batch',headers=headers,json=[
+                exercise("2024-05-02T23:30:00-03:00",sets=5),
+                exercise("2024-05-03T07:00:00",sets=6),
+                exercise("2024-05-03T09:00:00Z",sets=7,weight_lifted=20.0),
+            ])
+
+            async with factory() as session:
+                assert series_cache.appends==appends+2
+                appended={column:values.copy() for column,values in (await series_cache.get(session,1)).items()}
+                series_cache.invalidate(1)
+                rebuilt=await series_cache.get(session,1)
+
+            return appended,rebuilt
+
+    appended,rebuilt=asyncio.run(run())
+
+    assert len(appended["id"])==5
+    order=np.argsort(appended["id"])
+
+    for column,values in rebuilt.items():
+        np.testing.assert_array_equal(appended[column][order],values[np.argsort(rebuilt["id"])],err_msg=column)
@@ -1,19 +1,43 @@
-from fastapi import APIRouter,Depends,status
+import json
+import os
+from datetime import datetime,date,timedelta
+from typing import Optional
+from fastapi import APIRouter,Depends,status,Request,Query,Response,File,UploadFile
 from fastapi.exceptions import HTTPException
 from fastapi_jwt_auth import AuthJWT
-from models import User,Exercise
-from schemas import WorkoutResponseModel
-from database import Session,engine
-from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+from models import Exercise
+from schemas import WorkoutResponseModel,ExerciseResponseModel,IngestAcceptedModel,ExercisePageModel,SummaryPeriod,ChartMetric,ChartFormat,ExportFormat,LeaderboardPeriod
+from database import get_db,get_read_db
+from charts import get_chart,MEDIA_TYPES
+import export
+from crud import get_cached_user,exercise_row,exercise_values,exercise_dict,insert_exercises,exercise_summary,update_rollups,replace_rollups,update_records,replace_records,bump_exercise_versions,personal_records,daily_totals,list_exercises,stream_exercises
+from ingest import ingestor,IngestQueueFull,IngestNotRunning,EXERCISE_INGEST_MODE
+from csv_import import importer,ImportTooLarge,IMPORT_MAX_BYTES
+from series_cache import series_cache,trend_stats,EXERCISE_CODES
+from leaderboard import leaderboard,LEADERBOARD_MAX_LIMIT
+from query_budget import query_budget
+from partitions import exercise_partitions
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import ORJSONResponse,StreamingResponse
+
+#page size limits of /exercises/mine
+EXERCISE_PAGE_DEFAULT=50
+EXERCISE_PAGE_MAX=500
+
+#largest number of exercises accepted by one batch request
+EXERCISE_BATCH_MAX_ITEMS=int(os.getenv("EXERCISE_BATCH_MAX_ITEMS","10000"))
+
 
 exercise_router=APIRouter(
     prefix="/exercises",
-    tags=['exercises']
+    tags=['exercises'],
+    default_response_class=ORJSONResponse
 )
 
 
-session=Session(bind=engine)
-
 @exercise_router.get('/')
 async def hello(Authorize:AuthJWT=Depends()):
 
@@ -33,8 +57,13 @@ async def hello(Authorize:AuthJWT=Depends()):
     return {"message":"Hello World"}
 
 
-@exercise_router.post('/exercise',status_code=status.HTTP_201_CREATED)
-async def load_exercise(model:WorkoutResponseModel,Authorize:AuthJWT=Depends()):
+@exercise_router.post('/exercise',
+    status_code=status.HTTP_201_CREATED,
+    response_model=ExerciseResponseModel,
+    responses={status.HTTP_202_ACCEPTED:{"model":IngestAcceptedModel}}
+)
+@query_budget(6)
+async def load_exercise(model:WorkoutResponseModel,Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
     """
         ## Entering an exercise activity
         This requires the following
@@ -48,8 +77,9 @@ async def load_exercise(model:WorkoutResponseModel,Authorize:AuthJWT=Depends()):
             distance_covered =float
             calories_burned =float
             intensity_level =str
-           
-    
+
+        With EXERCISE_INGEST_MODE=write_behind the exercise is written to the
+        ingest log and queued, and the route answers 202 with its sequence number
     """
 
 
@@ -64,14 +94,35 @@ async def load_exercise(model:WorkoutResponseModel,Authorize:AuthJWT=Depends()):
 
     current_user=Authorize.get_jwt_subject()
 
-    user=session.query(User).filter(User.username==current_user).first()
+    user=await get_cached_user(session,current_user)
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    if EXERCISE_INGEST_MODE=="write_behind":
+        try:
+            seq=await ingestor.submit(exercise_row(model,user.id))
+
+        except IngestQueueFull:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Ingest queue is full, try again later"
+            )
+
+        except IngestNotRunning:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Ingest writer is not running, try again later"
+            )
+
+        return ORJSONResponse({"status":"accepted","seq":seq},status_code=status.HTTP_202_ACCEPTED)
 
 
     new_exercise=Exercise(
         exercise_name=model.exercise_name,
         sets=model.sets,
         date=model.date,
-        user_id=model.user_id,
+        user_id=user.id,
         repetitions=model.repetitions,
         weight_lifted=model.weight_lifted,
         distance_covered=model.distance_covered,
@@ -80,14 +131,20 @@ async def load_exercise(model:WorkoutResponseModel,Authorize:AuthJWT=Depends()):
 
     )   
 
-    new_exercise.user=user
-
     session.add(new_exercise)
 
-    session.commit()
+    await update_rollups(session,[exercise_row(model,user.id)])
+    await update_records(session,[exercise_row(model,user.id)])
+    versions=await bump_exercise_versions(session,[user.id])
+
+    await session.commit()
+
+    series_cache.append([exercise_row(model,user.id)],[new_exercise.id])
+    leaderboard.record([exercise_row(model,user.id)],versions=versions)
 
 
     response={
+        "id":new_exercise.id,
         "exercise_name":new_exercise.exercise_name,
         "sets":new_exercise.sets,
         "user_id":new_exercise.user_id,
@@ -100,8 +157,632 @@ async def load_exercise(model:WorkoutResponseModel,Authorize:AuthJWT=Depends()):
 
     }
 
-    return jsonable_encoder(response)
+    return ORJSONResponse(response,status_code=status.HTTP_201_CREATED)
+
+
+async def _read_batch(request:Request):
+    """
+        Yields the raw items of a batch body, either a JSON array or NDJSON lines
+    """
+    content_type=request.headers.get("content-type","")
+
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buffer=b""
+
+        async for chunk in request.stream():
+            buffer+=chunk
+            *lines,buffer=buffer.split(b"\n")
+
+            for line in lines:
+                if line.strip():
+                    yield line
+
+        if buffer.strip():
+            yield buffer
+
+        return
+
+    try:
+        items=json.loads(await request.body())
+
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Body must be a JSON array or NDJSON"
+        )
+
+    if not isinstance(items,list):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Body must be a JSON array or NDJSON"
+        )
+
+    for item in items:
+        yield item
+
+
+@exercise_router.post('/batch')
+@query_budget(repeats=None)
+async def load_exercise_batch(request:Request,Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
+    """
+        ## Entering many exercise activities at once
+        This takes a JSON array of exercises, or one exercise per line when sent as
+        `application/x-ndjson`. Each item has the same fields as `/exercises/exercise`.
+
+        Valid items are inserted in a single transaction, invalid ones are skipped.
+        The response lists the outcome of every item by its position in the body.
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    current_user=Authorize.get_jwt_subject()
+
+    user=await get_cached_user(session,current_user)
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    results=[]
+    rows=[]
+    positions=[]
+
+    async for item in _read_batch(request):
+        index=len(results)
+
+        if index>=EXERCISE_BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"A batch can hold at most {EXERCISE_BATCH_MAX_ITEMS} exercises"
+            )
+
+        try:
+            if isinstance(item,bytes):
+                item=json.loads(item)
+
+            model=WorkoutResponseModel.parse_obj(item)
+
+        except ValueError as e:
+            errors=e.errors() if isinstance(e,ValidationError) else [{"msg":"Invalid JSON"}]
+            results.append({"index":index,"status":"invalid","errors":errors})
+            continue
+
+        results.append({"index":index,"status":"created"})
+        rows.append(exercise_row(model,user.id))
+        positions.append(index)
+
+    ids,versions=await insert_exercises(session,rows)
+
+    await session.commit()
+
+    series_cache.append(rows,ids)
+    leaderboard.record(rows,versions=versions)
+
+    for index,exercise_id in zip(positions,ids):
+        results[index]["id"]=exercise_id
+
+    response={
+        "created":len(rows),
+        "invalid":len(results)-len(rows),
+        "results":results
+    }
+
+    return ORJSONResponse(response)
+
+
+@exercise_router.post('/import',status_code=status.HTTP_202_ACCEPTED)
+@query_budget(1)
+async def import_exercises(file:UploadFile=File(...),Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
+    """
+        ## Importing exercise history from a CSV file
+        This takes a CSV upload with a header row naming the exercise fields
+        (`date`, `exercise_name` and `sets` are required) and imports it in the
+        background. It returns a job id; follow it on `/exercises/import/{job_id}`.
+        Invalid rows are skipped and listed in `/exercises/import/{job_id}/errors`.
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    try:
+        upload_path=await importer.spool(file)
+
+    except ImportTooLarge:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"An import can be at most {IMPORT_MAX_BYTES} bytes"
+        )
+
+    job=importer.submit(user.id,file.filename,upload_path)
+
+    return ORJSONResponse(job.to_dict(),status_code=status.HTTP_202_ACCEPTED)
+
+
+@exercise_router.get('/import/{job_id}')
+@query_budget(1)
+async def get_import_status(job_id:str,Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
+    """
+        ## Progress of a CSV import
+        This returns the status of an import job and its row counts
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    job=importer.get(job_id,user.id)
+
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+            detail="Import job not found"
+        )
+
+    return ORJSONResponse(job.to_dict())
+
+
+@exercise_router.get('/import/{job_id}/errors')
+@query_budget(1)
+async def get_import_errors(job_id:str,Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
+    """
+        ## Error report of a CSV import
+        This returns a CSV with the line number, the validation errors and the
+        original content of every rejected row
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    job=importer.get(job_id,user.id)
+
+    if job is None or job.report_path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+            detail="No error report for this import"
+        )
+
+    def read_report():
+        with open(job.report_path,"rb") as report:
+            while True:
+                data=report.read(64*1024)
+
+                if not data:
+                    break
+
+                yield data
+
+    return StreamingResponse(read_report(),
+        media_type="text/csv",
+        headers={"Content-Disposition":f'attachment; filename="import-{job.id}-errors.csv"'}
+    )
+
+
+@exercise_router.post('/ingest/flush')
+async def flush_ingest(Authorize:AuthJWT=Depends()):
+    """
+        ## Flushing the write-behind queue
+        This waits until every exercise accepted so far is committed to the database
+        or set aside in the dead-letter file. Every exercise up to `committed_seq`
+        is in the database, except the ones listed in `dead_lettered_seqs`.
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    return await ingestor.flush()
+
+
+@exercise_router.get('/ingest/health')
+async def ingest_health(Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
+    """
+        ## State of the write-behind ingestor
+        This returns the queue depth, the submitted, processed and committed sequence numbers,
+        the log size and the last error.
+        It can be accessed by admins only
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None or not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="You are not an admin"
+        )
+
+    return ingestor.health()
+
+
+
+@exercise_router.get('/summary')
+@query_budget(2)
+async def get_exercise_summary(period:Optional[SummaryPeriod]=None,
+        start:Optional[datetime]=None,
+        end:Optional[datetime]=None,
+        Authorize:AuthJWT=Depends(),
+        session:AsyncSession=Depends(get_read_db)):
+    """
+        ## Summary of the current user's exercises
+        This returns the count, sum and average of `calories_burned`, `distance_covered`
+        and `weight_lifted`, grouped by `exercise_name` and `intensity_level`.
+        - period : optional `day`, `week` (labelled with its Monday) or `month` to also group by date
+        - start, end : optional datetimes, `start` inclusive and `end` exclusive
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    groups=await exercise_summary(session,user.id,
+        period=period.value if period else None,
+        start=start,
+        end=end
+    )
+
+    response={
+        "period":period.value if period else None,
+        "start":start,
+        "end":end,
+        "groups":groups
+    }
+
+    return ORJSONResponse(response)
+
+
+@exercise_router.get('/daily')
+@query_budget(2)
+async def get_daily_totals(start:Optional[date]=None,
+        end:Optional[date]=None,
+        exercise_name:Optional[str]=None,
+        Authorize:AuthJWT=Depends(),
+        session:AsyncSession=Depends(get_read_db)):
+    """
+        ## Daily totals of the current user
+        This returns per day totals of exercises, sets, repetitions, calories, distance
+        and weight, read from the daily rollups.
+        - start, end : optional dates, both inclusive. Defaults to the last 90 days
+        - exercise_name : optional, only count this exercise
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    end=end or date.today()
+    start=start or end-timedelta(days=89)
+
+    days=await daily_totals(session,user.id,start,end,exercise_name=exercise_name)
+
+    return ORJSONResponse({"start":start,"end":end,"days":days})
+
+
+@exercise_router.get('/mine',response_model=ExercisePageModel)
+@query_budget(5)
+async def list_my_exercises(limit:int=Query(EXERCISE_PAGE_DEFAULT,ge=1,le=EXERCISE_PAGE_MAX),
+        cursor:Optional[str]=None,
+        exercise_name:Optional[str]=None,
+        intensity_level:Optional[str]=None,
+        Authorize:AuthJWT=Depends(),
+        session:AsyncSession=Depends(get_db)):
+    """
+        ## List the current user's exercises
+        This returns one page of exercises, newest first, and a `next_cursor`.
+        Pass `next_cursor` back as `cursor` to get the following page; it is null on the last page.
+        - limit : page size
+        - exercise_name, intensity_level : optional filters
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    try:
+        items,next_cursor=await list_exercises(session,user.id,limit,
+            cursor=cursor,
+            exercise_name=exercise_name,
+            intensity_level=intensity_level
+        )
+
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+    return ORJSONResponse({"items":items,"next_cursor":next_cursor})
+
+
+@exercise_router.get('/export')
+@query_budget(2)
+async def export_my_exercises(format:ExportFormat=ExportFormat.csv,
+        start:Optional[datetime]=None,
+        end:Optional[datetime]=None,
+        gzip:bool=False,
+        Authorize:AuthJWT=Depends(),
+        session:AsyncSession=Depends(get_read_db)):
+    """
+        ## Export the current user's exercises
+        This streams every exercise, oldest first, as CSV or NDJSON. Rows are read
+        from a server-side cursor and encoded chunk by chunk, so the export never
+        holds more than one chunk in memory.
+        - format : `csv` or `ndjson`
+        - start, end : optional, only export exercises with start <= date < end
+        - gzip : compress the file (`.gz`)
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    body=export.ENCODERS[format.value](stream_exercises(session,user.id,start=start,end=end))
+    filename=f"exercises-{user.username}.{format.value}"
+    media_type=export.MEDIA_TYPES[format.value]
+
+    if gzip:
+        body=export.gzip_stream(body)
+        filename+=".gz"
+        media_type="application/gzip"
+
+    return StreamingResponse(body,
+        media_type=media_type,
+        headers={"Content-Disposition":f'attachment; filename="{filename}"'}
+    )
+
+
+@exercise_router.get('/records')
+@query_budget(2)
+async def get_personal_records(Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_read_db)):
+    """
+        ## Personal records of the current user
+        This returns the best weight lifted, repetitions and distance covered for
+        every exercise the user has done, read from the personal records table
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    return ORJSONResponse({"records":await personal_records(session,user.id)})
+
+
+@exercise_router.get('/leaderboard')
+@query_budget(2)
+async def get_leaderboard(period:LeaderboardPeriod=LeaderboardPeriod.week,
+        limit:int=Query(LEADERBOARD_MAX_LIMIT,ge=1,le=LEADERBOARD_MAX_LIMIT),
+        Authorize:AuthJWT=Depends(),
+        session:AsyncSession=Depends(get_read_db)):
+    """
+        ## Calories leaderboard
+        This returns the users who burned the most calories over the last 7 days
+        (`week`) or 30 days (`month`), and the current user's rank. It is served from
+        memory and never groups the exercises table.
+        - period : `week` or `month`
+        - limit : number of users returned, at most 100
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    return ORJSONResponse(await leaderboard.standings(period.value,limit,user.id))
+
+
+@exercise_router.get('/trends')
+@query_budget(3)
+async def get_trends(days:int=Query(90,ge=1,le=3660),
+        window:int=Query(7,ge=1,le=365),
+        exercise_name:Optional[str]=None,
+        Authorize:AuthJWT=Depends(),
+        session:AsyncSession=Depends(get_read_db)):
+    """
+        ## Training trends of the current user
+        This returns a rolling average of daily calories, weekly volume
+        (sets x repetitions x weight) and all-time bests per exercise. It is computed
+        from the user's columnar history cache, without querying the exercises table.
+        - days : number of days reported, ending today
+        - window : rolling average window in days
+        - exercise_name : optional, only count this exercise
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    if exercise_name is not None and exercise_name not in EXERCISE_CODES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"exercise_name must be one of {', '.join(EXERCISE_CODES)}"
+        )
+
+    columns=await series_cache.get(session,user.id)
+
+    return ORJSONResponse(trend_stats(columns,days,window,exercise_name=exercise_name,today=date.today()))
+
+
+@exercise_router.get('/chart')
+@query_budget(2)
+async def get_progress_chart(request:Request,
+        metric:ChartMetric=ChartMetric.calories_burned,
+        start:Optional[date]=None,
+        end:Optional[date]=None,
+        format:ChartFormat=ChartFormat.png,
+        Authorize:AuthJWT=Depends(),
+        session:AsyncSession=Depends(get_read_db)):
+    """
+        ## Progress chart of the current user
+        This returns a PNG or SVG chart of a daily total, built from the daily rollups.
+        Charts are cached by their content and only redrawn when the data changes.
+        - metric : the daily total to plot
+        - start, end : optional dates, both inclusive. Defaults to the last 90 days
+        - format : `png` or `svg`
+    """
+
+    try:
+        Authorize.jwt_required()
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
 
+    end=end or date.today()
+    start=start or end-timedelta(days=89)
+
+    totals=await daily_totals(session,user.id,start,end)
+
+    days=[row["day"].isoformat() for row in totals]
+    values=[row[metric.value] for row in totals]
+
+    key,image=await get_chart(user.id,metric.value,start,end,format.value,days,values)
+
+    etag=f'"{key}"'
+
+    if request.headers.get("if-none-match")==etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED,headers={"ETag":etag})
+
+    return Response(content=image,media_type=MEDIA_TYPES[format.value],headers={"ETag":etag})
 
 
     
@@ -225,8 +906,9 @@ async def load_exercise(model:WorkoutResponseModel,Authorize:AuthJWT=Depends()):
 #     )
 
 
-@exercise_router.put('/exercise/update/{id}/')
-async def update_user_details(id:int,model:WorkoutResponseModel,Authorize:AuthJWT=Depends()):
+@exercise_router.put('/exercise/update/{id}/',response_model=ExerciseResponseModel)
+@query_budget(11)
+async def update_user_details(id:int,model:WorkoutResponseModel,Authorize:AuthJWT=Depends(),session:AsyncSession=Depends(get_db)):
     """
         ## Updating exercise details
         This updates exercise details and requires the following fields
@@ -241,22 +923,53 @@ async def update_user_details(id:int,model:WorkoutResponseModel,Authorize:AuthJW
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail="Invalid Token")
 
-    exercise_to_update=session.query(Exercise).filter(Exercise.id==id).first()
+    user=await get_cached_user(session,Authorize.get_jwt_subject())
+
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token"
+        )
+
+    #another user's exercise is not found either, so ids of others cannot be probed
+    exercise_to_update=await session.scalar(select(Exercise).where(Exercise.id==id,Exercise.user_id==user.id))
+
+    if exercise_to_update is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+            detail="No exercise with such id"
+        )
+
+    if exercise_partitions.read_only(exercise_to_update.date,exercise_to_update.id):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+            detail="Exercises of archived months cannot be edited"
+        )
+
+    previous=exercise_values(exercise_to_update)
 
     exercise_to_update.exercise_name=model.exercise_name
     exercise_to_update.sets=model.sets
 
-    session.commit()
+    #a month being archived is frozen by a trigger before every process knows its partition
+    try:
+        await session.flush()
+
+    except IntegrityError:
+        await session.rollback()
 
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+            detail="Exercises of archived months cannot be edited"
+        )
 
-    response={
-                "exercise_name":exercise_to_update.exercise_name,
-                "sets":exercise_to_update.sets,
-              
-               
-            }
+    await replace_rollups(session,previous,exercise_values(exercise_to_update))
+    await replace_records(session,previous,exercise_values(exercise_to_update))
+    versions=await bump_exercise_versions(session,[exercise_to_update.user_id])
+
+    await session.commit()
+
+    series_cache.invalidate(exercise_to_update.user_id)
+    leaderboard.record([previous],sign=-1,versions=versions)
+    leaderboard.record([exercise_values(exercise_to_update)],versions=versions)
 
-    return jsonable_encoder(exercise_to_update)
+    return ORJSONResponse(exercise_dict(exercise_to_update))
 
     
 